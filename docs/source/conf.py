@@ -114,7 +114,7 @@ MOCK_MODULES = [
                 'skimage', 'skimage.transform', 'skimage.io', 'skimage.filters', 'skimage.morphology', 'visvis', 'pyevtk', 'pyevtk.hl', 
                 'scipy', 'scipy.optimize', 'scipy.sparse', 'scipy.sparse.linalg', 'scipy.ndimage', 'scipy.ndimage.filters', 'dolfin',
                 'pumapy.physicsmodels.isotropic_conductivity_utils', 'pumapy.physicsmodels.anisotropic_conductivity_utils', 
-                'pumapy.physicsmodels.elasticity_utils', 'pumapy.generation.tpms_utils', 'pumapy.utilities.libPuMA'
+                'pumapy.physicsmodels.elasticity_utils', 'pumapy.utilities.libPuMA'
                 ]
 
 for module_name in MOCK_MODULES:
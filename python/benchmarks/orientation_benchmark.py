@@ -0,0 +1,33 @@
+""" Timing and accuracy of the orientation methods on the fibers with known orientation of the test data
+
+Run from this folder: python orientation_benchmark.py
+"""
+import os
+import time
+import pumapy as puma
+
+
+def run_benchmark(path):
+    ws = puma.import_bin(path)
+    methods = {"structure tensor": lambda w: puma.compute_orientation_st(w, 0.7, 1.4, (128, 255)),
+               "structure tensor (blocks)": lambda w: puma.compute_orientation_st(w, 0.7, 1.4, (128, 255), blocks=True),
+               "ray casting": lambda w: puma.compute_orientation_rc(w, (128, 255), 10),
+               "artificial flux": lambda w: puma.compute_orientation_af(w, (128, 255))}
+    results = []
+    for name, method in methods.items():
+        ws_method = ws.copy()
+        start = time.time()
+        method(ws_method)
+        elapsed = time.time() - start
+        _, mean, std = puma.compute_angular_differences(ws.matrix, ws_method.orientation, ws.orientation, (128, 255))
+        results.append((name, elapsed, mean, std))
+
+    print("\n{:<26}{:>10}{:>10}{:>10}".format("method", "time [s]", "mean", "std"))
+    for name, elapsed, mean, std in results:
+        print("{:<26}{:>10.2f}{:>10.2f}{:>10.2f}".format(name, elapsed, mean, std))
+    return results
+
+
+if __name__ == '__main__':
+    run_benchmark(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests", "testdata",
+                               "fibers_with_orientation.pumapy"))
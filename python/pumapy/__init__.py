@@ -21,6 +21,8 @@ from pumapy.utilities.isosurface import generate_isosurface
 from pumapy.utilities.detect_env import detect_env
 from pumapy.utilities.property_maps import IsotropicConductivityMap, AnisotropicConductivityMap, ElasticityMap
 from pumapy.utilities.boundary_conditions import ConductivityBC, ElasticityBC
+from pumapy.utilities.orientation_encoding import encode_orientation, decode_orientation
+from pumapy.utilities.parallel import remove_field
 
 # input/output
 from pumapy.io.input import import_3Dtiff, import_bin
@@ -33,16 +35,15 @@ except ImportError:
 # material properties
 from pumapy.materialproperties.surfacearea import compute_surface_area
 from pumapy.materialproperties.volumefraction import compute_volume_fraction
+from pumapy.materialproperties.partialvolume import compute_partial_volume
 from pumapy.materialproperties.mean_intercept_length import compute_mean_intercept_length
-from pumapy.materialproperties.orientation import compute_orientation_st, compute_angular_differences
+from pumapy.materialproperties.orientation import (compute_orientation_st, compute_orientation_rc, compute_orientation_af,
+                                                   compute_angular_differences)
 from pumapy.materialproperties.conductivity import compute_thermal_conductivity, compute_electrical_conductivity
 from pumapy.materialproperties.tortuosity import compute_continuum_tortuosity
 from pumapy.materialproperties.elasticity import compute_elasticity, compute_stress_analysis
 from pumapy.materialproperties.radiation import compute_radiation, compute_extinction_coefficients
-try:
-    from pumapy.materialproperties.permeability import compute_permeability
-except ImportError:
-    pass
+from pumapy.materialproperties.permeability import compute_permeability
 
 # filtering
 from pumapy.filters.filters import (filter_median, filter_gaussian, filter_edt, filter_mean,
@@ -54,7 +55,10 @@ from pumapy.generation.sphere import get_sphere
 from pumapy.generation.random_spheres import generate_random_spheres
 from pumapy.generation.generate_sphere import generate_sphere
 from pumapy.generation.generate_2d_square_array import generate_2d_square_array
+from pumapy.generation.fiber_array import generate_fiber_array
 from pumapy.generation.random_fibers import generate_random_fibers
+from pumapy.generation.fibers import generate_fibers, generate_prescribed_fibers
+from pumapy.generation.ensemble import generate_ensemble
 try:
     from pumapy.generation.weave_3mdcp.weave_3mdcp import generate_3mdcp
 except ImportError:  # import it only if installed
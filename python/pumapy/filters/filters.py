@@ -1,19 +1,22 @@
 from skimage.filters import gaussian
-from scipy.ndimage import distance_transform_edt, median_filter
+from scipy.ndimage import distance_transform_edt, median_filter, gaussian_filter
 from scipy.ndimage.filters import uniform_filter
-from skimage.morphology import erosion, dilation, opening, closing, ball
+from skimage.morphology import erosion, dilation, ball
 from pumapy import Workspace
 from pumapy.utilities.logger import print_warning
+from pumapy.utilities.parallel import filter_in_slabs
 import numpy as np
 
 
-def filter_median(ws, size):
+def filter_median(ws, size, workers=None):
     """ 3D Median filter
 
     :param ws: input workspace
     :type ws: Workspace
     :param size: size of window
     :type size: int
+    :param workers: number of threads used to filter the domain in slabs (None uses all cores)
+    :type workers: int, optional
     :return: True if successful, False otherwise.
     :rtype: bool
     """
@@ -24,11 +27,11 @@ def filter_median(ws, size):
     ws.log.log_line("Window Size: " + str(size))
     ws.log.write_log()
 
-    ws.matrix = median_filter(ws.matrix, size)
+    filter_in_slabs(ws.matrix, lambda block: median_filter(block, size), size // 2 + 1, workers)
     return True
 
 
-def filter_gaussian(ws, sigma=1, apply_on_orientation=False):
+def filter_gaussian(ws, sigma=1, apply_on_orientation=False, workers=None):
     """ 3D Gaussian filter
 
         :param ws: input workspace
@@ -37,6 +40,8 @@ def filter_gaussian(ws, sigma=1, apply_on_orientation=False):
         :type sigma: int
         :param apply_on_orientation: specify whether to apply filter on orientation field
         :type apply_on_orientation: bool, optional
+        :param workers: number of threads used to filter the domain in slabs (None uses all cores)
+        :type workers: int, optional
         :return: True if successful, False otherwise.
         :rtype: bool
     """
@@ -47,7 +52,9 @@ def filter_gaussian(ws, sigma=1, apply_on_orientation=False):
     ws.log.log_line("Sigma: " + str(sigma))
     ws.log.write_log()
 
-    ws.matrix = gaussian(ws.matrix, sigma=sigma, preserve_range=True).astype(np.uint16)
+    # same kernel as skimage.filters.gaussian, but only a slab at a time is converted to float
+    filter_in_slabs(ws.matrix, lambda block: gaussian_filter(block.astype(float), sigma, mode='nearest', truncate=4.0),
+                    int(4.0 * np.max(sigma) + 0.5), workers)
 
     if apply_on_orientation:
         if ws.orientation.shape[:3] == ws.matrix.shape:
@@ -83,13 +90,15 @@ def filter_edt(ws, cutoff):
     return True
 
 
-def filter_mean(ws, size=5):
+def filter_mean(ws, size=5, workers=None):
     """ 3D Mean filter.
 
     :param ws: input workspace
     :type ws: Workspace
     :param size: size of window
     :type size: int, optional
+    :param workers: number of threads used to filter the domain in slabs (None uses all cores)
+    :type workers: int, optional
     :return: True if successful, False otherwise.
     :rtype: bool
     """
@@ -100,11 +109,11 @@ def filter_mean(ws, size=5):
     ws.log.log_line("Window Size: " + str(size))
     ws.log.write_log()
 
-    ws.matrix = uniform_filter(ws.matrix, size)
+    filter_in_slabs(ws.matrix, lambda block: uniform_filter(block, size), size // 2 + 1, workers)
     return True
 
 
-def filter_erode(ws, cutoff, size=5):
+def filter_erode(ws, cutoff, size=5, method='edt', workers=None):
     """ 3D morphological erosion filter.
 
     :param ws: input workspace
@@ -113,6 +122,11 @@ def filter_erode(ws, cutoff, size=5):
     :type cutoff: tuple(int, int)
     :param size: size of the spherical windows used
     :type size: int, optional
+    :param method: 'edt' (default) uses the Euclidean distance transform, with a cost per voxel independent of size,
+        'ball' applies the spherical structuring element directly. Both give identical output
+    :type method: string, optional
+    :param workers: number of threads used to filter the domain in slabs (None uses all cores)
+    :type workers: int, optional
     :return: True if successful, False otherwise.
     :rtype: bool
     """
@@ -125,11 +139,11 @@ def filter_erode(ws, cutoff, size=5):
 
     ws.binarize_range(cutoff)
 
-    ws.matrix = erosion(ws.matrix, ball(size))
+    _apply_morphology(ws.matrix, 'erosion', size, method, workers)
     return True
 
 
-def filter_dilate(ws, cutoff, size=5):
+def filter_dilate(ws, cutoff, size=5, method='edt', workers=None):
     """ 3D morphological dilation filter.
 
     :param ws: input workspace
@@ -138,6 +152,11 @@ def filter_dilate(ws, cutoff, size=5):
     :type cutoff: tuple(int, int)
     :param size: size of the spherical windows used
     :type size: int, optional
+    :param method: 'edt' (default) uses the Euclidean distance transform, with a cost per voxel independent of size,
+        'ball' applies the spherical structuring element directly. Both give identical output
+    :type method: string, optional
+    :param workers: number of threads used to filter the domain in slabs (None uses all cores)
+    :type workers: int, optional
     :return: True if successful, False otherwise.
     :rtype: bool
     """
@@ -150,11 +169,11 @@ def filter_dilate(ws, cutoff, size=5):
 
     ws.binarize_range(cutoff)
 
-    ws.matrix = dilation(ws.matrix, ball(size))
+    _apply_morphology(ws.matrix, 'dilation', size, method, workers)
     return True
 
 
-def filter_opening(ws, cutoff, size=5):
+def filter_opening(ws, cutoff, size=5, method='edt', workers=None):
     """ 3D morphological opening filter (i.e. dilation first and then erosion).
 
     :param ws: input workspace
@@ -163,6 +182,11 @@ def filter_opening(ws, cutoff, size=5):
     :type cutoff: tuple(int, int)
     :param size: size of the spherical windows used
     :type size: int, optional
+    :param method: 'edt' (default) uses the Euclidean distance transform, with a cost per voxel independent of size,
+        'ball' applies the spherical structuring element directly. Both give identical output
+    :type method: string, optional
+    :param workers: number of threads used to filter the domain in slabs (None uses all cores)
+    :type workers: int, optional
     :return: True if successful, False otherwise.
     :rtype: bool
     """
@@ -175,11 +199,11 @@ def filter_opening(ws, cutoff, size=5):
 
     ws.binarize_range(cutoff)
 
-    ws.matrix = opening(ws.matrix, ball(size))
+    _apply_morphology(ws.matrix, 'opening', size, method, workers)
     return True
 
 
-def filter_closing(ws, cutoff, size=5):
+def filter_closing(ws, cutoff, size=5, method='edt', workers=None):
     """ 3D morphological closing filter (i.e. erosion first and then dilation).
 
     :param ws: input workspace
@@ -188,6 +212,11 @@ def filter_closing(ws, cutoff, size=5):
     :type cutoff: tuple(int, int)
     :param size: size of the spherical windows used
     :type size: int, optional
+    :param method: 'edt' (default) uses the Euclidean distance transform, with a cost per voxel independent of size,
+        'ball' applies the spherical structuring element directly. Both give identical output
+    :type method: string, optional
+    :param workers: number of threads used to filter the domain in slabs (None uses all cores)
+    :type workers: int, optional
     :return: True if successful, False otherwise.
     :rtype: bool
     """
@@ -200,5 +229,46 @@ def filter_closing(ws, cutoff, size=5):
 
     ws.binarize_range(cutoff)
 
-    ws.matrix = closing(ws.matrix, ball(size))
+    _apply_morphology(ws.matrix, 'closing', size, method, workers)
     return True
+
+
+def _edt_erosion(block, radius):
+    # a voxel survives if no 0 voxel lies within radius (i.e. inside the ball footprint)
+    if np.all(block):
+        return block
+    return (distance_transform_edt(block) > radius).astype(block.dtype)
+
+
+def _edt_dilation(block, radius):
+    # a voxel is set if a 1 voxel lies within radius (i.e. inside the ball footprint)
+    if not np.any(block):
+        return block
+    return (distance_transform_edt(block == 0) <= radius).astype(block.dtype)
+
+
+def _apply_morphology(matrix, operation, size, method, workers):
+    if method == 'edt':
+        erode = lambda block: _edt_erosion(block, size)
+        dilate = lambda block: _edt_dilation(block, size)
+        halo = size + 1
+    elif method == 'ball':
+        footprint = ball(size)
+        erode = lambda block: erosion(block, footprint)
+        dilate = lambda block: dilation(block, footprint)
+        halo = size
+    else:
+        raise Exception("Unrecognized method, options are: 'edt', 'ball'.")
+
+    if operation == 'erosion':
+        func = erode
+    elif operation == 'dilation':
+        func = dilate
+    elif operation == 'opening':
+        func = lambda block: dilate(erode(block))
+        halo *= 2
+    else:  # closing
+        func = lambda block: erode(dilate(block))
+        halo *= 2
+
+    filter_in_slabs(matrix, func, halo, workers)
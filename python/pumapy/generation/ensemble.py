@@ -0,0 +1,181 @@
+from pumapy.utilities.logger import Logger
+from pumapy.utilities.parallel import get_workers
+from pumapy.materialproperties.volumefraction import compute_volume_fraction
+from pumapy.materialproperties.surfacearea import compute_surface_area
+from pumapy.materialproperties.mean_intercept_length import compute_mean_intercept_length
+from pumapy.io.output import export_bin
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+import numpy as np
+import itertools
+import inspect
+import io
+import os
+
+
+def generate_ensemble(generator, parameters, realizations=1, seed=None, descriptors=('porosity',),
+                      cutoff=(128, 255), workers=None, output_dir=None):
+    """ Generation of an ensemble of random microstructures, with descriptors computed for each realization
+
+    Each realization runs in a worker process, with the global NumPy RNG seeded from its own child of
+    np.random.SeedSequence(seed), so that the results do not depend on the number of workers or on the scheduling.
+    In the workers, the log files are not written and the standard output is discarded, and generators with a workers
+    argument run on a single thread (unless it is set in the parameters), to avoid oversubscribing the cores.
+
+    :param generator: generation function returning a Workspace, e.g. puma.generate_random_spheres. It needs to be
+        picklable (i.e. defined at module level) when workers > 1
+    :type generator: callable
+    :param parameters: keyword arguments of the generator. Either a dict of lists of values, whose Cartesian product
+        is generated, or a list of dicts
+    :type parameters: dict or list(dict)
+    :param realizations: number of realizations for each set of parameters
+    :type realizations: int, optional
+    :param seed: entropy of the seed sequence (a random one is drawn if None)
+    :type seed: int, optional
+    :param descriptors: descriptors computed on each realization, among 'porosity', 'volume_fraction',
+        'surface_area' (specific area), 'mean_intercept_length' (one column per direction), or custom functions as
+        a dict {name: function(Workspace)}
+    :type descriptors: tuple(string) or dict, optional
+    :param cutoff: cutoff of the solid phase, used by the built-in descriptors (e.g. (1, 1) for generate_random_fibers)
+    :type cutoff: tuple(int, int), optional
+    :param workers: number of worker processes (all available cores if None). If 1, runs in the current process,
+        restoring the state of the global NumPy RNG afterwards
+    :type workers: int, optional
+    :param output_dir: directory where each realization is exported as a .pumapy file (not saved if None)
+    :type output_dir: string, optional
+    :return: results table with one row per realization and columns 'realization', 'replicate', the varied
+        parameters, the descriptors (prefixed by 'measured_' if a generator parameter has the same name, e.g.
+        'measured_porosity' when generating for a list of porosities), and 'path' if output_dir is set
+    :rtype: numpy structured array
+    """
+    if isinstance(parameters, dict):
+        names = list(parameters.keys())
+        grid = [dict(zip(names, values)) for values in itertools.product(*[parameters[n] for n in names])]
+    else:
+        grid = [dict(p) for p in parameters]
+    if len(grid) == 0:
+        raise Exception("Error, empty parameter grid")
+    if realizations < 1:
+        raise Exception("Error, invalid realizations, must be >= 1")
+    if not isinstance(descriptors, dict):
+        for name in descriptors:
+            if name not in _DESCRIPTORS:
+                raise Exception("Error, unrecognized descriptor " + str(name))
+    if output_dir is not None and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # descriptor columns, renamed if a generator parameter has the same name
+    names = list(dict.fromkeys(name for kwargs in grid for name in kwargs))
+    descriptor_columns = {name: 'measured_' + name if name in names else name for name in descriptors}
+
+    workers = min(get_workers(workers), len(grid) * realizations)
+    single_thread = workers > 1 and 'workers' in inspect.signature(generator).parameters
+
+    seeds = np.random.SeedSequence(seed).spawn(len(grid) * realizations)
+    tasks = []
+    for n, (kwargs, replicate) in enumerate(itertools.product(grid, range(realizations))):
+        path = None if output_dir is None else os.path.join(output_dir, "realization_{:05d}.pumapy".format(n))
+        if single_thread and 'workers' not in kwargs:
+            kwargs = dict(kwargs, workers=1)
+        tasks.append((generator, kwargs, seeds[n].generate_state(4), descriptors, descriptor_columns, cutoff, path))
+
+    print("Generating {} realizations on {} workers ... ".format(len(tasks), workers), end='')
+    if workers == 1:
+        # seeding each realization in this process, without changing the caller's global RNG
+        state = np.random.get_state()
+        try:
+            rows = [_run_realization(task) for task in tasks]
+        finally:
+            np.random.set_state(state)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            rows = list(executor.map(_run_realization, tasks, chunksize=max(len(tasks) // (4 * workers), 1)))
+    print("Done")
+
+    # parameters that change within the ensemble, then the descriptors
+    varied = [name for name in names if any(not _equal(kwargs.get(name), grid[0].get(name)) for kwargs in grid)]
+    columns = {'realization': list(range(len(tasks))),
+               'replicate': [replicate for _ in grid for replicate in range(realizations)]}
+    for name in varied:
+        columns[name] = [task[1].get(name) for task in tasks]
+    for name in rows[0][0]:
+        columns[name] = [values[name] for values, _ in rows]
+    if output_dir is not None:
+        columns['path'] = [path for _, path in rows]
+    return _to_table(columns)
+
+
+def _porosity(ws, cutoff):
+    return 1. - compute_volume_fraction(ws, cutoff)
+
+
+def _specific_area(ws, cutoff):
+    return compute_surface_area(ws, cutoff)[1]
+
+
+def _mean_intercept_length(ws, cutoff):
+    # computed in the complementary (void) range of the solid cutoff
+    void_cutoff = (0, cutoff[0] - 1) if cutoff[0] > 0 else (cutoff[1] + 1, np.iinfo(ws.matrix.dtype).max)
+    return compute_mean_intercept_length(ws, void_cutoff)
+
+
+_DESCRIPTORS = {'porosity': _porosity,
+                'volume_fraction': compute_volume_fraction,
+                'surface_area': _specific_area,
+                'mean_intercept_length': _mean_intercept_length}
+
+
+def _run_realization(task):
+    generator, kwargs, seed_state, descriptors, descriptor_columns, cutoff, path = task
+
+    write_to_file = Logger.write_to_file
+    Logger.write_to_file = False
+    try:
+        with redirect_stdout(io.StringIO()):
+            np.random.seed(seed_state)
+            ws = generator(**kwargs)
+
+            values = dict()
+            if isinstance(descriptors, dict):
+                functions = [(name, lambda w, f=function: f(w)) for name, function in descriptors.items()]
+            else:
+                functions = [(name, lambda w, f=_DESCRIPTORS[name]: f(w, cutoff)) for name in descriptors]
+            for name, function in functions:
+                value = function(ws)
+                if np.ndim(value) == 0:
+                    values[descriptor_columns[name]] = value
+                else:
+                    for axis, component in zip('xyz', value):
+                        values[descriptor_columns[name] + '_' + axis] = component
+
+            if path is not None:
+                export_bin(path, ws)
+    finally:
+        Logger.write_to_file = write_to_file
+    return values, path
+
+
+def _equal(a, b):
+    try:
+        return bool(np.all(np.asarray(a) == np.asarray(b)))
+    except (ValueError, TypeError):
+        return a is b
+
+
+def _to_table(columns):
+    arrays = []
+    for name, values in columns.items():
+        if all(isinstance(v, (bool, np.bool_)) for v in values):
+            arrays.append(np.array(values, dtype=bool))
+        elif all(isinstance(v, (int, np.integer)) and not isinstance(v, bool) for v in values):
+            arrays.append(np.array(values, dtype=np.int64))
+        elif all(isinstance(v, (int, float, np.integer, np.floating)) for v in values):
+            arrays.append(np.array(values, dtype=float))
+        else:
+            column = np.empty(len(values), dtype=object)
+            column[:] = values
+            arrays.append(column)
+    table = np.empty(len(arrays[0]), dtype=[(name, a.dtype) for name, a in zip(columns.keys(), arrays)])
+    for name, a in zip(columns.keys(), arrays):
+        table[name] = a
+    return table
@@ -0,0 +1,200 @@
+from pumapy.utilities.workspace import Workspace
+import pumapy.utilities.generic_checks as check
+from pumapy.utilities.logger import print_warning
+from pumapy.utilities.parallel import get_workers, split_slabs, run_in_pool
+from scipy.spatial import cKDTree
+import numpy as np
+
+
+def generate_fiber_array(size, radius, fiber_volume_fraction, packing='hexagonal', coating=0., min_spacing=0.,
+                         phase_ids=(0, 1, 2), orientation=False, periodic=True, max_attempts=100, workers=None):
+    """ Generation of a unidirectional array of coated fibers along z, e.g. for ceramic matrix composites
+
+    The fiber centers are placed in the XY plane on a hexagonal or square lattice, or by random sequential addition
+    with a minimum spacing (which jams when the disks of diameter 2 * (radius + coating) + min_spacing cover about 55%
+    of the plane). Each pixel of the plane is then assigned to its nearest fiber center, and gets the fiber,
+    coating or matrix phase according to its distance from it. The plane is extruded along z as a read-only
+    broadcast view (no copy per slice): use ws.matrix.copy() before modifying it in place.
+
+    :param size: size of 3D domain (x,y,z), or of the 2D plane (x,y) for a single slice
+    :type size: tuple(int, int, int)
+    :param radius: fiber radius in voxels
+    :type radius: float
+    :param fiber_volume_fraction: target volume fraction of the fibers (coating excluded)
+    :type fiber_volume_fraction: float
+    :param packing: 'hexagonal', 'square' or 'random'
+    :type packing: string, optional
+    :param coating: thickness of the coating around the fibers in voxels
+    :type coating: float, optional
+    :param min_spacing: minimum distance between the coatings of neighboring fibers, for random packing
+    :type min_spacing: float, optional
+    :param phase_ids: IDs of the (matrix, coating, fiber) phases
+    :type phase_ids: tuple(int, int, int), optional
+    :param orientation: write the axial direction (0, 0, 1) in the fiber and coating voxels of Workspace.orientation,
+        e.g. for the anisotropic conductivity (also a read-only broadcast view)
+    :type orientation: bool, optional
+    :param periodic: for random packing, wrap the fibers around the domain faces (the lattices are periodic only
+        if the domain is a multiple of their cell)
+    :type periodic: bool, optional
+    :param max_attempts: number of consecutive batches of random candidates without any insertion before the random
+        packing stops
+    :type max_attempts: int, optional
+    :param workers: number of threads used to rasterize the plane (all available cores if None)
+    :type workers: int, optional
+    :return: unidirectional fiber array
+    :rtype: Workspace
+    """
+    generator = GeneratorFiberArray(size, radius, fiber_volume_fraction, packing, coating, min_spacing, phase_ids,
+                                    orientation, periodic, max_attempts, workers)
+
+    generator.error_check()
+
+    generator.log_input()
+    ws = generator.generate()
+    generator.log_output()
+    return ws
+
+
+class GeneratorFiberArray:
+    def __init__(self, size, radius, fiber_volume_fraction, packing='hexagonal', coating=0., min_spacing=0.,
+                 phase_ids=(0, 1, 2), orientation=False, periodic=True, max_attempts=100, workers=None):
+        self._workspace = Workspace()
+        self._size = tuple(size) if len(size) == 3 else tuple(size) + (1,)
+        self._radius = radius
+        self._fiber_volume_fraction = fiber_volume_fraction
+        self._packing = packing
+        self._coating = coating
+        self._min_spacing = min_spacing
+        self._phase_ids = phase_ids
+        self._orientation = orientation
+        self._periodic = periodic and packing == 'random'
+        self._max_attempts = max_attempts
+        self._workers = get_workers(workers)
+
+        # distance between the centers of fibers whose coatings touch, plus the required spacing
+        self._min_distance = 2 * (radius + coating) + (min_spacing if packing == 'random' else 0)
+        self._centers = None
+
+    def generate(self):
+        if self._packing == 'random':
+            self._centers = self._random_centers()
+        else:
+            self._centers = self._lattice_centers()
+        plane = self._rasterize()
+
+        shape = self._size
+        self._workspace.matrix = np.broadcast_to(plane[:, :, np.newaxis], shape)
+        if self._orientation:
+            axial = np.zeros(plane.shape + (3,))
+            axial[plane != self._phase_ids[0], 2] = 1
+            self._workspace.orientation = np.broadcast_to(axial[:, :, np.newaxis], shape + (3,))
+
+        fibers = np.count_nonzero(plane == self._phase_ids[2]) / float(plane.size)
+        print("Generated {} fibers with volume fraction: {}".format(self._centers.shape[0], fibers))
+        return self._workspace
+
+    def _lattice_centers(self):
+        # spacing giving the target volume fraction: one fiber per a^2 (square) or per sqrt(3)/2 a^2 (hexagonal)
+        area = np.pi * self._radius ** 2 / self._fiber_volume_fraction
+        if self._packing == 'square':
+            dx = dy = np.sqrt(area)
+        else:
+            dx = np.sqrt(2 * area / np.sqrt(3))
+            dy = dx * np.sqrt(3) / 2
+        if dx < 2 * (self._radius + self._coating):
+            raise Exception("Error, the coated fibers cannot fit in a {} array with a fiber volume fraction of {}"
+                            .format(self._packing, self._fiber_volume_fraction))
+
+        # lattice extended by one row and column around the domain, so that every pixel sees its nearest fiber
+        rows = np.arange(-1, int(np.ceil(self._size[1] / dy)) + 1)
+        columns = np.arange(-1, int(np.ceil(self._size[0] / dx)) + 2)
+        j, i = np.meshgrid(rows, columns)
+        x = (i + 0.5 + (0.5 * (j % 2) if self._packing == 'hexagonal' else 0)) * dx - 0.5
+        y = (j + 0.5) * dy - 0.5
+        return np.column_stack((x.ravel(), y.ravel()))
+
+    def _random_centers(self):
+        # random sequential addition, with candidates tested by batches against a KD-tree of the accepted fibers
+        plane = np.array(self._size[:2], dtype=float)
+        target = int(np.round(self._fiber_volume_fraction * np.prod(plane) / (np.pi * self._radius ** 2)))
+        boxsize = plane if self._periodic else None
+        low = 0 if self._periodic else -self._radius
+        batch_size = max(min(target // 4, 1024), 16)
+
+        centers = np.zeros((0, 2))
+        tree = None
+        attempts = 0
+        while centers.shape[0] < target:
+            candidates = low + np.random.rand(batch_size, 2) * (plane - 2 * low)
+            accepted = np.ones(batch_size, dtype=bool)
+            if tree is not None:
+                neighbors = tree.query_ball_point(candidates, self._min_distance, return_length=True)
+                accepted[neighbors > 0] = False
+
+            # within the batch, a candidate is rejected if it is too close to an earlier accepted one
+            pairs = cKDTree(candidates, boxsize=boxsize).query_pairs(self._min_distance, output_type='ndarray')
+            for first, second in pairs[np.argsort(pairs.max(axis=1), kind='stable')]:
+                first, second = min(first, second), max(first, second)
+                if accepted[first]:
+                    accepted[second] = False
+
+            new = candidates[accepted][:target - centers.shape[0]]
+            if new.shape[0] == 0:
+                attempts += 1
+                if attempts == self._max_attempts:
+                    print_warning("Could not insert more fibers, stopping at {} out of {} fibers"
+                                  .format(centers.shape[0], target))
+                    break
+                continue
+            attempts = 0
+            centers = np.vstack((centers, new))
+            tree = cKDTree(centers, boxsize=boxsize)
+        return centers
+
+    def _rasterize(self):
+        # nearest fiber center of every pixel (i.e. Voronoi cell), by slabs along x on a thread pool
+        plane = np.empty(self._size[:2], dtype=np.uint16)
+        if self._periodic:
+            tree = cKDTree(self._centers, boxsize=np.array(self._size[:2], dtype=float))
+        else:
+            tree = cKDTree(self._centers)
+        y = np.arange(self._size[1])
+        fiber_radius2 = self._radius ** 2
+        coating_radius2 = (self._radius + self._coating) ** 2
+
+        def process(slab):
+            start, end = slab
+            x = np.arange(start, end)
+            points = np.column_stack((np.repeat(x, y.size), np.tile(y, x.size))).astype(float)
+            distance2 = tree.query(points)[0].reshape(-1, y.size) ** 2
+            block = plane[start:end]
+            block[:] = self._phase_ids[0]
+            block[distance2 <= coating_radius2] = self._phase_ids[1]
+            block[distance2 <= fiber_radius2] = self._phase_ids[2]
+
+        run_in_pool(process, split_slabs(self._size[0], 4 * self._workers), self._workers)
+        return plane
+
+    def log_input(self):
+        self._workspace.log.log_section("Generating Fiber Array")
+        self._workspace.log.log_value("Domain Size", self._size)
+        self._workspace.log.log_value("Radius", self._radius)
+        self._workspace.log.log_value("Fiber volume fraction", self._fiber_volume_fraction)
+        self._workspace.log.log_value("Packing", self._packing)
+        self._workspace.log.log_value("Coating", self._coating)
+        self._workspace.log.write_log()
+
+    def log_output(self):
+        self._workspace.log.log_section("Finished Fiber Array Generation")
+        self._workspace.log.write_log()
+
+    def error_check(self):
+        check.size_check(self._size)
+        check.greater_than_exc(self._radius, 0, "radius")
+        check.range_exc(self._fiber_volume_fraction, (0, 1), "fiber_volume_fraction")
+        check.greater_than_inc(self._coating, 0, "coating")
+        check.greater_than_inc(self._min_spacing, 0, "min_spacing")
+        if self._packing not in ('hexagonal', 'square', 'random'):
+            raise Exception("Error, packing has to be 'hexagonal', 'square' or 'random'")
+        if len(self._phase_ids) != 3:
+            raise Exception("Error, phase_ids has to contain the (matrix, coating, fiber) IDs")
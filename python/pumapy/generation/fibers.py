@@ -0,0 +1,359 @@
+from pumapy.utilities.workspace import Workspace
+import pumapy.utilities.generic_checks as check
+from pumapy.utilities.logger import print_warning
+from pumapy.utilities.parallel import get_workers, run_in_pool
+from pumapy.generation.periodic import periodic_images
+from pumapy.generation.tracker import DescriptorTracker
+import numpy as np
+import sys
+
+
+def generate_fibers(size, radius, length, porosity, phi=0, theta=90, radius_var=0., length_var=0.,
+                    curvature_radius=None, curvature_radius_var=0., n_small_fibers=0, small_radius=None,
+                    small_radius_var=0., n_small_fibers_var=0, placement_var=0., accuracy=0.1, orientation=False,
+                    workers=None, periodic=False):
+    """ Generation of random fibers (straight or curved, with circular or flower cross sections) up to a porosity
+
+    The fibers are rasterized as gray-scale cylinders (255 on the centerline, 128 at the fiber surface), composed
+    with a max. Curved fibers are circular arcs, while flower fibers are made of a main fiber surrounded by
+    n_small_fibers smaller parallel ones, centered on its surface. All parameters with a _var suffix are the
+    half-widths of uniform distributions around the corresponding mean value.
+
+    :param size: size of 3D domain (x,y,z)
+    :type size: tuple(int, int, int)
+    :param radius: mean fiber radius in voxels
+    :type radius: float
+    :param length: mean fiber length (i.e. distance between its ends) in voxels
+    :type length: float
+    :param porosity: target porosity of the generated structure
+    :type porosity: float
+    :param phi: a value between 0 and 90 that controls the amount that the fibers lie *out of* the XY plane,
+        with 0 meaning all fibers lie in the XY plane, and 90 meaning that they are randomly oriented out of the
+        plane by as much as +/- 90 degrees
+    :type phi: float, optional
+    :param theta: a value between 0 and 90 that controls the amount of rotation *in the* XY plane,
+        with 0 meaning all fibers point in the X-direction, and 90 meaning they are randomly rotated about the
+        Z axis by as much as +/- 90 degrees
+    :type theta: float, optional
+    :param radius_var: variation of the fiber radius
+    :type radius_var: float, optional
+    :param length_var: variation of the fiber length
+    :type length_var: float, optional
+    :param curvature_radius: mean radius of curvature of the fibers (straight fibers if None). It is clipped to half
+        the fiber length, which gives half circles
+    :type curvature_radius: float, optional
+    :param curvature_radius_var: variation of the radius of curvature
+    :type curvature_radius_var: float, optional
+    :param n_small_fibers: mean number of small fibers around the main one, for flower cross sections
+    :type n_small_fibers: int, optional
+    :param small_radius: mean radius of the small fibers, required if n_small_fibers or n_small_fibers_var > 0
+    :type small_radius: float, optional
+    :param small_radius_var: variation of the radius of the small fibers
+    :type small_radius_var: float, optional
+    :param n_small_fibers_var: variation of the number of small fibers
+    :type n_small_fibers_var: int, optional
+    :param placement_var: variation of the angular position of the small fibers, in degrees
+    :type placement_var: float, optional
+    :param accuracy: maximum distance in voxels between curved fibers and the segments approximating them
+    :type accuracy: float, optional
+    :param orientation: write the fiber tangent directions in the solid voxels of Workspace.orientation
+    :type orientation: bool, optional
+    :param workers: number of threads used to rasterize the fibers (all available cores if None)
+    :type workers: int, optional
+    :param periodic: the fibers crossing a face of the domain wrap around to the opposite face, producing a
+        periodic structure
+    :type periodic: bool, optional
+    :return: domain with random fibers, with gray values in [0, 255] (solid in [128, 255])
+    :rtype: Workspace
+    """
+
+    generator = GeneratorFibers(size, radius, length, porosity, phi, theta, radius_var, length_var,
+                                curvature_radius, curvature_radius_var, n_small_fibers, small_radius,
+                                small_radius_var, n_small_fibers_var, placement_var, accuracy, orientation, workers,
+                                periodic)
+
+    generator.error_check()
+
+    generator.log_input()
+    ws = generator.generate()
+    generator.log_output()
+    return ws
+
+
+def generate_prescribed_fibers(positions, radius, size=None, scale=1., orientation=False, workers=None,
+                               periodic=False):
+    """ Generation of straight fibers from a prescribed list of end points, e.g. for reproducible microstructures
+
+    :param positions: fiber end points as (N, 6) or (N, 2, 3), i.e. (x0, y0, z0, x1, y1, z1) for each fiber
+    :type positions: ndarray
+    :param radius: fiber radius, either one for all fibers or one per fiber
+    :type radius: float or ndarray
+    :param size: size of 3D domain (x,y,z). If None, the positions are shifted to start at zero and the domain is
+        their bounding box, plus a buffer of radius + 2 voxels on each side
+    :type size: tuple(int, int, int), optional
+    :param scale: scaling factor applied to the positions and the radius, to convert them into voxels
+    :type scale: float, optional
+    :param orientation: write the fiber tangent directions in the solid voxels of Workspace.orientation
+    :type orientation: bool, optional
+    :param workers: number of threads used to rasterize the fibers (all available cores if None)
+    :type workers: int, optional
+    :param periodic: the fibers crossing a face of the domain wrap around to the opposite face
+    :type periodic: bool, optional
+    :return: domain with the prescribed fibers, with gray values in [0, 255] (solid in [128, 255])
+    :rtype: Workspace
+    """
+    positions = np.array(positions, dtype=float).reshape(-1, 6) * scale
+    radii = np.broadcast_to(np.asarray(radius, dtype=float) * scale, (positions.shape[0],)).copy()
+    if positions.shape[0] == 0:
+        raise Exception("Error, no fibers were prescribed")
+    check.greater_than_exc(radii.min(), 0, "radius")
+
+    if size is None:
+        buffer = int(radii.max()) + 2
+        points = positions.reshape(-1, 3)
+        positions = (positions.reshape(-1, 2, 3) - points.min(axis=0) + buffer).reshape(-1, 6)
+        size = tuple(int(s) for s in np.ceil(points.max(axis=0) - points.min(axis=0)) + 2 * buffer)
+    check.size_check(size)
+
+    ws = Workspace()
+    ws.log.log_section("Generating Prescribed Fibers")
+    ws.log.log_value("Domain Size", size)
+    ws.log.log_value("Number of fibers", positions.shape[0])
+    ws.log.write_log()
+
+    ws.resize_new_matrix(size)
+    if orientation:
+        ws.create_orientation()
+    solid = _rasterize_segments(ws.matrix, ws.orientation if orientation else None,
+                                positions[:, :3], positions[:, 3:], radii, workers, periodic)
+    print("Generated prescribed fibers domain with porosity: {}".format(1. - solid / float(np.prod(size))))
+    return ws
+
+
+def _rasterize_segments(matrix, orientation, starts, ends, radii, workers=None, periodic=False, tile=16):
+    """ Composes (with a max) the gray-scale cylinders around segments into a matrix, tile by tile on a thread pool
+
+    Every tile only evaluates the distance fields of the segments that can reach it. The gray value decreases
+    linearly from 255 on the segment to 128 at its radius, and where it increases in a solid voxel, the segment
+    tangent is written into the orientation (if not None). If periodic, the segments wrap around the domain faces.
+
+    :return: number of voxels that were turned solid (i.e. >= 128)
+    :rtype: int
+    """
+    workers = get_workers(workers)
+    if starts.shape[0] == 0:
+        return 0
+    if periodic:
+        reach = 2 * radii[:, np.newaxis] + 1
+        indices, shifts = periodic_images(np.minimum(starts, ends) - reach, np.maximum(starts, ends) + reach,
+                                          matrix.shape)
+        starts, ends, radii = starts[indices] + shifts, ends[indices] + shifts, radii[indices]
+    directions = ends - starts
+    lengths2 = np.maximum(np.sum(directions ** 2, axis=1), 1e-12)
+    tangents = directions / np.sqrt(lengths2)[:, np.newaxis]
+    slopes = 127. / radii
+    reach = 2 * radii + np.sqrt(3) * tile / 2.  # the gray value vanishes at twice the radius
+
+    def distance2(points, indices):
+        # squared distances between points (broadcastable arrays for x, y, z) and a set of segments
+        a = [starts[indices, i].reshape((-1,) + (1,) * points[0].ndim) for i in range(3)]
+        d = [directions[indices, i].reshape(a[0].shape) for i in range(3)]
+        t = ((points[0] - a[0]) * d[0] + (points[1] - a[1]) * d[1] + (points[2] - a[2]) * d[2])
+        t = np.clip(t / lengths2[indices].reshape(a[0].shape), 0, 1)
+        return ((points[0] - a[0] - t * d[0]) ** 2 + (points[1] - a[1] - t * d[1]) ** 2 +
+                (points[2] - a[2] - t * d[2]) ** 2)
+
+    origins = [(i, j, k) for i in range(0, matrix.shape[0], tile)
+               for j in range(0, matrix.shape[1], tile) for k in range(0, matrix.shape[2], tile)]
+
+    def process(origin):
+        block_slice = tuple(slice(origin[i], origin[i] + tile) for i in range(3))
+        block = matrix[block_slice]
+        center = [np.array([origin[i] + (block.shape[i] - 1) / 2.]) for i in range(3)]
+        candidates = np.where(distance2(center, np.arange(starts.shape[0]))[:, 0] < reach ** 2)[0]
+        if candidates.size == 0:
+            return 0
+
+        points = np.ogrid[origin[0]:origin[0] + block.shape[0], origin[1]:origin[1] + block.shape[1],
+                          origin[2]:origin[2] + block.shape[2]]
+        best = np.zeros(block.shape)
+        best_index = np.zeros(block.shape, dtype=int)
+        chunk = max(2 ** 18 // block.size, 1)  # bounding the temporaries of each thread
+        for n in range(0, candidates.size, chunk):
+            indices = candidates[n:n + chunk]
+            gray = 255. - slopes[indices].reshape(-1, 1, 1, 1) * np.sqrt(distance2(points, indices))
+            nearest = np.argmax(gray, axis=0)
+            gray = np.take_along_axis(gray, nearest[np.newaxis], axis=0)[0]
+            better = gray > best
+            best[better] = gray[better]
+            best_index[better] = indices[nearest[better]]
+
+        gray = best.astype(np.uint16)
+        update = gray > block
+        solid_before = np.count_nonzero(block >= 128)
+        if orientation is not None:
+            write = np.logical_and(update, gray >= 128)
+            orientation[block_slice][write] = tangents[best_index[write]]
+        block[update] = gray[update]
+        return np.count_nonzero(block >= 128) - solid_before
+
+    return int(sum(run_in_pool(process, origins, workers)))
+
+
+class GeneratorFibers:
+    def __init__(self, size, radius, length, porosity, phi=0, theta=90, radius_var=0., length_var=0.,
+                 curvature_radius=None, curvature_radius_var=0., n_small_fibers=0, small_radius=None,
+                 small_radius_var=0., n_small_fibers_var=0, placement_var=0., accuracy=0.1, orientation=False,
+                 workers=None, periodic=False):
+        self._workspace = Workspace()
+        self._size = size
+        self._radius = radius
+        self._length = length
+        self._porosity = porosity
+        self._phi = phi
+        self._theta = theta
+        self._radius_var = radius_var
+        self._length_var = length_var
+        self._curvature_radius = curvature_radius
+        self._curvature_radius_var = curvature_radius_var
+        self._n_small_fibers = n_small_fibers
+        self._small_radius = small_radius
+        self._small_radius_var = small_radius_var
+        self._n_small_fibers_var = n_small_fibers_var
+        self._placement_var = placement_var
+        self._accuracy = accuracy
+        self._orientation = orientation
+        self._workers = get_workers(workers)
+        self._periodic = periodic
+
+    def generate(self):
+        self._workspace.resize_new_matrix(self._size)
+        if self._orientation:
+            self._workspace.create_orientation()
+        self._generate_fibers()
+        return self._workspace
+
+    def _generate_fibers(self):
+        total_voxels = float(np.prod(self._size))
+        tracker = DescriptorTracker(self._size)
+        total_count = 0
+        unsuccessful_batches = 0
+
+        # first guess from the fiber volume, then from the volume actually added (overlaps included)
+        vol_fiber = np.pi * self._length * (self._radius ** 2 + self._n_small_fibers * (self._small_radius or 0) ** 2)
+        nfibers = max(int(0.5 * (1 - self._porosity) * total_voxels / vol_fiber), 1)
+
+        while tracker.porosity > self._porosity:
+            segments = [self._random_fiber() for _ in range(nfibers)]
+            starts, ends, radii = [np.concatenate(s) for s in zip(*segments)]
+            added = _rasterize_segments(self._workspace.matrix,
+                                        self._workspace.orientation if self._orientation else None,
+                                        starts, ends, radii, self._workers, self._periodic)
+            tracker.add(added)
+            total_count += nfibers
+            current_porosity = tracker.porosity
+            sys.stdout.write("\rFibers Generated {}  Porosity = {} ".format(total_count, current_porosity))
+
+            if added == 0:
+                unsuccessful_batches += 1
+                if unsuccessful_batches == 100:
+                    print_warning("Could not add more fibers, stopping at porosity {}".format(current_porosity))
+                    break
+                continue
+            unsuccessful_batches = 0
+
+            # overlapping fibers: porosity = exp(-n * vol_fiber / total_voxels)
+            vol_fiber = -np.log(current_porosity) * total_voxels / total_count
+            nfibers_total = -np.log(self._porosity) * total_voxels / vol_fiber
+            nfibers = max(int(np.ceil(0.8 * (nfibers_total - total_count))), 1)
+        print()
+
+    @staticmethod
+    def _uniform(mean, var):
+        return mean + (2 * np.random.rand() - 1) * var
+
+    def _random_fiber(self):
+        # returns the (starts, ends, radii) of the segments approximating a random fiber
+        radius = max(self._uniform(self._radius, self._radius_var), 0.5)
+        length = max(self._uniform(self._length, self._length_var), 1.)
+
+        phi_rand = (np.pi / 2 - np.pi * np.random.rand()) * self._phi / 90
+        theta_rand = (np.pi / 2 - np.pi * np.random.rand()) * self._theta / 90
+        direction = np.array([np.cos(phi_rand) * np.cos(theta_rand), np.cos(phi_rand) * np.sin(theta_rand),
+                              np.sin(phi_rand)])
+        midpoint = np.random.rand(3) * self._size
+        point_1, point_2 = midpoint - direction * length / 2., midpoint + direction * length / 2.
+
+        # random unit vector perpendicular to the fiber, setting the plane of its curvature and its cross section
+        vector_u = np.random.normal(size=3)
+        vector_u -= direction * np.dot(vector_u, direction)
+        vector_u /= np.linalg.norm(vector_u)
+
+        if self._curvature_radius is None:
+            points = np.vstack((point_1, point_2))
+            frame_1 = np.tile(vector_u, (2, 1))
+            frame_2 = np.tile(np.cross(direction, vector_u), (2, 1))
+        else:
+            curvature_radius = max(self._uniform(self._curvature_radius, self._curvature_radius_var), length / 2.)
+            points, frame_1, frame_2 = self._arc(point_1, point_2, direction, vector_u, curvature_radius)
+
+        centerlines, radii = [points], [radius]
+        n_small = int(round(self._uniform(self._n_small_fibers, self._n_small_fibers_var)))
+        for i in range(max(n_small, 0)):
+            angle = np.radians(i * 360. / n_small + (2 * np.random.rand() - 1) * self._placement_var)
+            centerlines.append(points + radius * (np.cos(angle) * frame_1 + np.sin(angle) * frame_2))
+            radii.append(max(self._uniform(self._small_radius, self._small_radius_var), 0.5))
+
+        starts = np.vstack([c[:-1] for c in centerlines])
+        ends = np.vstack([c[1:] for c in centerlines])
+        radii = np.concatenate([np.full(c.shape[0] - 1, r) for c, r in zip(centerlines, radii)])
+        return starts, ends, radii
+
+    def _arc(self, point_1, point_2, direction, vector_u, curvature_radius):
+        # circular arc between two points, bulging opposite to vector_u, as points with a (radial, normal) frame
+        midpoint = (point_1 + point_2) / 2.
+        half_chord = np.linalg.norm(point_2 - point_1) / 2.
+        center = midpoint + vector_u * np.sqrt(max(curvature_radius ** 2 - half_chord ** 2, 0))
+        normal = np.cross(direction, vector_u)
+        radial_1 = (point_1 - center) / curvature_radius
+        angle = 2 * np.arcsin(min(half_chord / curvature_radius, 1))
+
+        # angular step such that the distance between the arc and its segments is below the accuracy
+        step = 2 * np.arccos(max(1 - self._accuracy / curvature_radius, -1))
+        alpha = np.linspace(0, angle, max(int(np.ceil(angle / step)), 1) + 1)[:, np.newaxis]
+        radial = np.cos(alpha) * radial_1 + np.sin(alpha) * np.cross(normal, radial_1)
+        return center + curvature_radius * radial, radial, np.tile(normal, (alpha.shape[0], 1))
+
+    def log_input(self):
+        self._workspace.log.log_section("Generating Fibers")
+        self._workspace.log.log_value("Domain Size", self._size)
+        self._workspace.log.log_value("Radius", self._radius)
+        self._workspace.log.log_value("Length", self._length)
+        self._workspace.log.log_value("Porosity", self._porosity)
+        self._workspace.log.log_value("Radius of curvature", self._curvature_radius)
+        self._workspace.log.log_value("Number of small fibers", self._n_small_fibers)
+        self._workspace.log.log_value("Periodic", self._periodic)
+        self._workspace.log.write_log()
+
+    def log_output(self):
+        self._workspace.log.log_section("Finished Fiber Generation")
+        self._workspace.log.write_log()
+
+    def error_check(self):
+        check.size_check(self._size)
+        check.greater_than_exc(self._radius, 0, "radius")
+        check.greater_than_exc(self._length, 0, "length")
+        check.range_exc(self._porosity, (0, 1), "porosity")
+        check.range_inc(self._phi, (0, 90), "phi")
+        check.range_inc(self._theta, (0, 90), "theta")
+        check.greater_than_inc(self._radius_var, 0, "radius_var")
+        check.greater_than_inc(self._length_var, 0, "length_var")
+        check.greater_than_exc(self._accuracy, 0, "accuracy")
+        if self._curvature_radius is not None:
+            check.greater_than_exc(self._curvature_radius, 0, "curvature_radius")
+        check.greater_than_inc(self._n_small_fibers, 0, "n_small_fibers")
+        check.greater_than_inc(self._n_small_fibers_var, 0, "n_small_fibers_var")
+        if self._n_small_fibers + self._n_small_fibers_var > 0:
+            if self._small_radius is None:
+                raise Exception("Error, small_radius has to be specified for flower fibers")
+            check.greater_than_exc(self._small_radius, 0, "small_radius")
@@ -0,0 +1,49 @@
+import numpy as np
+import itertools
+
+
+def periodic_images(low, high, size):
+    """ Periodic images of objects that overlap the domain
+
+    An object with bounding box [low, high) has an image translated by k * size (k integer, per axis) wherever that
+    translated box overlaps the domain [0, size). Rasterizing all images clipped to the domain is equivalent to
+    wrapping the voxel indices of the objects around the domain faces.
+
+    :param low: lower corners of the bounding boxes as (N, 3)
+    :type low: ndarray
+    :param high: upper corners of the bounding boxes as (N, 3)
+    :type high: ndarray
+    :param size: size of 3D domain (x,y,z)
+    :type size: tuple(int, int, int)
+    :return: index of the object of each image, and translation of each image as (M, 3)
+    :rtype: tuple(ndarray, ndarray)
+    """
+    low, high = np.atleast_2d(low), np.atleast_2d(high)
+    size = np.asarray(size, dtype=float)
+    k_min = np.floor(-high / size).astype(int) + 1
+    k_max = np.ceil((size - low) / size).astype(int) - 1
+
+    indices, shifts = [], []
+    for k in itertools.product(*[range(k_min[:, i].min(), k_max[:, i].max() + 1) for i in range(3)]):
+        k = np.array(k)
+        valid = np.where(np.all(np.logical_and(k >= k_min, k <= k_max), axis=1))[0]
+        indices.append(valid)
+        shifts.append(np.tile(k * size, (valid.size, 1)))
+    return np.concatenate(indices), np.vstack(shifts)
+
+
+def periodic_difference(a, b, size):
+    """ Minimum image difference a - b between points of a periodic domain
+
+    :param a: points as (..., 3)
+    :type a: ndarray
+    :param b: points as (..., 3)
+    :type b: ndarray
+    :param size: size of 3D domain (x,y,z)
+    :type size: tuple(int, int, int)
+    :return: differences as (..., 3)
+    :rtype: ndarray
+    """
+    size = np.asarray(size, dtype=float)
+    difference = a - b
+    return difference - size * np.round(difference / size)
@@ -4,67 +4,160 @@
 # See https://github.com/PMEAL/porespy/blob/dev/porespy/generators/_imgen.py for more information.
 # See https://github.com/PMEAL/porespy/blob/dev/LICENSE for the license.
 
-from scipy.ndimage import distance_transform_edt as edt
 import numpy as np
 from pumapy.utilities.workspace import Workspace
 from pumapy.materialproperties.volumefraction import compute_volume_fraction
+from pumapy.utilities.parallel import get_workers, run_in_pool
+from pumapy.generation.periodic import periodic_images
+from pumapy.generation.tracker import DescriptorTracker
 import sys
 
 
-def _generate_fibers(shape, radius, nfibers, phi=0, theta=90, length=None):
-    """ Generates random fibers given nfibers"""
+def _default_length(shape, periodic=False):
+    """ Fiber length when none is given: twice the domain diagonal, so that the fibers extend beyond the domain in
+    both directions, or the smallest period if periodic (less the rounding of the end points to the voxels), so that
+    the fibers never wrap onto themselves"""
+    if periodic:
+        return int(np.min(shape)) - 1
+    return 2 * np.sqrt(np.sum(np.square(shape))).astype(int)
 
-    # error checks
+
+def _fiber_half_length(shape, length, periodic=False):
+    """ Half length of the fibers (see _default_length)"""
+    H = np.sqrt(np.sum(np.square(shape))).astype(int)
+    if length is None:
+        length = _default_length(shape, periodic)
+    return min(int(length / 2), 2 * H)
+
+
+def _sample_directions(n, phi, theta):
+    """ Random unit vectors within phi degrees out of the XY plane and theta degrees from the X axis"""
+    phi_rand = (np.pi / 2 - np.pi * np.random.rand(n)) * phi / 90
+    theta_rand = (np.pi / 2 - np.pi * np.random.rand(n)) * theta / 90
+    return np.column_stack([np.cos(phi_rand) * np.cos(theta_rand),
+                            np.cos(phi_rand) * np.sin(theta_rand),
+                            np.sin(phi_rand)])
+
+
+def _sample_fibers(shape, nfibers, phi=0, theta=90, length=None, batch_size=4096, periodic=False):
+    """ Samples the end points of nfibers random fibers whose centerline crosses the domain
+
+    The fiber centers are drawn uniformly within the domain extended by the fiber half length, which is the region
+    where a fiber can reach the domain, and the fibers missing the domain are rejected. If periodic, the centers are
+    drawn within the domain, since the fibers wrap around its faces.
+    """
+    shape = np.array(shape)
+    R = _fiber_half_length(shape, length, periodic)
+    if periodic:
+        x = np.random.rand(nfibers, 3) * shape
+        x0 = R * _sample_directions(nfibers, phi, theta)
+        return np.around(x + x0), np.around(x - x0)
+
+    starts, ends = [], []
+    n = 0
+    while n < nfibers:
+        x = np.random.rand(batch_size, 3) * (shape + 2 * R) - R
+        x0 = R * _sample_directions(batch_size, phi, theta)
+        x0, x1 = np.around(x + x0), np.around(x - x0)
+
+        # clipping the centerlines against the domain voxels: [-0.5, shape - 0.5] along each axis
+        t_min, t_max = np.zeros(batch_size), np.ones(batch_size)
+        direction = x1 - x0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i in range(3):
+                t_low = (-0.5 - x0[:, i]) / direction[:, i]
+                t_high = (shape[i] - 0.5 - x0[:, i]) / direction[:, i]
+                parallel = direction[:, i] == 0
+                inside = np.logical_and(x0[:, i] >= -0.5, x0[:, i] <= shape[i] - 0.5)
+                t_min = np.where(parallel, np.where(inside, t_min, 1), np.maximum(t_min, np.minimum(t_low, t_high)))
+                t_max = np.where(parallel, np.where(inside, t_max, 0), np.minimum(t_max, np.maximum(t_low, t_high)))
+        valid = np.where(t_min <= t_max)[0][:nfibers - n]
+
+        starts.append(x0[valid])
+        ends.append(x1[valid])
+        n += valid.shape[0]
+    return np.vstack(starts), np.vstack(ends)
+
+
+def _rasterize_fibers(solid, starts, ends, radius, workers=None, periodic=False, tile=16):
+    """ Marks as solid the voxels closer than radius to the fiber centerlines, tile by tile on a thread pool
+
+    Every tile only evaluates the capsule distance fields of the fibers that can reach it. If periodic, the
+    fibers wrap around the domain faces.
+
+    :return: number of voxels that were turned solid by these fibers
+    :rtype: int
+    """
+    workers = get_workers(workers)
+    if starts.shape[0] == 0:
+        return 0
+    if periodic:
+        indices, shifts = periodic_images(np.minimum(starts, ends) - radius - 1, np.maximum(starts, ends) + radius + 1,
+                                          solid.shape)
+        starts, ends = starts[indices] + shifts, ends[indices] + shifts
+    directions = ends - starts
+    lengths2 = np.maximum(np.sum(directions ** 2, axis=1), 1e-12)
+    reach = radius + np.sqrt(3) * tile / 2.
+
+    def distance2(points, indices):
+        # squared distances between points (broadcastable arrays for x, y, z) and a set of centerline segments
+        a = [starts[indices, i].reshape((-1,) + (1,) * points[0].ndim) for i in range(3)]
+        d = [directions[indices, i].reshape(a[0].shape) for i in range(3)]
+        t = ((points[0] - a[0]) * d[0] + (points[1] - a[1]) * d[1] + (points[2] - a[2]) * d[2])
+        t = np.clip(t / lengths2[indices].reshape(a[0].shape), 0, 1)
+        return ((points[0] - a[0] - t * d[0]) ** 2 + (points[1] - a[1] - t * d[1]) ** 2 +
+                (points[2] - a[2] - t * d[2]) ** 2)
+
+    origins = [(i, j, k) for i in range(0, solid.shape[0], tile)
+               for j in range(0, solid.shape[1], tile) for k in range(0, solid.shape[2], tile)]
+
+    def process(origin):
+        block = solid[origin[0]:origin[0] + tile, origin[1]:origin[1] + tile, origin[2]:origin[2] + tile]
+        center = [np.array([origin[i] + (block.shape[i] - 1) / 2.]) for i in range(3)]
+        candidates = np.where(distance2(center, np.arange(starts.shape[0]))[:, 0] < reach ** 2)[0]
+        if candidates.size == 0 or np.all(block):
+            return 0
+
+        points = np.ogrid[origin[0]:origin[0] + block.shape[0], origin[1]:origin[1] + block.shape[1],
+                          origin[2]:origin[2] + block.shape[2]]
+        added = np.zeros(block.shape, dtype=bool)
+        chunk = max(2 ** 18 // block.size, 1)  # bounding the temporaries of each thread
+        for n in range(0, candidates.size, chunk):
+            added |= np.any(distance2(points, candidates[n:n + chunk]) < radius ** 2, axis=0)
+        added &= ~block
+        block |= added
+        return np.count_nonzero(added)
+
+    return int(sum(run_in_pool(process, origins, workers)))
+
+
+def _check_fibers(shape, phi, theta):
+    """ Error checks on the fiber parameters, returning the 3D shape"""
     shape = np.array(shape)
     if np.size(shape) == 1:
         shape = np.full((3, ), int(shape))
     elif np.size(shape) == 2:
         raise Exception("Shape can only be 3D")
 
-    H = np.sqrt(np.sum(np.square(shape))).astype(int)
-    if length is None:
-        length = 2 * H
-    R = min(int(length / 2), 2 * H)
-
     if (phi > 90) or (phi < 0):
         raise Exception('phi_max must be betwen 0 and 90')
     if (theta > 90) or (theta < 0):
         raise Exception('theta_max must be betwen 0 and 90')
+    return shape
 
-    im = np.zeros(shape, dtype=bool)
-    n = 0
-    L = min(H, R)
 
-    while n < nfibers:
-        x = np.random.rand(3) * (shape + 2 * L)
-
-        phi_rand = (np.pi / 2 - np.pi * np.random.rand()) * phi / 90
-        theta_rand = (np.pi / 2 - np.pi * np.random.rand()) * theta / 90
-        x0 = R * np.array([np.cos(phi_rand) * np.cos(theta_rand),
-                           np.cos(phi_rand) * np.sin(theta_rand),
-                           np.sin(phi_rand)])
-        [x0, x1] = [x + x0, x - x0]
-
-        x0 = np.around(x0).astype(int)
-        x1 = np.around(x1).astype(int)
-        L = np.amax(np.absolute([[x1[0] - x0[0]], [x1[1] - x0[1]], [x1[2] - x0[2]]])) + 1
-        crds = [np.rint(np.linspace(x0[0], x1[0], L)).astype(int),
-                np.rint(np.linspace(x0[1], x1[1], L)).astype(int),
-                np.rint(np.linspace(x0[2], x1[2], L)).astype(int)]
-
-        lower = ~np.any(np.vstack(crds).T < [L, L, L], axis=1)
-        upper = ~np.any(np.vstack(crds).T >= shape + L, axis=1)
-        valid = upper * lower
-        if np.any(valid):
-            im[crds[0][valid] - L, crds[1][valid] - L, crds[2][valid] - L] = 1
-            n += 1
-
-    im = np.array(im, dtype=bool)
-    dt = edt(~im) < radius
-    return ~dt
-
-
-def generate_random_fibers(shape, radius, nfibers=None, porosity=None, phi=0, theta=90, length=None, max_iter=3):
+def _generate_fibers(shape, radius, nfibers, phi=0, theta=90, length=None, workers=None, periodic=False):
+    """ Generates random fibers given nfibers"""
+
+    shape = _check_fibers(shape, phi, theta)
+    solid = np.zeros(shape, dtype=bool)
+    starts, ends = _sample_fibers(shape, nfibers, phi, theta, length, periodic=periodic)
+    _rasterize_fibers(solid, starts, ends, radius, workers, periodic)
+    return ~solid
+
+
+def generate_random_fibers(shape, radius, nfibers=None, porosity=None, phi=0, theta=90, length=None, max_iter=3,
+                           workers=None, periodic=False):
     """ Generates random fibers from number of fibers or porosity
 
     :param shape: the size of the workspace to generate in (Nx, Ny, Nz) where N is the number of voxels.
@@ -87,7 +180,8 @@ def generate_random_fibers(shape, radius, nfibers=None, porosity=None, phi=0, th
         Z axis by as much as +/- 90 degrees
     :type theta: float, optional
     :param length: the length of the cylinders to add.  If ``None`` (default) then the cylinders will extend beyond the
-        domain in both directions so no ends will exist. If a scalar value is given it will be interpreted as the
+        domain in both directions so no ends will exist (if periodic, they are as long as the smallest side of the
+        domain, so that they do not wrap onto themselves). If a scalar value is given it will be interpreted as the
         Euclidean distance between the two ends of the cylinder.  Note that one or both of the ends *may* still lie
         outside the domain, depending on the randomly chosen center point of the cylinder
     :type length: float, optional
@@ -95,6 +189,11 @@ def generate_random_fibers(shape, radius, nfibers=None, porosity=None, phi=0, th
         value of 3 is used (and this is typically effective in getting very close to the targeted porosity),
         but a greater number can be input to improve the achieved porosity
     :type max_iter: int, optional
+    :param workers: number of threads used to rasterize the fibers (all available cores if None)
+    :type workers: int, optional
+    :param periodic: the fibers crossing a face of the domain wrap around to the opposite face, producing a
+        periodic structure. The fiber centers are then drawn within the domain
+    :type periodic: bool, optional
     :return: random fibers domain
     :rtype: Workspace
     """
@@ -107,12 +206,19 @@ def generate_random_fibers(shape, radius, nfibers=None, porosity=None, phi=0, th
 
     # run solver for provided number of fibers
     if nfibers is not None:
-        img = _generate_fibers(shape=shape, radius=radius, nfibers=nfibers, phi=phi, theta=theta, length=length)
+        img = _generate_fibers(shape=shape, radius=radius, nfibers=nfibers, phi=phi, theta=theta, length=length,
+                               workers=workers, periodic=periodic)
 
     else:  # porosity provided
+        shape = _check_fibers(shape, phi, theta)
         vol_total = float(np.prod(shape))
 
-        length_estimate = vol_total ** (1 / 3) if length is None else length
+        if length is not None:
+            length_estimate = length
+        elif periodic:  # the whole fiber lies within the domain
+            length_estimate = _default_length(shape, periodic)
+        else:
+            length_estimate = vol_total ** (1 / 3)
 
         vol_fiber = length_estimate * np.pi * radius * radius
         n_pixels_to_add = -np.log(porosity) * vol_total
@@ -124,20 +230,23 @@ def generate_random_fibers(shape, radius, nfibers=None, porosity=None, phi=0, th
         for i in range(1, max_iter):
             fractions.append(fractions[i - 1] + (max_iter - i) ** 2 * subdif)
 
-        img = np.ones(shape, dtype=bool)
+        # each insertion only rasterizes the new fibers, and the porosity follows from the voxels they turned solid
+        solid = np.zeros(shape, dtype=bool)
+        tracker = DescriptorTracker(shape)
         for i, frac in enumerate(fractions):
             n_fibers_total = n_pixels_to_add / vol_fiber
             n_fibers = int(np.ceil(frac * n_fibers_total) - n_fibers_added)
             if n_fibers > 0:
-                img = img & _generate_fibers(shape, radius, n_fibers, phi, theta, length)
+                starts, ends = _sample_fibers(shape, n_fibers, phi, theta, length, periodic=periodic)
+                tracker.add(_rasterize_fibers(solid, starts, ends, radius, workers, periodic))
             n_fibers_added += n_fibers
 
-            void_vf = np.sum(img == 1)
-            porosity = void_vf / (np.sum(img == 0) + void_vf)
+            porosity = tracker.porosity
             vol_added = -np.log(porosity) * vol_total
             vol_fiber = vol_added / n_fibers_added
 
             sys.stdout.write("\rGenerating fibers ... {:.1f}% ".format((i+1) / len(fractions) * 100))
+        img = ~solid
 
     img = np.where(img, np.uint16(0), np.uint16(1))
     img = Workspace.from_array(img.astype(np.uint16))
@@ -1,26 +1,47 @@
 from pumapy import Workspace
 import pumapy.utilities.generic_checks as check
-from pumapy.generation.sphere import get_sphere
+from pumapy.generation.sphere import sphere_profile
+from pumapy.generation.periodic import periodic_images, periodic_difference
+from pumapy.generation.tracker import DescriptorTracker
+from pumapy.utilities.logger import print_warning
+from pumapy.utilities.parallel import get_workers, split_slabs, run_in_pool
+from scipy.spatial import cKDTree
 import numpy as np
 import sys
 
 
-def generate_random_spheres(size, diameter, porosity, allow_intersect=True):
-    """ Generation of triply periodic minimal surface material
+def generate_random_spheres(size, diameter, porosity, allow_intersect=True, diameter_std=0., batch_size=1024,
+                            workers=None, periodic=False, specific_area=None):
+    """ Generation of random spheres domain
 
     :param size: size of 3D domain (x,y,z)
     :type size: tuple(int, int, int)
-    :param diameter: diameter of the random spheres in voxels
+    :param diameter: diameter of the random spheres in voxels (mean diameter if diameter_std > 0)
     :type diameter: float
     :param porosity: target porosity of the generated structure
     :type porosity: float
     :param allow_intersect: allow the spheres to intersect or not
     :type allow_intersect: bool
+    :param diameter_std: standard deviation of the (normal) diameter distribution, for polydisperse spheres.
+        Diameters are truncated to [1, diameter + 4 * diameter_std]
+    :type diameter_std: float, optional
+    :param batch_size: number of candidate spheres generated and tested together
+    :type batch_size: int, optional
+    :param workers: number of threads used to rasterize the spheres (all available cores if None)
+    :type workers: int, optional
+    :param periodic: the spheres crossing a face of the domain wrap around to the opposite face, producing a
+        periodic structure (intersections are also tested across the faces)
+    :type periodic: bool, optional
+    :param specific_area: target specific surface area (in 1/m, for the default voxel length of 1e-6 m). If set, the
+        generation stops as soon as either this specific area or the porosity is reached. The specific area is
+        tracked incrementally from the voxel faces, so it approximates the one computed on the final domain
+    :type specific_area: float, optional
     :return: domain with random spheres with input diameter
     :rtype: Workspace
     """
 
-    generator = GeneratorSpheres(size, diameter, porosity, allow_intersect)
+    generator = GeneratorSpheres(size, diameter, porosity, allow_intersect, diameter_std, batch_size, workers,
+                                 periodic, specific_area)
 
     generator.error_check()
 
@@ -31,105 +52,197 @@ def generate_random_spheres(size, diameter, porosity, allow_intersect=True):
 
 
 class GeneratorSpheres:
-    def __init__(self, size, diameter, porosity, allow_intersect):
+    def __init__(self, size, diameter, porosity, allow_intersect, diameter_std=0., batch_size=1024, workers=None,
+                 periodic=False, specific_area=None):
         self._workspace = Workspace()
         self._size = size
         self._diameter = diameter
         self._porosity = porosity
         self._allow_intersect = allow_intersect
+        self._diameter_std = diameter_std
+        self._batch_size = batch_size
+        self._workers = get_workers(workers)
+        self._periodic = periodic
+        self._specific_area = specific_area
 
-        self._size_padded = (self._size[0]+4*diameter, self._size[1]+4*diameter, self._size[2]+4*diameter)
-        self._start = 2 * diameter
-        self._endX = size[0] + self._start
-        self._endY = size[1] + self._start
-        self._endZ = size[2] + self._start
+        # periodic KD-trees measure the distances across the faces of the domain
+        self._boxsize = np.array(size, dtype=float) if periodic else None
 
-        self._placed_sphere_list = [(-1e6, -1e6, -1e6)]
+        # largest diameter that can be drawn, which sets the neighbor search radius
+        self._max_diameter = diameter + 4 * diameter_std
 
-        # size of the created sphere block
-        self._spheresize = int(self._diameter+4)
-        if self._spheresize % 2 == 0:
-            self._size_m = self._spheresize / 2
-            self._size_p = self._spheresize / 2
-        else:
-            self._size_m = int(self._spheresize / 2.)+1
-            self._size_p = int(self._spheresize / 2.)
+        # all the placed spheres, rasterized once the target porosity is reached
+        self._centers = []
+        self._diameters = []
+
+        # descriptors updated with each placed sphere. The solid mask is only needed to count the overlaps of
+        # intersecting spheres, or to track the surface area
+        self._tracker = None
+
+        # neighbor index of the placed spheres: KD-tree rebuilt periodically, plus the spheres placed since then
+        self._tree = None
+        self._tree_diameters = np.zeros(0)
+        self._pending_centers = []
+        self._pending_diameters = []
 
     def generate(self):
-        self._workspace.resize_new_matrix(self._size_padded)
+        self._tracker = DescriptorTracker(self._size, self._workspace.voxel_length,
+                                          surface=self._specific_area is not None, mask=self._allow_intersect)
         self._generate_spheres()
+        self._tracker.mask = None
 
+        self._workspace.resize_new_matrix(self._size)
+        self._rasterize()
         return self._workspace
 
     def _generate_spheres(self):
-        sphere = get_sphere(self._diameter)
-        radius = self._diameter / 2.
-        volume_per_sphere = 4./3. * np.pi * radius**3
-        volume_all_spheres = self._size[0] * self._size[1] * self._size[2] * (1-self._porosity)
-
-        approx_num_spheres = volume_all_spheres / volume_per_sphere / self._porosity
-        print("Approximately " + str(approx_num_spheres) + " spheres to be generated")
-
-        current_volume = 0
-        approx_volume_left = volume_all_spheres - current_volume
-        approx_spheres_left = approx_volume_left / volume_per_sphere
-
-        current_porosity = 1
-        localCount = 0
-        totalCount = 0
-
-        while current_porosity > self._porosity:
-            x = np.random.randint(self._size[0] + 2 * self._diameter) + self._diameter
-            y = np.random.randint(self._size[1] + 2 * self._diameter) + self._diameter
-            z = np.random.randint(self._size[2] + 2 * self._diameter) + self._diameter
-            xm = int(x - self._size_m)
-            xp = int(x + self._size_p)
-            ym = int(y - self._size_m)
-            yp = int(y + self._size_p)
-            zm = int(z - self._size_m)
-            zp = int(z + self._size_p)
-
-            if self._allow_intersect:
-                self._workspace.matrix[xm:xp, ym:yp, zm:zp] += sphere
-            else:
-                intersection = False
-                for location in self._placed_sphere_list:
-                    if np.sqrt( (x-location[0])*(x-location[0]) +
-                                (y-location[1])*(y-location[1]) +
-                                (z-location[2])*(z-location[2]) ) < self._diameter:
-                        intersection = True
+        volume_all_spheres = self._size[0] * self._size[1] * self._size[2] * (1 - self._porosity)
+        mean_volume_per_sphere = 4. / 3. * np.pi * (self._diameter / 2.) ** 3
+        print("Approximately " + str(volume_all_spheres / mean_volume_per_sphere) + " spheres to be generated")
+
+        total_count = 0
+        unsuccessful_batches = 0
+
+        while not self._target_reached():
+            centers, diameters = self._generate_candidates()
+            if not self._allow_intersect:
+                accepted = self._non_intersecting(centers, diameters)
+                centers, diameters = centers[accepted], diameters[accepted]
+                if centers.shape[0] == 0:
+                    unsuccessful_batches += 1
+                    if unsuccessful_batches == 200:
+                        print_warning("Could not insert more non-intersecting spheres, stopping at porosity {}"
+                                      .format(self._tracker.porosity))
                         break
-                if intersection:
                     continue
+                unsuccessful_batches = 0
+
+            for center, diameter in zip(centers, diameters):
+                self._stamp_sphere(center, diameter)
+                self._centers.append(center)
+                self._diameters.append(diameter)
+                total_count += 1
+                if not self._allow_intersect:
+                    self._pending_centers.append(center)
+                    self._pending_diameters.append(diameter)
+
+                # descriptors updated from the contribution of each sphere, instead of scanning the domain
+                if self._target_reached():
+                    break
+            sys.stdout.write("\rSpheres Generated {}  Porosity = {} ".format(total_count, self._tracker.porosity))
+
+            if len(self._pending_centers) > max(256, self._tree_diameters.shape[0] // 4):
+                self._rebuild_tree()
+        print()
+
+    def _generate_candidates(self):
+        # centers drawn from [-max_diameter, size + max_diameter) in domain coordinates, or [0, size) if periodic
+        low = 0 if self._periodic else -int(np.ceil(self._max_diameter))
+        centers = np.column_stack([np.random.randint(low, self._size[i] - low, self._batch_size) for i in range(3)])
+        if self._diameter_std > 0:
+            diameters = np.random.normal(self._diameter, self._diameter_std, self._batch_size)
+            diameters = np.round(np.clip(diameters, 1, self._max_diameter), 1)
+        else:
+            diameters = np.full(self._batch_size, float(self._diameter))
+        return centers.astype(float), diameters
+
+    def _non_intersecting(self, centers, diameters):
+        accepted = np.ones(centers.shape[0], dtype=bool)
+
+        # against the spheres in the KD-tree, and the ones placed since its last rebuild
+        self._reject_overlaps(centers, diameters, self._tree, self._tree_diameters, accepted)
+        if len(self._pending_centers) > 0:
+            self._reject_overlaps(centers, diameters, cKDTree(np.array(self._pending_centers), boxsize=self._boxsize),
+                                  np.array(self._pending_diameters), accepted)
+
+        # within the batch: a candidate is rejected if it intersects an earlier accepted one
+        indices = np.where(accepted)[0]
+        if indices.size > 1:
+            pairs = cKDTree(centers[indices], boxsize=self._boxsize).query_pairs(self._max_diameter,
+                                                                                  output_type='ndarray')
+            if pairs.shape[0] > 0:
+                first, second = indices[pairs.min(axis=1)], indices[pairs.max(axis=1)]
+                if self._periodic:
+                    dist = np.linalg.norm(periodic_difference(centers[first], centers[second], self._size), axis=1)
                 else:
-                    self._workspace.matrix[xm:xp, ym:yp, zm:zp] += sphere
-                    self._placed_sphere_list.append((x, y, z))
+                    dist = np.linalg.norm(centers[first] - centers[second], axis=1)
+                overlap = dist < (diameters[first] + diameters[second]) / 2.
+                first, second = first[overlap], second[overlap]
+                for n in np.argsort(second, kind='stable'):
+                    if accepted[first[n]]:
+                        accepted[second[n]] = False
+        return accepted
+
+    def _reject_overlaps(self, centers, diameters, tree, tree_diameters, accepted):
+        if tree is None:
+            return
+        pairs = cKDTree(centers, boxsize=self._boxsize).sparse_distance_matrix(tree, self._max_diameter,
+                                                                                output_type='ndarray')
+        overlap = pairs['v'] < (diameters[pairs['i']] + tree_diameters[pairs['j']]) / 2.
+        accepted[pairs['i'][overlap]] = False
+
+    def _rebuild_tree(self):
+        if self._tree is not None:
+            centers = np.vstack((self._tree.data, self._pending_centers))
+        else:
+            centers = np.array(self._pending_centers)
+        self._tree_diameters = np.concatenate((self._tree_diameters, self._pending_diameters))
+        self._tree = cKDTree(centers, boxsize=self._boxsize)
+        self._pending_centers = []
+        self._pending_diameters = []
+
+    def _images(self, centers, diameters):
+        # periodic images of the spheres that reach the domain, each clipped to it when stamped
+        if not self._periodic:
+            return centers, diameters
+        reach = diameters[:, np.newaxis] / 2. + 2
+        indices, shifts = periodic_images(centers - reach, centers + reach + 1, self._size)
+        return centers[indices] + shifts, diameters[indices]
 
-            localCount += 1
-            totalCount += 1
+    def _target_reached(self):
+        if self._tracker.porosity <= self._porosity:
+            return True
+        return self._specific_area is not None and self._tracker.specific_area >= self._specific_area
 
-            if localCount > 0.5 * approx_spheres_left:
-                localCount = 0
+    def _stamp_sphere(self, center, diameter):
+        # adds the domain voxels a sphere turns solid (i.e. above 127) to the tracked descriptors
+        for image in self._images(center[np.newaxis], np.array([diameter]))[0]:
+            profile = sphere_profile(image, diameter, (0, 0, 0), self._size)
+            if profile is not None:
+                self._tracker.stamp(profile[0], profile[1] > 127)
 
-                mask = self._workspace.matrix[self._start:self._endX, self._start:self._endY, self._start:self._endZ] >= 0
-                mask_high = self._workspace.matrix[self._start:self._endX, self._start:self._endY, self._start:self._endZ] <= 127
-                mask = mask * mask_high
-                current_porosity = float(np.sum(mask)) / float(self._size[0] * self._size[1] * self._size[2])
+    def _rasterize(self):
+        # the spheres are stamped slab by slab along x on a thread pool, directly in the output domain.
+        # Overlaps are composed with a max, so that the values cannot overflow
+        if len(self._centers) == 0:
+            return
+        matrix = self._workspace.matrix
+        centers, diameters = self._images(np.array(self._centers, dtype=float), np.array(self._diameters))
+        order = np.argsort(centers[:, 0], kind='stable')
+        centers, diameters = centers[order], diameters[order]
+        reach = self._max_diameter / 2. + 2
 
-                current_volume = self._size[0] * self._size[1] * self._size[2] * (1 - current_porosity)
-                approx_volume_left = volume_all_spheres - current_volume
-                approx_spheres_left = approx_volume_left / volume_per_sphere
-                sys.stdout.write("\rSpheres Generated {}  Porosity = {} ".format(totalCount, current_porosity))
+        def process(slab):
+            start, end = slab
+            first, last = np.searchsorted(centers[:, 0], [start - reach, end + reach])
+            block = matrix[start:end]
+            for n in range(first, last):
+                profile = sphere_profile(centers[n], diameters[n], (start, 0, 0), block.shape)
+                if profile is not None:
+                    view = block[profile[0]]
+                    np.maximum(view, profile[1], out=view)
 
-        self._workspace.matrix = self._workspace.matrix[self._start:self._endX, self._start:self._endY, self._start:self._endZ]
-        self._workspace.matrix[self._workspace.matrix > 255] = 255
-        self._workspace.matrix = self._workspace.matrix.astype(np.uint16)
+        run_in_pool(process, split_slabs(self._size[0], 4 * self._workers), self._workers)
 
     def log_input(self):
         self._workspace.log.log_section("Generating Random Spheres")
         self._workspace.log.log_value("Domain Size", self._size)
         self._workspace.log.log_value("Diameter", self._diameter)
+        self._workspace.log.log_value("Diameter standard deviation", self._diameter_std)
         self._workspace.log.log_value("Porosity", self._porosity)
+        self._workspace.log.log_value("Periodic", self._periodic)
+        if self._specific_area is not None:
+            self._workspace.log.log_value("Specific area", self._specific_area)
         self._workspace.log.write_log()
 
     def log_output(self):
@@ -139,4 +252,10 @@ class GeneratorSpheres:
     def error_check(self):
         check.size_check(self._size)
         check.greater_than_exc(self._diameter, 0, "diameter")
+        check.greater_than_inc(self._diameter_std, 0, "diameter_std")
+        check.greater_than_exc(self._batch_size, 0, "batch_size")
         check.range_exc(self._porosity, (0, 1), "porosity")
+        if self._specific_area is not None:
+            check.greater_than_exc(self._specific_area, 0, "specific_area")
+        if self._periodic and self._max_diameter >= min(self._size):
+            raise Exception("Error, periodic spheres need to be smaller than the domain")
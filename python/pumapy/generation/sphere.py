@@ -13,6 +13,36 @@ def get_sphere(diameter):
     return sphere
 
 
+def sphere_profile(center, diameter, origin, shape):
+    """ Gray-scale profile of a sphere (same tanh transition as get_sphere), evaluated only within its bounding box
+    clipped to a block of a domain
+
+    :param center: center of the sphere in domain voxel coordinates
+    :type center: ndarray
+    :param diameter: diameter of the sphere in voxels
+    :type diameter: float
+    :param origin: domain coordinates of the first voxel of the block
+    :type origin: tuple(int, int, int)
+    :param shape: shape of the block
+    :type shape: tuple(int, int, int)
+    :return: slices of the block covered by the sphere and the uint16 values there, or None if they do not overlap
+    :rtype: tuple(tuple(slice, slice, slice), ndarray) or None
+    """
+    radius = diameter / 2.
+    reach = radius + 2.
+    low = [max(int(np.ceil(center[i] - reach)) - origin[i], 0) for i in range(3)]
+    high = [min(int(np.floor(center[i] + reach)) + 1 - origin[i], shape[i]) for i in range(3)]
+    if any(high[i] <= low[i] for i in range(3)):
+        return None
+
+    # separable squared distances, broadcast to the box
+    dx, dy, dz = [(np.arange(low[i], high[i]) + origin[i] - center[i]) ** 2 for i in range(3)]
+    dist = np.sqrt(dx[:, None, None] + dy[None, :, None] + dz[None, None, :])
+    values = 255. - 127.5 * (1 + np.tanh(dist - radius))
+    values[values < 0] = 0
+    return tuple(slice(low[i], high[i]) for i in range(3)), values.astype(np.uint16)
+
+
 def get_circle(diameter):
     radius = diameter / 2.
     shape = (int(diameter+4), int(diameter+4))
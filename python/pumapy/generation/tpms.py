@@ -1,20 +1,29 @@
 from pumapy import Workspace
 from pumapy.utilities.timer import Timer
-from pumapy.generation.tpms_utils import generate
+from pumapy.utilities.parallel import get_workers, split_slabs, run_in_pool
 import numpy as np
 
 
-def generate_tpms(size, w, q, equation=0):
+def generate_tpms(size, w, q, equation=0, output=None, workers=None):
     """ Generation of triply periodic minimal surface material
 
+    The implicit field (plus q) is clamped to [0.8, 1.2] and mapped to [0, 255], so that the surface at 1.0 lies
+    at the 127.5 gray value.
+
     :param size: size of 3D domain (x,y,z)
     :type size: tuple(int, int, int)
     :param w: w parameter for tpms
     :type w: float or tuple(float, float)
     :param q: q parameter for tpms (float or tuple)
     :type q: float or tuple(float, float)
-    :param equation: equation 0, 1, or 2 for tpms
-    :type equation: int
+    :param equation: equation 0, 1, or 2 for tpms, or a user function f(x, y, z, w, q) returning the implicit field
+        (q included) from broadcastable NumPy arrays: x, y, z are the voxel indices and w, q vary along z
+    :type equation: int or callable
+    :param output: path of a raw file where the uint16 domain is written as a np.memmap, for domains larger than
+        the memory (in memory if None)
+    :type output: string, optional
+    :param workers: number of threads (all available cores if None)
+    :type workers: int, optional
     :return: TPMS domain
     :rtype: Workspace
     """
@@ -33,7 +42,7 @@ def generate_tpms(size, w, q, equation=0):
     else:
         raise Exception("Invalid w, must be float or tuple")
 
-    generator = GeneratorTPMS(size, _w, _q, equation)
+    generator = GeneratorTPMS(size, _w, _q, equation, output, workers)
 
     generator.error_check()
 
@@ -44,7 +53,7 @@ def generate_tpms(size, w, q, equation=0):
 
 
 class GeneratorTPMS:
-    def __init__(self, size, w, q, equation=0):
+    def __init__(self, size, w, q, equation=0, output=None, workers=None, slab_voxels=2**20):
         self._workspace = Workspace()
         self._size = size
         self._wmin = w[0]
@@ -52,17 +61,66 @@ class GeneratorTPMS:
         self._qmin = q[0]
         self._qmax = q[1]
         self._equation = equation
+        self._output = output
+        self._workers = get_workers(workers)
+        self._slab_voxels = slab_voxels
 
     def generate(self):
         t = Timer()
-        self._workspace.resize_new_matrix(self._size)
-        self._workspace.matrix = generate(self._workspace.matrix.astype(float), self._size[0], self._size[1],
-                                          self._size[2], self._wmin, self._wmax, self._qmin, self._qmax, self._equation)
-        self._workspace.matrix = (255. * (self._workspace.matrix - np.min(self._workspace.matrix)) /
-                                  np.ptp(self._workspace.matrix)).astype(np.uint16)
+        if self._output is None:
+            self._workspace.resize_new_matrix(self._size)
+        else:
+            self._workspace.matrix = np.memmap(self._output, dtype=np.uint16, mode='w+', shape=self._size)
+
+        # w and q vary linearly along z
+        fraction = np.arange(self._size[2]) / max(float(self._size[2]) - 1, 1.)
+        self._w = self._wmin + fraction * (self._wmax - self._wmin)
+        self._q = self._qmin + fraction * (self._qmax - self._qmin)
+
+        # the built-in equations are separable: per-axis sin/cos tables, with the x ones computed per slab
+        if not callable(self._equation):
+            self._sin_y = np.sin(self._w * np.arange(self._size[1])[:, np.newaxis])
+            self._cos_y = np.cos(self._w * np.arange(self._size[1])[:, np.newaxis])
+            self._sin_z = np.sin(self._w * np.arange(self._size[2]))
+            self._cos_z = np.cos(self._w * np.arange(self._size[2]))
+
+        plane = self._size[1] * self._size[2]
+        nslabs = max(self._workers, int(np.ceil(self._size[0] * plane / float(self._slab_voxels))))
+        run_in_pool(self._generate_slab, split_slabs(self._size[0], nslabs), self._workers)
+
+        if isinstance(self._workspace.matrix, np.memmap):
+            self._workspace.matrix.flush()
         print("Generated in: " + str(t.elapsed()) + " seconds")
         return self._workspace
 
+    def _generate_slab(self, slab):
+        start, end = slab
+        if callable(self._equation):
+            x, y, z = np.ogrid[start:end, 0:self._size[1], 0:self._size[2]]
+            field = np.array(self._equation(x, y, z, self._w, self._q), dtype=float)
+            field = np.broadcast_to(field, (end - start, self._size[1], self._size[2])).copy()
+        else:
+            field = self._separable_field(start, end)
+            field += self._q
+
+        # single pass clamp and quantization into the uint16 output
+        np.clip(field, 0.8, 1.2, out=field)
+        field -= 0.8
+        field *= 255.
+        field /= (1.2 - 0.8)
+        self._workspace.matrix[start:end] = field
+
+    def _separable_field(self, start, end):
+        w_x = self._w * np.arange(start, end)[:, np.newaxis]
+        sin_x, cos_x = np.sin(w_x)[:, np.newaxis], np.cos(w_x)[:, np.newaxis]
+        sin_y, cos_y = self._sin_y[np.newaxis], self._cos_y[np.newaxis]
+        sin_z, cos_z = self._sin_z, self._cos_z
+        if self._equation == 0:
+            return sin_x * sin_y * sin_z + sin_x * cos_y * cos_z + cos_x * sin_y * cos_z + cos_x * cos_y * sin_z
+        elif self._equation == 1:
+            return cos_x * sin_y + cos_y * sin_z + cos_z * cos_x
+        return cos_x + cos_y + cos_z
+
     def log_input(self):
         self._workspace.log.log_section("Generating TPMS")
         self._workspace.log.log_line("Domain Size: " + str(self._size))
@@ -96,7 +154,7 @@ class GeneratorTPMS:
             raise Exception("Error, invalid q, must be >= 0")
         if self._qmax <= 0:
             raise Exception("Error, invalid q, must be >= 0")
-        if self._qmax < self._wmin:
+        if self._qmax < self._qmin:
             raise Exception("Error, invalid q, q[1] cannot be < q[0]")
-        if self._equation != 0 and self._equation != 1 and self._equation != 2:
-            raise Exception("Error, invalid equation number. Must be 0, 1, or 2")
+        if not callable(self._equation) and self._equation not in (0, 1, 2):
+            raise Exception("Error, invalid equation number. Must be 0, 1, or 2, or a function")
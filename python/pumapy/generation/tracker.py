@@ -0,0 +1,89 @@
+import numpy as np
+
+
+class DescriptorTracker:
+    """ Incremental tracking of the descriptors of a structure while a generator adds solid objects to it
+
+    The generators report the exact number of voxels turned solid by each object, so that the volume fraction is
+    available at any time without scanning the domain. If surface is True, the tracker also keeps the solid mask and
+    the number of solid-void faces between voxels, updated only around each stamped object. The specific surface area
+    is then estimated as 2/3 of the area of these faces, which is the mean ratio between the true area and the
+    voxel face area of an isotropic surface.
+
+    :param shape: size of 3D domain (x,y,z)
+    :type shape: tuple(int, int, int)
+    :param voxel_length: size of a voxel side, used for the specific surface area
+    :type voxel_length: float, optional
+    :param surface: track the specific surface area (and the solid mask)
+    :type surface: bool, optional
+    :param mask: keep the solid mask, needed to stamp objects that can overlap (always kept if surface is True)
+    :type mask: bool, optional
+    """
+
+    def __init__(self, shape, voxel_length=1e-6, surface=False, mask=False):
+        self.shape = tuple(int(s) for s in shape)
+        self.voxel_length = voxel_length
+        self.total_voxels = int(np.prod(self.shape))
+        self.solid_voxels = 0
+        self.faces = 0
+        self.surface = surface
+        self.mask = np.zeros(self.shape, dtype=bool) if (surface or mask) else None
+
+    @property
+    def volume_fraction(self):
+        return self.solid_voxels / float(self.total_voxels)
+
+    @property
+    def porosity(self):
+        return 1. - self.volume_fraction
+
+    @property
+    def specific_area(self):
+        if not self.surface:
+            raise Exception("Error, the tracker was created without surface tracking")
+        return 2. / 3. * self.faces / (self.total_voxels * self.voxel_length)
+
+    def add(self, count):
+        """ Adds the number of voxels turned solid by objects rasterized elsewhere
+
+        :param count: number of new solid voxels
+        :type count: int
+        """
+        if self.surface:
+            raise Exception("Error, objects need to be stamped when tracking the surface area")
+        self.solid_voxels += int(count)
+
+    def stamp(self, block, solid):
+        """ Adds the solid voxels of an object within a block of the domain
+
+        :param block: slices of the domain covered by the object
+        :type block: tuple(slice, slice, slice)
+        :param solid: solid voxels of the object within the block
+        :type solid: ndarray
+        :return: number of voxels turned solid by the object
+        :rtype: int
+        """
+        if self.mask is None:
+            count = np.count_nonzero(solid)
+            self.solid_voxels += count
+            return count
+
+        if self.surface:
+            # the faces can only change within one voxel of the block
+            region = tuple(slice(max(b.start - 1, 0), min(b.stop + 1, s)) for b, s in zip(block, self.shape))
+            self.faces -= self._count_faces(self.mask[region])
+
+        new = solid & ~self.mask[block]
+        self.mask[block] |= new
+        count = np.count_nonzero(new)
+        self.solid_voxels += count
+
+        if self.surface:
+            self.faces += self._count_faces(self.mask[region])
+        return count
+
+    @staticmethod
+    def _count_faces(mask):
+        # solid-void pairs of neighboring voxels (the domain boundaries are not counted)
+        return (np.count_nonzero(mask[1:] != mask[:-1]) + np.count_nonzero(mask[:, 1:] != mask[:, :-1]) +
+                np.count_nonzero(mask[:, :, 1:] != mask[:, :, :-1]))
@@ -4,7 +4,9 @@ from pumapy.utilities.property_maps import IsotropicConductivityMap, Anisotropic
 
 
 def compute_thermal_conductivity(workspace, cond_map, direction, side_bc='s', prescribed_bc=None, tolerance=1e-4,
-                                 maxiter=10000, solver_type='bicgstab', display_iter=True, print_matrices=(0, 0, 0, 0, 0)):
+                                 maxiter=10000, solver_type='bicgstab', display_iter=True, print_matrices=(0, 0, 0, 0, 0),
+                                 workers=None, outputs='fields', preconditioner='jacobi', backend=None,
+                                 effective_tolerance=None, check_every=10, levels=1):
     """ Compute the thermal conductivity
 
     :param workspace: domain
@@ -27,15 +29,46 @@ def compute_thermal_conductivity(workspace, cond_map, direction, side_bc='s', pr
     :type display_iter: bool, optional
     :param print_matrices: corresponding to b, E, A, T, q decimal places. If 0, they are not printed
     :type print_matrices: tuple(5 bools), optional
+    :param workers: number of threads, each assembling the rows of a slab of the domain along the direction of the
+        solve (anisotropic conductivity), computing the fluxes of its slab, and applying its block of rows of the
+        matrix in the iterative solvers (all available cores if None)
+    :type workers: int, optional
+    :param outputs: flux field to compute: 'fields' (in memory), 'disk' (np.memmap on a temporary .npy file) or
+        'effective' (only the effective conductivity, accumulated slab by slab without any flux field, returned as
+        None). The temporary files are owned by the caller, and can be deleted with puma.remove_field
+    :type outputs: string, optional
+    :param preconditioner: preconditioner of the iterative solvers: 'jacobi', 'ilu' (incomplete LU), 'none', or a
+        callable returning a matrix or LinearOperator from the system matrix
+    :type preconditioner: string or callable, optional
+    :param backend: matrix-vector products of the iterative solvers: 'scipy', 'threads' (blocks of rows on the workers)
+        or 'petsc' (KSP solvers of petsc4py, if installed). If None, 'threads' for more than one worker
+    :type backend: string, optional
+    :param effective_tolerance: if not None, the iterative solver also stops once the effective conductivity along the
+        direction changes by less than this relative tolerance (e.g. 1e-3) over three consecutive estimates. It is
+        estimated every check_every iterations from the fluxes of the temperature iterate, and the trace of the
+        estimates is written in the log. For the anisotropic conductivity, the estimate is a linear function of the
+        temperatures whose coefficients are accumulated during the assembly: this costs about one extra flux
+        computation, and one extra vector of the size of the system
+    :type effective_tolerance: float, optional
+    :param check_every: number of iterations between two estimates of the effective conductivity
+    :type check_every: int, optional
+    :param levels: number of grids of the coarse-to-fine cascade (1 for a single solve). The domain is coarsened
+        levels - 1 times by 2x2x2 majority vote of its materials, and the solution of each level (from the coarsest,
+        solved from a linear guess without prescribed_bc) is interpolated as the initial guess of the next finer one,
+        to cut the iterations of large domains. The shape, solver time and iterations of each level are written in the
+        log
+    :type levels: int, optional
     :return: thermal conductivity, temperature field, flux
     :rtype: tuple(tuple(float, float, float), ndarray, ndarray)
     """
     if isinstance(cond_map, IsotropicConductivityMap):
         solver = IsotropicConductivity(workspace, cond_map, direction, side_bc, prescribed_bc, tolerance, maxiter,
-                                       solver_type, display_iter)
+                                       solver_type, display_iter, workers, outputs, preconditioner, backend,
+                                       effective_tolerance, check_every, levels)
     elif isinstance(cond_map, AnisotropicConductivityMap):
         solver = AnisotropicConductivity(workspace, cond_map, direction, side_bc, prescribed_bc, tolerance, maxiter,
-                                         solver_type, display_iter, print_matrices)
+                                         solver_type, display_iter, print_matrices, workers, outputs,
+                                         preconditioner, backend, effective_tolerance, check_every, levels)
     else:
         raise Exception("cond_map has to be an IsotropicConductivityMap or AnisotropicConductivityMap")
 
@@ -48,7 +81,10 @@ def compute_thermal_conductivity(workspace, cond_map, direction, side_bc='s', pr
 
 
 def compute_electrical_conductivity(workspace, cond_map, direction, side_bc='p', prescribed_bc=None, tolerance=1e-4,
-                                    maxiter=10000, solver_type='bicgstab', display_iter=True, print_matrices=(0, 0, 0, 0, 0)):
+                                    maxiter=10000, solver_type='bicgstab', display_iter=True,
+                                    print_matrices=(0, 0, 0, 0, 0), workers=None, outputs='fields',
+                                    preconditioner='jacobi', backend=None, effective_tolerance=None, check_every=10,
+                                    levels=1):
     """ Compute the electrical conductivity
 
     :param workspace: domain
@@ -71,8 +107,38 @@ def compute_electrical_conductivity(workspace, cond_map, direction, side_bc='p',
     :type display_iter: bool, optional
     :param print_matrices: corresponding to E, A, b, T, q decimal places. If 0, they are not printed
     :type print_matrices: tuple(5 bools), optional
+    :param workers: number of threads, each assembling the rows of a slab of the domain along the direction of the
+        solve (anisotropic conductivity), computing the fluxes of its slab, and applying its block of rows of the
+        matrix in the iterative solvers (all available cores if None)
+    :type workers: int, optional
+    :param outputs: flux field to compute: 'fields' (in memory), 'disk' (np.memmap on a temporary .npy file) or
+        'effective' (only the effective conductivity, accumulated slab by slab without any flux field, returned as
+        None). The temporary files are owned by the caller, and can be deleted with puma.remove_field
+    :type outputs: string, optional
+    :param preconditioner: preconditioner of the iterative solvers: 'jacobi', 'ilu' (incomplete LU), 'none', or a
+        callable returning a matrix or LinearOperator from the system matrix
+    :type preconditioner: string or callable, optional
+    :param backend: matrix-vector products of the iterative solvers: 'scipy', 'threads' (blocks of rows on the workers)
+        or 'petsc' (KSP solvers of petsc4py, if installed). If None, 'threads' for more than one worker
+    :type backend: string, optional
+    :param effective_tolerance: if not None, the iterative solver also stops once the effective conductivity along the
+        direction changes by less than this relative tolerance (e.g. 1e-3) over three consecutive estimates. It is
+        estimated every check_every iterations from the fluxes of the temperature iterate, and the trace of the
+        estimates is written in the log. For the anisotropic conductivity, the estimate is a linear function of the
+        temperatures whose coefficients are accumulated during the assembly: this costs about one extra flux
+        computation, and one extra vector of the size of the system
+    :type effective_tolerance: float, optional
+    :param check_every: number of iterations between two estimates of the effective conductivity
+    :type check_every: int, optional
+    :param levels: number of grids of the coarse-to-fine cascade (1 for a single solve). The domain is coarsened
+        levels - 1 times by 2x2x2 majority vote of its materials, and the solution of each level (from the coarsest,
+        solved from a linear guess without prescribed_bc) is interpolated as the initial guess of the next finer one,
+        to cut the iterations of large domains. The shape, solver time and iterations of each level are written in the
+        log
+    :type levels: int, optional
     :return: electrical conductivity, potential field, flux
     :rtype: tuple(tuple(float, float, float), ndarray, ndarray)
     """
     return compute_thermal_conductivity(workspace, cond_map, direction, side_bc, prescribed_bc, tolerance, maxiter,
-                                        solver_type, display_iter, print_matrices)
+                                        solver_type, display_iter, print_matrices, workers, outputs,
+                                        preconditioner, backend, effective_tolerance, check_every, levels)
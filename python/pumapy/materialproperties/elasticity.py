@@ -4,7 +4,9 @@ import numpy as np
 
 
 def compute_elasticity(workspace, elast_map, direction, side_bc='p', prescribed_bc=None, tolerance=1e-4,
-                       maxiter=10000, solver_type='bicgstab', display_iter=True, print_matrices=(0, 0, 0, 0, 0)):
+                       maxiter=10000, solver_type='bicgstab', display_iter=True, print_matrices=(0, 0, 0, 0, 0),
+                       workers=None, outputs='fields', preconditioner='jacobi', backend=None, effective_tolerance=None,
+                       check_every=10, levels=1):
     """ Compute the thermal conductivity (N.B. 0 material ID in workspace refers to air unless otherwise specified)
 
     :param workspace: domain
@@ -27,12 +29,41 @@ def compute_elasticity(workspace, elast_map, direction, side_bc='p', prescribed_
     :type display_iter: bool, optional
     :param print_matrices: corresponding to b, E, A, u, s decimal places. If 0, they are not printed
     :type print_matrices: tuple(5 ints), optional
+    :param workers: number of threads, each assembling the rows of a slab of the domain, computing the stresses of
+        its slab, and applying its block of rows of the matrix in the iterative solvers (all available cores if None)
+    :type workers: int, optional
+    :param outputs: stress fields to compute: 'fields' (in memory), 'disk' (np.memmap on temporary .npy files) or
+        'effective' (only the effective elasticity, accumulated slab by slab without any stress field, returned as
+        None). The temporary files are owned by the caller, and can be deleted with puma.remove_field
+    :type outputs: string, optional
+    :param preconditioner: preconditioner of the iterative solvers: 'jacobi', 'ilu' (incomplete LU), 'none', or a
+        callable returning a matrix or LinearOperator from the system matrix
+    :type preconditioner: string or callable, optional
+    :param backend: matrix-vector products of the iterative solvers: 'scipy', 'threads' (blocks of rows on the workers)
+        or 'petsc' (KSP solvers of petsc4py, if installed). If None, 'threads' for more than one worker
+    :type backend: string, optional
+    :param effective_tolerance: if not None, the iterative solver also stops once the effective stiffness along the
+        direction changes by less than this relative tolerance (e.g. 1e-3) over three consecutive estimates. It is
+        estimated every check_every iterations from the direct stresses of the displacement iterate, and the trace of
+        the estimates is written in the log. The estimate is a linear function of the displacements whose coefficients
+        are accumulated during the assembly: this costs about one extra stress computation, and one extra vector of
+        the size of the system
+    :type effective_tolerance: float, optional
+    :param check_every: number of iterations between two estimates of the effective stiffness
+    :type check_every: int, optional
+    :param levels: number of grids of the coarse-to-fine cascade (1 for a single solve). The domain is coarsened
+        levels - 1 times by 2x2x2 majority vote of its materials, and the solution of each level (from the coarsest,
+        solved from a linear guess without prescribed_bc) is interpolated as the initial guess of the next finer one,
+        to cut the iterations of large domains. The shape, solver time and iterations of each level are written in the
+        log
+    :type levels: int, optional
     :return: elasticity, displacement field, direct stresses, shear stresses
     :rtype: tuple(tuple(6 floats), ndarray, ndarray, ndarray)
     """
     if isinstance(elast_map, ElasticityMap):
         solver = Elasticity(workspace, elast_map, direction, side_bc, prescribed_bc, tolerance, maxiter,
-                            solver_type, display_iter, print_matrices)
+                            solver_type, display_iter, print_matrices, workers, outputs, preconditioner, backend,
+                            effective_tolerance, check_every, levels)
     else:
         raise Exception("elast_map has to be an ElasticityMap")
 
@@ -45,7 +76,8 @@ def compute_elasticity(workspace, elast_map, direction, side_bc='p', prescribed_
 
 
 def compute_stress_analysis(workspace, elast_map, prescribed_bc=None, side_bc='p', tolerance=1e-4,
-                            maxiter=10000, solver_type='bicgstab', display_iter=True, print_matrices=(0, 0, 0, 0, 0)):
+                            maxiter=10000, solver_type='bicgstab', display_iter=True, print_matrices=(0, 0, 0, 0, 0),
+                            workers=None, outputs='fields', preconditioner='jacobi', backend=None):
     """ Compute the thermal conductivity (N.B. 0 material ID in workspace refers to air unless otherwise specified)
 
     :param workspace: domain
@@ -66,12 +98,24 @@ def compute_stress_analysis(workspace, elast_map, prescribed_bc=None, side_bc='p
     :type display_iter: bool, optional
     :param print_matrices: corresponding to b, E, A, u, s decimal places. If 0, they are not printed
     :type print_matrices: tuple(5 ints), optional
+    :param workers: number of threads, each assembling the rows of a slab of the domain, computing the stresses of
+        its slab, and applying its block of rows of the matrix in the iterative solvers (all available cores if None)
+    :type workers: int, optional
+    :param outputs: stress fields in memory ('fields') or streamed to np.memmap on temporary .npy files ('disk'),
+        owned by the caller and can be deleted with puma.remove_field
+    :type outputs: string, optional
+    :param preconditioner: preconditioner of the iterative solvers: 'jacobi', 'ilu' (incomplete LU), 'none', or a
+        callable returning a matrix or LinearOperator from the system matrix
+    :type preconditioner: string or callable, optional
+    :param backend: matrix-vector products of the iterative solvers: 'scipy', 'threads' (blocks of rows on the workers)
+        or 'petsc' (KSP solvers of petsc4py, if installed). If None, 'threads' for more than one worker
+    :type backend: string, optional
     :return: displacement field, direct stresses, shear stresses 'yz', 'xz', 'xy'
     :rtype: tuple(ndarray, ndarray, ndarray)
     """
     if isinstance(elast_map, ElasticityMap):
         solver = Elasticity(workspace, elast_map, None, side_bc, prescribed_bc, tolerance, maxiter,
-                            solver_type, display_iter, print_matrices)
+                            solver_type, display_iter, print_matrices, workers, outputs, preconditioner, backend)
     else:
         raise Exception("elast_map has to be an ElasticityMap")
 
@@ -1,8 +1,14 @@
 import sys
+import copy
 import numpy as np
 from scipy.ndimage.filters import gaussian_filter
 from scipy.ndimage import distance_transform_edt
 from pumapy.utilities.generic_checks import check_ws_cutoff
+from pumapy.utilities.parallel import split_slabs, run_in_pool, get_workers, memory_bounded_workers
+from pumapy.utilities.property_maps import IsotropicConductivityMap
+from pumapy.utilities.logger import Logger, print_warning
+from pumapy.utilities.workspace import Workspace
+from pumapy.physicsmodels.isotropic_conductivity import IsotropicConductivity
 
 
 def compute_angular_differences(matrix, orientation1, orientation2, cutoff):
@@ -45,7 +51,7 @@ def compute_angular_differences(matrix, orientation1, orientation2, cutoff):
     return angle_diff, diff.mean(), diff.std()
 
 
-def compute_orientation_st(ws, sigma, rho, cutoff, edt=False):
+def compute_orientation_st(ws, sigma, rho, cutoff, edt=False, blocks=False, workers=None):
     """ Compute orientation of the material by the structure tensor algorithm
 
     :param ws: domain
@@ -58,10 +64,17 @@ def compute_orientation_st(ws, sigma, rho, cutoff, edt=False):
     :type cutoff: tuple(int, int)
     :param edt: indicating if we need to apply Euclidean Distance Transform before computing ST
     :type edt: bool
+    :param blocks: compute the structure tensor in slabs (only its 6 unique components, in float32) on a thread pool,
+        with a closed-form eigenvector solver. This cuts the memory footprint by about an order of magnitude and
+        the orientation is stored as float32
+    :type blocks: bool, optional
+    :param workers: number of threads used when blocks=True (None uses all cores), bounded so that their temporaries
+        stay within about 4 times the size of the input
+    :type workers: int, optional
     :return: True if successful, False otherwise.
     :rtype: bool
     """
-    solver = OrientationST(ws, sigma, rho, cutoff, edt)
+    solver = OrientationST(ws, sigma, rho, cutoff, edt, blocks, workers)
 
     solver.error_check()
     return solver.compute()
@@ -69,25 +82,30 @@ def compute_orientation_st(ws, sigma, rho, cutoff, edt=False):
 
 class OrientationST:
 
-    def __init__(self, ws, sigma, rho, cutoff, edt):
-        self.ws = ws.copy()
+    def __init__(self, ws, sigma, rho, cutoff, edt, blocks=False, workers=None):
+        self.ws = ws if blocks else ws.copy()
         self.ws_in = ws
 
         self.sigma = sigma
         self.rho = rho
         self.cutoff = cutoff
         self.edt = edt
+        self.blocks = blocks
+        self.workers = workers
 
         self.mask = None
         self.st = None
 
     def compute(self):
-        self.__compute_structuretensor()
-        self.__eigenvalue_analysis()
+        if self.blocks:
+            self.__compute_in_blocks()
+        else:
+            self.__compute_structuretensor()
+            self.__eigenvalue_analysis()
         return True
 
     def __compute_structuretensor(self):
-        self.ws.matrix = self.ws.matrix.astype(int)
+        self.ws.matrix = self.ws.matrix.astype(float)
         self.mask = np.logical_and(self.ws.matrix >= self.cutoff[0], self.ws.matrix <= self.cutoff[1])
 
         sys.stdout.write("First gradient computation ... ")
@@ -99,8 +117,8 @@ class OrientationST:
             Vy = gaussian_filter(distance, self.sigma, order=[0, 1, 0], mode='nearest')
             Vz = gaussian_filter(distance, self.sigma, order=[0, 0, 1], mode='nearest')
         else:
-            self.st = np.empty((self.ws.matrix.shape[0], self.ws.matrix.shape[1], self.ws.matrix.shape[2], 3, 3), dtype=int)
-            tmp = np.empty(self.ws.matrix.shape, dtype=int)
+            self.st = np.empty((self.ws.matrix.shape[0], self.ws.matrix.shape[1], self.ws.matrix.shape[2], 3, 3), dtype=float)
+            tmp = np.empty(self.ws.matrix.shape, dtype=float)
             Vx = gaussian_filter(self.ws.matrix, self.sigma, order=[1, 0, 0], mode='nearest')
             Vy = gaussian_filter(self.ws.matrix, self.sigma, order=[0, 1, 0], mode='nearest')
             Vz = gaussian_filter(self.ws.matrix, self.sigma, order=[0, 0, 1], mode='nearest')
@@ -131,5 +149,327 @@ class OrientationST:
         self.ws_in.orientation[self.mask] = np.linalg.eigh(self.st[self.mask])[1][:, :, 0]
         print("Done")
 
+    def __compute_in_blocks(self):
+        matrix = self.ws.matrix
+        shape = matrix.shape
+        if self.edt:
+            sys.stdout.write("Computing distance transform ... ")
+            matrix = distance_transform_edt(np.logical_and(matrix >= self.cutoff[0],
+                                                           matrix <= self.cutoff[1])).astype(np.float32)
+            print("Done")
+
+        # halo covering the derivative and the blurring kernels (gaussian_filter truncates at 4 sigma)
+        halo = int(4. * self.sigma + 0.5) + int(4. * self.rho + 0.5)
+        # each thread holds about 12 float32 per voxel of its slab and halos, and about 30 float32 per voxel of a
+        # chunk of the eigenvector solve: the temporaries of all threads are bounded by about 4 times the input (and by
+        # the free memory), which bounds the number of threads and the thickness of their slabs
+        plane = max(shape[1] * shape[2], 1)
+        chunk = 2 ** 16
+        budget = max(4 * self.ws.matrix.nbytes, 2 ** 26)
+        min_thickness = max(2 * halo, 1)
+        min_bytes = 4 * (12 * (min_thickness + 2 * halo) * plane + 30 * chunk)
+        workers = memory_bounded_workers(min(get_workers(self.workers), max(budget // min_bytes, 1)), min_bytes)
+        thickness = max((budget // workers - 4 * 30 * chunk) // (4 * 12 * plane) - 2 * halo, min_thickness)
+        slabs = split_slabs(shape[0], max(workers, int(np.ceil(shape[0] / thickness))))
+        self.ws_in.orientation = np.zeros(list(shape) + [3], dtype=np.float32)
+
+        def process(slab):
+            start, end = slab
+            lo, hi = max(start - halo, 0), min(end + halo, shape[0])
+            block = np.asarray(matrix[lo:hi], dtype=np.float32)
+
+            grads = [gaussian_filter(block, self.sigma, order=order, mode='nearest', output=np.float32)
+                     for order in ([1, 0, 0], [0, 1, 0], [0, 0, 1])]
+            del block
+
+            # 6 unique components of the blurred structure tensor: xx, yy, zz, xy, xz, yz
+            st = np.empty((6, end - start) + shape[1:], dtype=np.float32)
+            tmp = np.empty_like(grads[0])
+            for n, (a, b) in enumerate(((0, 0), (1, 1), (2, 2), (0, 1), (0, 2), (1, 2))):
+                np.multiply(grads[a], grads[b], out=tmp)
+                st[n] = gaussian_filter(tmp, self.rho, mode='nearest', output=np.float32)[start - lo:end - lo]
+            del grads, tmp
+
+            # closed form eigenvectors of the masked voxels, by chunks bounding the temporaries of the solve
+            index = np.flatnonzero(np.logical_and(self.ws.matrix[start:end] >= self.cutoff[0],
+                                                  self.ws.matrix[start:end] <= self.cutoff[1]))
+            st = st.reshape(6, -1)
+            orientation = self.ws_in.orientation[start:end].reshape(-1, 3)  # view of the slab
+            for first in range(0, index.size, chunk):
+                chunk_index = index[first:first + chunk]
+                orientation[chunk_index] = smallest_eigenvector_sym3(st[:, chunk_index].T)
+
+        sys.stdout.write("Computing structure tensor and eigenvectors in {} slabs ... ".format(len(slabs)))
+        run_in_pool(process, slabs, workers)
+        print("Done")
+
+    def error_check(self):
+        check_ws_cutoff(self.ws, self.cutoff)
+
+
+def smallest_eigenvector_sym3(st):
+    """ Unit eigenvectors of the smallest eigenvalues of symmetric 3x3 matrices, in closed form
+
+    :param st: unique components of N symmetric matrices as (N, 6) ordered as xx, yy, zz, xy, xz, yz
+    :type st: ndarray
+    :return: eigenvectors as (N, 3), in float32 for float32 components (float64 otherwise)
+    :rtype: ndarray
+    """
+    dtype = np.result_type(st.dtype, np.float32)
+    st = np.asarray(st, dtype=dtype)
+    a00, a11, a22, a01, a02, a12 = st.T
+
+    # smallest eigenvalue by the trigonometric solution of the characteristic cubic
+    q = (a00 + a11 + a22) / 3.
+    p2 = (a00 - q) ** 2 + (a11 - q) ** 2 + (a22 - q) ** 2 + 2. * (a01 ** 2 + a02 ** 2 + a12 ** 2)
+    p = np.sqrt(p2 / 6.)
+    del p2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        b00, b11, b22 = (a00 - q) / p, (a11 - q) / p, (a22 - q) / p
+        b01, b02, b12 = a01 / p, a02 / p, a12 / p
+        r = (b00 * (b11 * b22 - b12 * b12) - b01 * (b01 * b22 - b12 * b02) + b02 * (b01 * b12 - b11 * b02)) / 2.
+    del b00, b11, b22, b01, b02, b12
+    phi = np.arccos(np.clip(np.nan_to_num(r), -1., 1.)) / 3.
+    eig = q + 2. * p * np.cos(phi + 2. * np.pi / 3.)
+    del q, p, r, phi
+
+    # eigenvector as the largest cross product between two rows of (A - eig I), written in place
+    rows = np.empty((st.shape[0], 3, 3), dtype=dtype)
+    rows[:, 0, 0], rows[:, 0, 1], rows[:, 0, 2] = a00 - eig, a01, a02
+    rows[:, 1, 0], rows[:, 1, 1], rows[:, 1, 2] = a01, a11 - eig, a12
+    rows[:, 2, 0], rows[:, 2, 1], rows[:, 2, 2] = a02, a12, a22 - eig
+    del eig
+    crosses = np.empty_like(rows)
+    for n, (i, j) in enumerate(((0, 1), (0, 2), (1, 2))):
+        for c in range(3):
+            c1, c2 = (c + 1) % 3, (c + 2) % 3
+            crosses[:, n, c] = rows[:, i, c1] * rows[:, j, c2] - rows[:, i, c2] * rows[:, j, c1]
+    del rows
+    norms = np.linalg.norm(crosses, axis=2)
+    best = np.argmax(norms, axis=1)
+    vectors = crosses[np.arange(st.shape[0]), best]
+    best_norms = norms[np.arange(st.shape[0]), best]
+    del crosses, norms, best
+
+    # repeated smallest eigenvalue (or null tensor): fall back to the iterative solver
+    scale = np.max(np.abs(st), axis=1)
+    stable = best_norms > max(1e-6, 100 * np.finfo(dtype).eps) * scale ** 2
+    vectors[stable] /= best_norms[stable, np.newaxis]
+    if not np.all(stable):
+        unstable = st[~stable].astype(float)
+        full = unstable[:, [0, 3, 4, 3, 1, 5, 4, 5, 2]].reshape(-1, 3, 3)
+        vectors[~stable] = np.linalg.eigh(full)[1][:, :, 0]
+    return vectors
+
+
+def compute_orientation_rc(ws, cutoff, degree_accuracy=10, init_accuracy=None, workers=None):
+    """ Compute orientation of the material by the ray casting algorithm: rays are cast from each solid voxel in a
+    set of directions, and the orientation is the direction of the longest chord through the phase
+
+    :param ws: domain
+    :type ws: Workspace
+    :param cutoff: with grayscales to consider
+    :type cutoff: tuple(int, int)
+    :param degree_accuracy: angular separation between rays in degrees, exact divider of 180
+    :type degree_accuracy: int, optional
+    :param init_accuracy: if specified, a first pass is run with this (coarser) angular separation and the direction
+        is then refined with degree_accuracy rays around it. It has to be a multiple of degree_accuracy
+    :type init_accuracy: int, optional
+    :param workers: number of threads (None uses all cores)
+    :type workers: int, optional
+    :return: True if successful, False otherwise.
+    :rtype: bool
+    """
+    solver = OrientationRC(ws, cutoff, degree_accuracy, init_accuracy, workers)
+
+    solver.error_check()
+    return solver.compute()
+
+
+def compute_orientation_af(ws, cutoff, side_bc='s', tolerance=1e-4, maxiter=10000, solver_type='cg', workers=None):
+    """ Compute orientation of the material by the artificial flux algorithm: a conduction problem is solved in
+    each direction on the selected phase only (void is insulating), and the orientation is the direction of the
+    combined fluxes
+
+    :param ws: domain
+    :type ws: Workspace
+    :param cutoff: with grayscales to consider
+    :type cutoff: tuple(int, int)
+    :param side_bc: side boundary conditions can be symmetric ('s') or periodic ('p')
+    :type side_bc: string, optional
+    :param tolerance: tolerance for iterative solver
+    :type tolerance: float, optional
+    :param maxiter: maximum Iterations for solver
+    :type maxiter: int, optional
+    :param solver_type: solver type, options: 'bicgstab', 'cg', 'gmres', 'direct'
+    :type solver_type: string, optional
+    :param workers: number of threads running the three solves (None runs them all at once)
+    :type workers: int, optional
+    :return: True if successful, False otherwise.
+    :rtype: bool
+    """
+    solver = OrientationAF(ws, cutoff, side_bc, tolerance, maxiter, solver_type, workers)
+
+    solver.error_check()
+    return solver.compute()
+
+
+class OrientationRC:
+
+    def __init__(self, ws, cutoff, degree_accuracy, init_accuracy, workers):
+        self.ws = ws
+        self.cutoff = cutoff
+        self.degree_accuracy = degree_accuracy
+        self.init_accuracy = init_accuracy
+        self.workers = workers
+
+        self.solid = None
+        self.shape = None
+        self.max_distance = 0.
+
+    def compute(self):
+        self.shape = self.ws.matrix.shape
+        self.solid = np.logical_and(self.ws.matrix >= self.cutoff[0], self.ws.matrix <= self.cutoff[1])
+        self.max_distance = np.sqrt(3.) * max(self.shape)
+        coords = np.argwhere(self.solid)
+        self.solid = self.solid.ravel()
+
+        refine = self.init_accuracy is not None and self.init_accuracy != self.degree_accuracy
+        directions = self.__hemisphere_directions(self.init_accuracy if refine else self.degree_accuracy)
+        print("Number of rays per voxel: {}".format(directions.shape[0]))
+
+        # chunks of voxels such that about 2**20 rays are marched together
+        rays = directions.shape[0] if not refine else (2 * self.init_accuracy // self.degree_accuracy) ** 2
+        chunk_size = max(1, 2 ** 19 // rays)
+        chunks = [np.arange(start, min(start + chunk_size, coords.shape[0]))
+                  for start in range(0, coords.shape[0], chunk_size)]
+
+        def process(chunk):
+            points = coords[chunk] + 0.5
+            best = self.__longest(points, np.broadcast_to(directions, (points.shape[0],) + directions.shape))
+            if refine:
+                theta0 = np.degrees(np.arccos(np.clip(best[:, 2], -1, 1)))
+                phi0 = np.degrees(np.arctan2(best[:, 1], best[:, 0]))
+                offsets = np.arange(-self.init_accuracy, self.init_accuracy, self.degree_accuracy, dtype=float)
+                theta = np.radians(theta0[:, None, None] + offsets[None, :, None])
+                phi = np.radians(phi0[:, None, None] + offsets[None, None, :])
+                local = np.stack(np.broadcast_arrays(np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi),
+                                                     np.cos(theta)), axis=-1).reshape(points.shape[0], -1, 3)
+                best = self.__longest(points, local)
+            return best
+
+        sys.stdout.write("Casting rays from {} voxels ... ".format(coords.shape[0]))
+        results = run_in_pool(process, chunks, self.workers)
+        print("Done")
+
+        self.ws.set_orientation(np.zeros(self.shape + (3,), dtype=float))
+        if coords.shape[0] > 0:
+            self.ws.orientation[tuple(coords.T)] = np.concatenate(results)
+        return True
+
+    def __longest(self, points, directions):
+        # directions as (n_points, n_directions, 3): returns the direction giving the longest chord for each point
+        n, k = directions.shape[:2]
+        rays = directions.reshape(-1, 3)
+        distance = self.__march(np.repeat(points, k, axis=0).repeat(2, axis=0), np.stack((rays, -rays), axis=1).reshape(-1, 3))
+        chords = distance.reshape(n, k, 2).sum(axis=2)
+        return directions[np.arange(n), np.argmax(chords, axis=1)]
+
+    def __march(self, origins, directions, step=0.5):
+        # distance travelled by each ray before leaving the phase (or the domain)
+        distance = np.zeros(origins.shape[0])
+        alive = np.arange(origins.shape[0])
+        t = step
+        while alive.size > 0 and t <= self.max_distance:
+            vox = np.floor(origins[alive] + t * directions[alive]).astype(int)
+            inside = np.all((vox >= 0) & (vox < self.shape), axis=1)
+            alive, vox = alive[inside], vox[inside]
+            alive = alive[self.solid[(vox[:, 0] * self.shape[1] + vox[:, 1]) * self.shape[2] + vox[:, 2]]]
+            distance[alive] = t
+            t += step
+        return distance
+
+    @staticmethod
+    def __hemisphere_directions(accuracy):
+        # same sampling of the sphere as the ray tracing, keeping one of each pair of opposite directions
+        theta = np.radians(np.arange(accuracy, 180, accuracy, dtype=float))
+        phi = np.radians(np.arange(0, 360, accuracy, dtype=float))
+        theta, phi = np.meshgrid(theta, phi, indexing='ij')
+        directions = np.column_stack((np.sin(theta).ravel() * np.cos(phi).ravel(),
+                                      np.sin(theta).ravel() * np.sin(phi).ravel(), np.cos(theta).ravel()))
+        directions = np.vstack(([0., 0., 1.], directions))
+        directions[np.abs(directions) < 1e-12] = 0.
+        keep = (directions[:, 2] > 0) | ((directions[:, 2] == 0) & ((directions[:, 1] > 0) |
+                                                                     ((directions[:, 1] == 0) & (directions[:, 0] > 0))))
+        return directions[keep]
+
+    def error_check(self):
+        check_ws_cutoff(self.ws, self.cutoff)
+        if not isinstance(self.degree_accuracy, int) or self.degree_accuracy <= 0 or 180 % self.degree_accuracy != 0:
+            raise Exception("Ray separation can only be an exact divider of 180°")
+        if self.init_accuracy is not None:
+            if not isinstance(self.init_accuracy, int) or self.init_accuracy <= 0 or 180 % self.init_accuracy != 0:
+                raise Exception("Initial ray separation can only be an exact divider of 180°")
+            if self.init_accuracy % self.degree_accuracy != 0:
+                raise Exception("Refined ray separation has to be an exact divider of the initial one")
+
+
+class OrientationAF:
+
+    def __init__(self, ws, cutoff, side_bc, tolerance, maxiter, solver_type, workers):
+        self.ws = ws
+        self.cutoff = cutoff
+        self.side_bc = side_bc
+        self.tolerance = tolerance
+        self.maxiter = maxiter
+        self.solver_type = solver_type
+        self.workers = workers
+
+    def compute(self):
+        mask = np.logical_and(self.ws.matrix >= self.cutoff[0], self.ws.matrix <= self.cutoff[1])
+        seg_ws = Workspace.from_array(mask.astype(np.uint16))
+        seg_ws.voxel_length = self.ws.voxel_length
+
+        cond_map = IsotropicConductivityMap()
+        cond_map.add_material((0, 0), 0)
+        cond_map.add_material((1, 1), 1)
+
+        def solve(direction):
+            # each solve logs into its own in-memory logger, merged in order into the domain's log afterwards
+            dir_ws = copy.copy(seg_ws)
+            dir_ws.log = Logger()
+            dir_ws.log.set_location("")
+            solver = IsotropicConductivity(dir_ws, cond_map, direction, self.side_bc, None, self.tolerance,
+                                           self.maxiter, self.solver_type, False)
+            solver.error_check()
+            solver.log_input()
+            solver.compute()
+            solver.log_output()
+            return solver.q, dir_ws.log.log
+
+        results = run_in_pool(solve, ['x', 'y', 'z'], self.workers if self.workers is not None else 3)
+        fluxes = [flux for flux, _ in results]
+        for _, log in results:
+            self.ws.log.log += log
+        self.ws.log.write_log()
+
+        # orientations are axial: align the flux of each solve with the running sum before adding it
+        q = fluxes[0]
+        for flux in fluxes[1:]:
+            flip = np.einsum('ijkl,ijkl->ijk', q, flux) < 0
+            flux[flip] *= -1
+            q += flux
+        q[~mask] = 0
+        magnitude = np.linalg.norm(q, axis=3)
+        no_flux = np.logical_and(mask, magnitude == 0)
+        if np.any(no_flux):
+            print_warning("{} voxels carry no flux (isolated from the domain sides), orientation left as zero"
+                          .format(np.count_nonzero(no_flux)))
+        magnitude[magnitude == 0] = 1
+        self.ws.set_orientation(q / magnitude[:, :, :, np.newaxis])
+        return True
+
     def error_check(self):
         check_ws_cutoff(self.ws, self.cutoff)
+        if self.side_bc not in ['s', 'symmetric', 'Symmetric', 'p', 'periodic', 'Periodic']:
+            raise Exception("Invalid side boundary conditions, options are: 's', 'p'.")
@@ -0,0 +1,181 @@
+from pumapy.utilities.generic_checks import check_ws_cutoff
+from pumapy.utilities.parallel import get_workers, split_slabs, run_in_pool
+from skimage import measure
+import numpy as np
+import itertools
+
+
+def compute_partial_volume(workspace, cutoff, workers=None, slab_voxels=2**22):
+    """ Sub-voxel estimation of the volume fraction and surface area from the gray-scale values, without a mesh
+
+    The domain is processed in a single pass of slabs along x on a thread pool. The surface area is the area of the
+    marching cubes isosurface (same triangulation as skimage.measure.marching_cubes with method='lorensen'),
+    summed cell by cell from a lookup table of triangles per 2x2x2 configuration. The volume fraction is the sum of
+    the partial volumes of the voxels, estimated from their signed distance to the isosurface (i.e. the gray value
+    offset divided by the gradient magnitude), which reduces to counting the voxels for segmented domains.
+
+    :param workspace: domain
+    :type workspace: Workspace
+    :param cutoff: specify the solid phase
+    :type cutoff: tuple(int, int)
+    :param workers: number of threads (all available cores if None)
+    :type workers: int, optional
+    :param slab_voxels: approximate maximum number of voxels in a slab, bounding the temporaries per thread
+    :type slab_voxels: int, optional
+    :return: volume_fraction, area, specific_area, and the per-slab values as a structured array with fields
+        'start', 'end' (voxel range along x), 'volume_fraction' and 'area'
+    :rtype: tuple(float, float, float, numpy structured array)
+    """
+    check_ws_cutoff(workspace, cutoff)
+
+    partial_volume = PartialVolume(workspace, cutoff, workers, slab_voxels)
+
+    partial_volume.log_input()
+    partial_volume.compute()
+    partial_volume.log_output()
+
+    return partial_volume.volume_fraction, partial_volume.area, partial_volume.specific_area, partial_volume.slabs
+
+
+# corners of a marching cubes cell, with the bit of corner k set in the configuration index when it is solid
+_CORNERS = np.array(list(itertools.product((0, 1), repeat=3)))
+_EDGES = np.array([(a, b) for a in range(8) for b in range(a + 1, 8)
+                   if np.sum(np.abs(_CORNERS[a] - _CORNERS[b])) == 1])
+_TRIANGLES = None
+
+
+def _triangle_table():
+    """ Edges of the marching cubes triangles of each configuration, as (256, 5, 3), padded with -1"""
+    global _TRIANGLES
+    if _TRIANGLES is None:
+        table = np.full((256, 5, 3), -1, dtype=int)
+        edge_index = {tuple(sorted(edge)): n for n, edge in enumerate(_EDGES)}
+        for case in range(1, 255):
+            cell = np.zeros((2, 2, 2))
+            for k in range(8):
+                cell[tuple(_CORNERS[k])] = (case >> k) & 1
+            verts, faces = measure.marching_cubes(cell, 0.5, method='lorensen')[:2]
+
+            # every vertex is the midpoint of an edge of the cell
+            edges = []
+            for vert in verts:
+                low, high = np.floor(vert).astype(int), np.ceil(vert).astype(int)
+                corners = [int(np.where(np.all(_CORNERS == c, axis=1))[0][0]) for c in (low, high)]
+                edges.append(edge_index[tuple(sorted(corners))])
+            table[case, :faces.shape[0]] = np.array(edges)[faces]
+        _TRIANGLES = table
+    return _TRIANGLES
+
+
+class PartialVolume:
+
+    def __init__(self, workspace, cutoff, workers=None, slab_voxels=2**22):
+        self.workspace = workspace
+        self.cutoff = list(cutoff)
+        self.workers = get_workers(workers)
+        self.slab_voxels = slab_voxels
+        self.volume_fraction = -1.
+        self.area = -1.
+        self.specific_area = -1.
+        self.slabs = None
+
+    def compute(self):
+        # same isovalue as the isosurface: half-way between the cutoff and the next gray value
+        if float(self.cutoff[0]).is_integer():
+            self.cutoff[0] -= 0.5
+        if float(self.cutoff[1]).is_integer():
+            self.cutoff[1] += 0.5
+        triangles = _triangle_table()
+
+        matrix = self.workspace.matrix
+        len_x = matrix.shape[0]
+        plane = max(int(np.prod(matrix.shape[1:])), 1)
+        nslabs = max(self.workers, int(np.ceil(len_x / max(self.slab_voxels // plane, 1))))
+        slabs = split_slabs(len_x, nslabs)
+
+        def process(slab):
+            start, end = slab
+            # one voxel of halo on each side, for the gradient and the cells crossing the end of the slab
+            low, high = max(start - 1, 0), min(end + 1, len_x)
+            block = self._level_set(matrix[low:high])
+            return (self._partial_volumes(block, start - low, end - low).sum() / ((end - start) * plane),
+                    self._cells_area(block[start - low:min(end + 1, len_x) - low], triangles))
+
+        values = run_in_pool(process, slabs, self.workers)
+
+        voxel_length = self.workspace.voxel_length
+        volumes = np.array([v[0] for v in values])
+        areas = np.array([v[1] for v in values]) * voxel_length ** 2
+        thicknesses = np.array([end - start for start, end in slabs])
+
+        self.slabs = np.empty(len(slabs), dtype=[('start', np.int64), ('end', np.int64),
+                                                 ('volume_fraction', float), ('area', float)])
+        self.slabs['start'], self.slabs['end'] = np.array(slabs).T
+        self.slabs['volume_fraction'], self.slabs['area'] = volumes, areas
+        self.volume_fraction = float(np.sum(volumes * thicknesses) / len_x)
+        self.area = float(np.sum(areas))
+        volume = voxel_length ** 3 * (self.workspace.len_x() - 1) * \
+                 (self.workspace.len_y() - 1) * (self.workspace.len_z() - 1)
+        self.specific_area = self.area / volume
+
+    def _level_set(self, block):
+        # gray values folded about the middle of the cutoff range, so that the solid is above cutoff[0]
+        block = block.astype(float)
+        average = (self.cutoff[0] + self.cutoff[1]) / 2.
+        np.subtract(2 * average, block, out=block, where=block > average)
+        block -= self.cutoff[0]
+        return block
+
+    @staticmethod
+    def _partial_volumes(block, start, end):
+        # fraction of each voxel on the solid side of the isosurface, locally approximated by a plane.
+        # The gradient uses central differences with the values replicated at the domain faces, so that a step
+        # between two voxels always gives a distance of at least half a voxel, and segmented domains are counted exactly
+        padded = np.pad(block, 1, mode='edge')
+        level = block[start:end]
+        magnitude = ((padded[start + 2:end + 2, 1:-1, 1:-1] - padded[start:end, 1:-1, 1:-1]) ** 2 +
+                     (padded[start + 1:end + 1, 2:, 1:-1] - padded[start + 1:end + 1, :-2, 1:-1]) ** 2 +
+                     (padded[start + 1:end + 1, 1:-1, 2:] - padded[start + 1:end + 1, 1:-1, :-2]) ** 2)
+        magnitude = np.sqrt(magnitude) / 2.
+        distance = np.divide(level, magnitude, out=np.where(level > 0, np.inf, -np.inf), where=magnitude > 0)
+        return np.clip(0.5 + distance, 0, 1)
+
+    @staticmethod
+    def _cells_area(block, triangles):
+        # marching cubes area of the cells between the voxels of the block
+        if min(block.shape) < 2:
+            return 0.
+        shape = tuple(s - 1 for s in block.shape)
+        corners = [block[c[0]:c[0] + shape[0], c[1]:c[1] + shape[1], c[2]:c[2] + shape[2]] for c in _CORNERS]
+        case = np.zeros(shape, dtype=np.uint8)
+        for k in range(8):
+            case |= (corners[k] > 0).astype(np.uint8) << k
+
+        # only the cells crossed by the surface are gathered
+        cells = np.flatnonzero(np.logical_and(case != 0, case != 255))
+        if cells.size == 0:
+            return 0.
+        index = np.unravel_index(cells, shape)
+        values = np.stack([block[index[0] + c[0], index[1] + c[1], index[2] + c[2]] for c in _CORNERS], axis=1)
+        va, vb = values[:, _EDGES[:, 0]], values[:, _EDGES[:, 1]]
+        t = np.divide(va, va - vb, out=np.zeros_like(va), where=va != vb)
+        points = _CORNERS[_EDGES[:, 0]] + t[..., np.newaxis] * (_CORNERS[_EDGES[:, 1]] - _CORNERS[_EDGES[:, 0]])
+
+        edges = triangles[case.ravel()[cells]]
+        valid = edges[..., 0] >= 0
+        vertices = np.take_along_axis(points[:, np.newaxis], np.maximum(edges, 0)[..., np.newaxis], axis=2)
+        normal = np.cross(vertices[:, :, 1] - vertices[:, :, 0], vertices[:, :, 2] - vertices[:, :, 0])
+        return float(np.sum(np.where(valid, 0.5 * np.linalg.norm(normal, axis=2), 0)))
+
+    def log_input(self):
+        self.workspace.log.log_section("Computing Partial Volume and Surface Area")
+        self.workspace.log.log_line("Domain Size: " + str(self.workspace.get_shape()))
+        self.workspace.log.log_line("Cutoff: " + str(self.cutoff))
+        self.workspace.log.write_log()
+
+    def log_output(self):
+        self.workspace.log.log_section("Finished Partial Volume and Surface Area Calculation")
+        self.workspace.log.log_line("Volume Fraction: " + str(self.volume_fraction))
+        self.workspace.log.log_line("Surface Area: " + str(self.area))
+        self.workspace.log.log_line("Specific Surface Area: " + str(self.specific_area))
+        self.workspace.log.write_log()
@@ -1,11 +1,19 @@
-from pumapy.physicsmodels.fenics_stokes import Permeability
+from pumapy.physicsmodels.fv_stokes import FVPermeability
 
 
 def compute_permeability(workspace, direction, solid_cutoff, side_bc='fs', first_order=True, inf_sup=0.2,
                          pressure_driven=True, rel_tol=1e-8, abs_tol=1e-6, maxiter=10000, solver_type='bicgstab',
-                         prec_type=None, display_iter=16, export_path=None):
+                         prec_type=None, display_iter=16, export_path=None, void_mesh=False, method='fe'):
     """ Compute the permeability
 
+    The default method solves the Stokes equations with finite elements in FEniCS (dolfin needs to be installed).
+    With method='fv', they are instead solved with a staggered (MAC) finite volume scheme on the voxels, in pure
+    NumPy/SciPy: the velocities are on the faces between void voxels and the pressure on the void voxels. In that
+    case, first_order, inf_sup, abs_tol, prec_type, export_path and void_mesh are not used, the solid is never meshed,
+    'minres' is the recommended solver_type, display_iter > 0 prints the residual, and the pressure and velocity are
+    returned at the voxel centers. For the pressure-driven flow, the inlet and outlet pressures are imposed one voxel
+    outside the domain, whereas the body force case is periodic along the flow direction.
+
     :param workspace: domain
     :type workspace: Workspace
     :param direction: direction for solve ('x','y', or 'z')
@@ -35,11 +43,24 @@ def compute_permeability(workspace, direction, solid_cutoff, side_bc='fs', first
     :type display_iter: int, optional
     :param export_path: export path for intermediary steps (mesh_facets, p, v). If None (default), no export
     :type export_path: string, optional
+    :param void_mesh: mesh only the void voxels, which removes the solid degrees of freedom from the system (serial
+        runs only). The pressure and velocity are still returned on the full grid, with zeros in the solid
+    :type void_mesh: bool, optional
+    :param method: 'fe' for the FEniCS finite elements, 'fv' for the voxel finite volumes
+    :type method: string, optional
     :return: permeability, pressure field, velocity field
     :rtype: tuple(ndarray, ndarray, ndarray)
     """
-    solver = Permeability(workspace, direction, solid_cutoff, side_bc, first_order, inf_sup, pressure_driven,
-                          rel_tol, abs_tol, maxiter, solver_type, prec_type, display_iter, export_path)
+    if method == 'fv':
+        solver = FVPermeability(workspace, direction, solid_cutoff, side_bc, pressure_driven, rel_tol, maxiter,
+                                solver_type, display_iter > 0)
+    elif method == 'fe':
+        from pumapy.physicsmodels.fenics_stokes import Permeability
+        solver = Permeability(workspace, direction, solid_cutoff, side_bc, first_order, inf_sup, pressure_driven,
+                              rel_tol, abs_tol, maxiter, solver_type, prec_type, display_iter, export_path,
+                              void_mesh)
+    else:
+        raise Exception("Error, method has to be 'fe' or 'fv'")
 
     solver.error_check()
 
@@ -4,7 +4,8 @@ from pumapy.physicsmodels.isotropic_conductivity import IsotropicConductivity
 
 
 def compute_continuum_tortuosity(workspace, cutoff, direction, side_bc='p', prescribed_bc=None,
-                                 tolerance=1e-4, maxiter=10000, solver_type='cg', display_iter=True):
+                                 tolerance=1e-4, maxiter=10000, solver_type='cg', display_iter=True,
+                                 effective_tolerance=None, check_every=10, levels=1):
     """ Compute the tortuosity modelling the local conductivity as isotropic
 
     :param workspace: domain
@@ -25,6 +26,19 @@ def compute_continuum_tortuosity(workspace, cutoff, direction, side_bc='p', pres
     :type solver_type: string
     :param display_iter: display iterations and residual
     :type display_iter: bool
+    :param effective_tolerance: if not None, the iterative solver also stops once the effective diffusivity along the
+        direction changes by less than this relative tolerance (e.g. 1e-3) over three consecutive estimates. It is
+        estimated every check_every iterations from the fluxes of the concentration iterate, and the trace of the
+        estimates is written in the log
+    :type effective_tolerance: float, optional
+    :param check_every: number of iterations between two estimates of the effective diffusivity
+    :type check_every: int, optional
+    :param levels: number of grids of the coarse-to-fine cascade (1 for a single solve). The domain is coarsened
+        levels - 1 times by 2x2x2 majority vote of its phases, and the solution of each level (from the coarsest,
+        solved from a linear guess without prescribed_bc) is interpolated as the initial guess of the next finer one,
+        to cut the iterations of large domains. The shape, solver time and iterations of each level are written in the
+        log
+    :type levels: int, optional
     :return: tortuosity, diffusivity, porosity, concentration field
     :rtype: tuple(tuple(float, float, float), float, float, ndarrya)
     """
@@ -38,7 +52,8 @@ def compute_continuum_tortuosity(workspace, cutoff, direction, side_bc='p', pres
 
 
     solver = IsotropicConductivity(workspace, cond_map, direction, side_bc, prescribed_bc,
-                                   tolerance, maxiter, solver_type, display_iter)
+                                   tolerance, maxiter, solver_type, display_iter,
+                                   effective_tolerance=effective_tolerance, check_every=check_every, levels=levels)
 
     solver.error_check()
 
@@ -1,13 +1,14 @@
 from pumapy.utilities.workspace import Workspace
 from pumapy.utilities.boundary_conditions import ConductivityBC
-import sys
-import inspect
+from pumapy.utilities.parallel import get_workers
+from pumapy.physicsmodels.linear_solver import check_solver_options
 import numpy as np
 
 
 class Conductivity:
     def __init__(self, workspace, cond_map, direction, side_bc, prescribed_bc,
-                 tolerance, maxiter, solver_type, display_iter):
+                 tolerance, maxiter, solver_type, display_iter, workers=None, outputs='fields',
+                 preconditioner='jacobi', backend=None, effective_tolerance=None, check_every=10, levels=1):
         self.ws = workspace
         self.cond_map = cond_map
         self.direction = direction
@@ -17,9 +18,20 @@ class Conductivity:
         self.maxiter = maxiter
         self.solver_type = solver_type
         self.display_iter = display_iter
+        self.workers = get_workers(workers)
+        self.outputs = outputs
+        self.preconditioner = preconditioner
+        self.backend = backend
+        self.effective_tolerance = effective_tolerance
+        self.check_every = check_every
+        self.convergence_trace = None
+        self.levels = levels
+        self.initial_guess = None
+        self.level_stats = None
 
         self.keff = [-1., -1., -1.]
         self.solve_time = -1
+        self.iterations = 0
         self.T = np.zeros([1, 1, 1])
         self.q = np.zeros([1, 1, 1, 3])
         self.len_x = self.ws.matrix.shape[0]
@@ -44,6 +56,11 @@ class Conductivity:
         self.ws.log.log_section("Finished Conductivity Calculation")
         self.ws.log.log_line("Conductivity: " + "[" + str(self.keff) + "]")
         self.ws.log.log_line("Solver Time: " + str(self.solve_time))
+        if self.convergence_trace is not None:
+            self.ws.log.log_line("Effective Conductivity Trace (iteration, keff): " + str(self.convergence_trace))
+        if self.level_stats is not None:
+            self.ws.log.log_line("Levels (shape, solver time, iterations): " +
+                                 str(self.level_stats + [(self.ws.get_shape(), self.solve_time, self.iterations)]))
         self.ws.log.write_log()
 
     def error_check(self):
@@ -73,6 +90,17 @@ class Conductivity:
         else:
             raise Exception("Invalid side boundary conditions.")
 
+        # outputs checks
+        if self.outputs not in ('fields', 'effective', 'disk'):
+            raise Exception("Error, outputs has to be 'fields', 'effective' or 'disk'.")
+
+        # solver checks
+        check_solver_options(self.preconditioner, self.backend)
+        if self.effective_tolerance is not None and self.effective_tolerance <= 0:
+            raise Exception("Error, effective_tolerance has to be positive.")
+        if not isinstance(self.levels, int) or self.levels < 1:
+            raise Exception("Error, levels has to be a positive integer.")
+
         # prescribed_bc checks
         if self.prescribed_bc is not None:
             if not isinstance(self.prescribed_bc, ConductivityBC):
@@ -87,13 +115,3 @@ class Conductivity:
                 self.prescribed_bc.dirichlet = self.prescribed_bc.dirichlet.transpose((2, 1, 0))
             if np.any((self.prescribed_bc[[0, -1]] == np.Inf)):
                 raise Exception("prescribed_bc must be defined on the direction sides")
-
-
-class SolverDisplay(object):
-    def __init__(self):
-        self.niter = 0
-
-    def __call__(self, rk=None):
-        self.niter += 1
-        frame = inspect.currentframe().f_back
-        sys.stdout.write("\rIteration {}  Residual = {} ".format(self.niter, frame.f_locals['resid']))
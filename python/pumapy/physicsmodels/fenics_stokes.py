@@ -9,7 +9,8 @@ from pumapy.utilities.logger import print_warning
 class Permeability:
 
     def __init__(self, workspace, direction, cutoff, side_bc, first_order, inf_sup, pressure_driven,
-                 relative_tolerance, absolute_tolerance, maxiter, solver_type, prec_type, display_iter, export_path):
+                 relative_tolerance, absolute_tolerance, maxiter, solver_type, prec_type, display_iter, export_path,
+                 void_mesh=False):
 
         flags = ["-O3", "-ffast-math", "-march=native"]
         # df.parameters["form_compiler"]["quadrature_degree"] = 4
@@ -29,6 +30,7 @@ class Permeability:
         self.export_path = export_path
         self.len_x, self.len_y, self.len_z = self.ws.matrix.shape
         self.inf_sup = inf_sup
+        self.void_mesh = void_mesh
 
         if self.first_order:
             self.voxel_length = 1
@@ -42,11 +44,11 @@ class Permeability:
             self.p_in = df.Constant(0.)
             self.bf = df.Constant((1, 0, 0))
 
-        self.mesh = df.BoxMesh.create([df.Point(0, 0, 0), df.Point(self.ws.get_shape())],
-                                      self.ws.get_shape(), df.CellType.Type.hexahedron)
-        self.faces = df.MeshFunction("size_t", self.mesh, self.mesh.topology().dim() - 1)
-        self.P = df.FiniteElement("CG", self.mesh.ufl_cell(), 1)
-        self.V = df.VectorElement("CG", self.mesh.ufl_cell(), 1 if first_order else 2)
+        self.mesh = None
+        self.vertex_indices = None  # indices of the mesh vertices in the full grid of vertices, for the void mesh
+        self.faces = None
+        self.P = None
+        self.V = None
         self.W = None
         self.p = None
         self.u = None
@@ -76,6 +78,7 @@ class Permeability:
 
     def compute(self):
         self.modify_domain()
+        self.build_mesh()
         self.mark_domain()
         self.setup_bcs()
         self.construct_variational_form()
@@ -94,6 +97,34 @@ class Permeability:
         elif self.direction == "z":
             self.ws.matrix.transpose(2, 1, 0)
 
+    def build_mesh(self):
+        if self.void_mesh and df.MPI.size(df.MPI.comm_world) > 1:
+            print_warning("The void mesh cannot be built in parallel, meshing the whole domain instead.")
+            self.void_mesh = False
+
+        if self.void_mesh:
+            # hexahedra only for the void voxels: the solid degrees of freedom are not part of the system
+            vertices, cells, self.vertex_indices = void_mesh_arrays(self.ws.matrix == 1)
+            if cells.shape[0] == 0:
+                raise Exception("Error, the domain does not contain any void voxel.")
+            self.mesh = df.Mesh()
+            editor = df.MeshEditor()
+            editor.open(self.mesh, "hexahedron", 3, 3)
+            editor.init_vertices(vertices.shape[0])
+            editor.init_cells(cells.shape[0])
+            for n, vertex in enumerate(vertices):
+                editor.add_vertex(n, vertex)
+            for n, cell in enumerate(cells):
+                editor.add_cell(n, cell)
+            editor.close()
+        else:
+            self.mesh = df.BoxMesh.create([df.Point(0, 0, 0), df.Point(self.ws.get_shape())],
+                                          self.ws.get_shape(), df.CellType.Type.hexahedron)
+
+        self.faces = df.MeshFunction("size_t", self.mesh, self.mesh.topology().dim() - 1)
+        self.P = df.FiniteElement("CG", self.mesh.ufl_cell(), 1)
+        self.V = df.VectorElement("CG", self.mesh.ufl_cell(), 1 if self.first_order else 2)
+
     def setup_bcs(self):
         if self.side_bc == "p":
             if self.pressure_driven:
@@ -113,8 +144,9 @@ class Permeability:
             self.bcs.append(df.DirichletBC(self.W.sub(0), df.Constant((0., 0., 0.)), self.faces, 3))  # no slip y faces
             self.bcs.append(df.DirichletBC(self.W.sub(0), df.Constant((0., 0., 0.)), self.faces, 4))  # no slip z faces
 
-        self.bcs.append(df.DirichletBC(self.W.sub(1), df.Constant(0.), self.faces, 5))  # zero pressure inside
-        self.bcs.append(df.DirichletBC(self.W.sub(0), df.Constant((0., 0., 0.)), self.faces, 5))  # zero velocity inside
+        if not self.void_mesh:  # the void mesh has no facets inside the solid
+            self.bcs.append(df.DirichletBC(self.W.sub(1), df.Constant(0.), self.faces, 5))  # zero pressure inside
+            self.bcs.append(df.DirichletBC(self.W.sub(0), df.Constant((0., 0., 0.)), self.faces, 5))  # zero velocity
         self.bcs.append(df.DirichletBC(self.W.sub(0), df.Constant((0., 0., 0.)), self.faces, 6))  # no slip on surfaces
 
     def construct_variational_form(self):
@@ -190,9 +222,19 @@ class Permeability:
             self.keff = [self.keff[2], self.keff[1], self.keff[0]]
 
         # reconstruct pressure and velocity only when not running in parallel with MPI (cannot gather data to one proc)
-        if (self.len_x + 1) * (self.len_y + 1) * (self.len_z + 1) == self.p.compute_vertex_values().size:
+        if self.void_mesh:
+            # mapped back onto the full grid of vertices, with zero pressure and velocity on the solid-only vertices
+            grid = (self.len_x + 1, self.len_y + 1, self.len_z + 1)
+            self.pressure = np.zeros(np.prod(grid))
+            self.velocity = np.zeros((np.prod(grid), 3))
+            self.pressure[self.vertex_indices] = self.p.compute_vertex_values()
+            self.velocity[self.vertex_indices] = self.u.compute_vertex_values().reshape(3, -1).T
+            self.pressure = self.pressure.reshape(grid)
+            self.velocity = self.velocity.reshape(grid + (3,))
+        elif (self.len_x + 1) * (self.len_y + 1) * (self.len_z + 1) == self.p.compute_vertex_values().size:
             self.pressure = self.p.compute_vertex_values().reshape(self.len_z + 1, self.len_y + 1, self.len_x + 1).transpose(2, 1, 0)
             self.velocity = self.u.compute_vertex_values().reshape(3, self.len_z + 1, self.len_y + 1, self.len_x + 1).transpose(3, 2, 1, 0)
+        if self.pressure is not None:
             if self.direction == 'y':
                 self.pressure = self.pressure.transpose(1, 0, 2)
                 self.velocity = self.velocity.transpose(1, 0, 2, 3)[:, :, :, [1, 0, 2]]
@@ -257,41 +299,77 @@ class Permeability:
         # 4: z0 and z1
         # 5: inside solid
         # 6: solid surface
-        for f in df.facets(self.mesh):
-            mp = f.midpoint()
-            if mp[0].is_integer():
-                i, j, k = int(mp[0]), int(np.floor(mp[1])), int(np.floor(mp[2]))
-                if i == 0 or i == self.len_x:
-                    self.faces[f] = 6 if self.ws[max(i - 1, 0), j, k] == 1 else (1 if i == 0 else 2)
-                else:
-                    if self.ws[i - 1, j, k] == 1 and self.ws[i, j, k] == 1:
-                        self.faces[f] = 5
-                    elif self.ws[i - 1, j, k] == 1:
-                        self.faces[f] = 6
-                    elif self.ws[i, j, k] == 1:
-                        self.faces[f] = 6
-            elif mp[1].is_integer():
-                i, j, k = int(np.floor(mp[0])), int(mp[1]), int(np.floor(mp[2]))
-                if j == 0 or j == self.len_y:
-                    self.faces[f] = 6 if self.ws[i, max(j - 1, 0), k] == 1 else 3
-                else:
-                    if self.ws[i, j - 1, k] == 1 and self.ws[i, j, k] == 1:
-                        self.faces[f] = 5
-                    elif self.ws[i, j - 1, k] == 1:
-                        self.faces[f] = 6
-                    elif self.ws[i, j, k] == 1:
-                        self.faces[f] = 6
-            else:
-                i, j, k = int(np.floor(mp[0])), int(np.floor(mp[1])), int(mp[2])
-                if k == 0 or k == self.len_z:
-                    self.faces[f] = 6 if self.ws[i, j, max(k - 1, 0)] == 1 else 4
-                else:
-                    if self.ws[i, j, k - 1] == 1 and self.ws[i, j, k] == 1:
-                        self.faces[f] = 5
-                    elif self.ws[i, j, k - 1] == 1:
-                        self.faces[f] = 6
-                    elif self.ws[i, j, k] == 1:
-                        self.faces[f] = 6
+        dim = self.mesh.topology().dim()
+        self.mesh.init(dim - 1, 0)
+        facet_vertices = self.mesh.topology()(dim - 1, 0)().reshape(self.faces.size(), -1)
+        midpoints = self.mesh.coordinates()[facet_vertices].mean(axis=1)
+        self.faces.array()[:] = mark_facets(midpoints, self.ws.matrix == 1)
+
+
+def void_mesh_arrays(solid):
+    """ Vertices and hexahedral cells of the void voxels, with the vertices shared between cells deduplicated
+
+    :param solid: solid voxels
+    :type solid: ndarray
+    :return: vertex coordinates as (N, 3), cell vertices as (M, 8) in the DOLFIN hexahedron ordering, and the indices
+        of the vertices in the C-ordered full grid of (len_x + 1, len_y + 1, len_z + 1) vertices
+    :rtype: tuple(ndarray, ndarray, ndarray)
+    """
+    void = ~solid
+    grid = tuple(s + 1 for s in solid.shape)
+    corners = [(dx, dy, dz) for dz in (0, 1) for dy in (0, 1) for dx in (0, 1)]
+
+    # vertices used by at least one void cell, numbered through an index map of the full grid
+    used = np.zeros(grid, dtype=bool)
+    for dx, dy, dz in corners:
+        used[dx:dx + solid.shape[0], dy:dy + solid.shape[1], dz:dz + solid.shape[2]] |= void
+    vertex_indices = np.flatnonzero(used)
+    index_map = np.zeros(used.size, dtype=np.int64)
+    index_map[vertex_indices] = np.arange(vertex_indices.size)
+    vertices = np.column_stack(np.unravel_index(vertex_indices, grid)).astype(float)
+
+    i, j, k = np.nonzero(void)
+    cells = np.column_stack([index_map[np.ravel_multi_index((i + dx, j + dy, k + dz), grid)]
+                             for dx, dy, dz in corners])
+    return vertices, cells, vertex_indices
+
+
+def mark_facets(midpoints, solid):
+    """ Markers of the facets of a voxel BoxMesh, from their midpoints and the solid voxels
+
+    :param midpoints: facet midpoints in voxel units as (N, 3)
+    :type midpoints: ndarray
+    :param solid: solid voxels
+    :type solid: ndarray
+    :return: facet markers (see Permeability.mark_domain)
+    :rtype: ndarray
+    """
+    shape = np.array(solid.shape)
+    rounded = np.round(midpoints)
+    on_grid = np.abs(midpoints - rounded) < 1e-6
+
+    # axis normal to each facet: the first one along which its midpoint lies on a grid plane
+    axis = np.where(on_grid[:, 0], 0, np.where(on_grid[:, 1], 1, 2))
+    indices = np.floor(midpoints).astype(int)
+    plane = rounded[np.arange(axis.size), axis].astype(int)
+
+    # voxels on both sides of each facet, clipped to the domain for the boundary facets
+    lower, upper = indices.copy(), indices.copy()
+    for a in range(3):
+        on_axis = axis == a
+        lower[on_axis, a] = np.maximum(plane[on_axis] - 1, 0)
+        upper[on_axis, a] = np.minimum(plane[on_axis], shape[a] - 1)
+    lower = solid[lower[:, 0], lower[:, 1], lower[:, 2]]
+    upper = solid[upper[:, 0], upper[:, 1], upper[:, 2]]
+
+    markers = np.zeros(axis.size, dtype=np.uintp)
+    boundary = np.logical_or(plane == 0, plane == shape[axis])
+    sides = np.where(axis == 0, np.where(plane == 0, 1, 2), axis + 2)
+    markers[boundary] = np.where(lower[boundary], 6, sides[boundary])
+    interior = ~boundary
+    markers[interior & (lower | upper)] = 6
+    markers[interior & lower & upper] = 5
+    return markers
 
 
 class PeriodicBoundaryYZ(df.SubDomain):
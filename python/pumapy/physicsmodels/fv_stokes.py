@@ -0,0 +1,252 @@
+import numpy as np
+import sys
+from scipy.sparse import coo_matrix, diags, bmat
+from pumapy.physicsmodels.linear_solver import KrylovSolver
+from pumapy.utilities.timer import Timer
+from pumapy.utilities.generic_checks import check_ws_cutoff
+from pumapy.utilities.logger import print_warning
+
+
+class FVPermeability:
+
+    def __init__(self, workspace, direction, cutoff, side_bc, pressure_driven, tolerance, maxiter, solver_type,
+                 display_iter):
+        self.ws = workspace
+        self.direction = direction
+        self.cutoff = cutoff
+        self.side_bc = side_bc
+        self.pressure_driven = pressure_driven
+        self.tolerance = tolerance
+        self.maxiter = maxiter
+        self.solver_type = solver_type
+        self.display_iter = display_iter
+
+        self.solid = None
+        self.shape = None
+        self.periodic = None
+        self.faces = None
+        self.cells = None
+        self._K = None
+        self._b = None
+        self._M = None
+        self._x = None
+        self.timer = Timer()
+
+        self.keff = None
+        self.pressure = None
+        self.velocity = None
+
+    def compute(self):
+        self.timer.start()
+        self.modify_domain()
+        self.assemble()
+        self.solve()
+        self.compute_effective_coefficient()
+        sys.stdout.write("Solved in {}s\n".format(str(self.timer.elapsed())))
+        sys.stdout.flush()
+
+    def modify_domain(self):
+        # solid mask rotated so that the flow is along x
+        self.solid = np.logical_and(self.ws.matrix >= self.cutoff[0], self.ws.matrix <= self.cutoff[1])
+        if self.direction == "y":
+            self.solid = self.solid.transpose(1, 0, 2)
+        elif self.direction == "z":
+            self.solid = self.solid.transpose(2, 1, 0)
+        self.shape = self.solid.shape
+
+        # x is periodic for the body force, the sides for side_bc='p'
+        self.periodic = (not self.pressure_driven, self.side_bc == "p", self.side_bc == "p")
+        if np.all(self.solid):
+            raise Exception("Error, the domain does not contain any void voxel.")
+        if not self.pressure_driven and self.side_bc != "ns" and not np.any(self.solid):
+            raise Exception("Error, the body force permeability of a domain without solid walls is infinite.")
+
+    def assemble(self):
+        """ Symmetric saddle point system [[A, G], [G^T, -eps I]] of the MAC discretization, in voxel units
+
+        The velocity component a is stored on the faces normal to a, and is a degree of freedom only on the faces
+        between two void voxels (or between a void voxel and the inlet/outlet). The pressure is stored on the void
+        voxels. The viscous operator A uses ghost velocities for the walls: zero normal velocity one voxel away, and
+        mirrored tangential velocity half a voxel away (-u for no slip, u for free slip). The tiny regularization eps
+        removes the constant pressure modes of the pores that are not connected to a pressure boundary.
+        """
+        fluid = ~self.solid
+        self.cells = np.full(self.shape, -1, dtype=np.int64)
+        self.cells[fluid] = np.arange(np.count_nonzero(fluid))
+
+        # open faces of each component, numbered consecutively
+        self.faces = []
+        offset = 0
+        for a in range(3):
+            low, high = self._face_cells(fluid, a, fill=not self.periodic[a] and a == 0)
+            index = np.full(low.shape, -1, dtype=np.int64)
+            open_faces = np.logical_and(low, high)
+            index[open_faces] = offset + np.arange(np.count_nonzero(open_faces))
+            offset += np.count_nonzero(open_faces)
+            self.faces.append(index)
+        n_u, n_p = offset, np.count_nonzero(fluid)
+
+        rows, cols, data = [], [], []
+        diagonal = np.zeros(n_u)
+        b = np.zeros(n_u + n_p)
+        for a in range(3):
+            index = self.faces[a]
+            is_open = index >= 0
+            rows_a = index[is_open]
+
+            # viscous operator: 6 neighbors of each face of the same component
+            for axis in range(3):
+                for step in (-1, 1):
+                    neighbor = self._shift(index, axis, step, periodic=self.periodic[axis])[is_open]
+                    inner = neighbor >= 0
+                    rows.append(rows_a[inner])
+                    cols.append(neighbor[inner])
+                    data.append(np.full(np.count_nonzero(inner), -1.))
+                    weight = np.where(inner, 1., 0.)
+                    if axis == a:
+                        weight[neighbor == -1] = 1.  # wall: zero velocity on the next face
+                    else:
+                        weight[neighbor == -1] = 2.  # wall half a voxel away
+                        if axis != 0 and self.side_bc == "ns":
+                            weight[neighbor == -2] = 2.
+                    np.add.at(diagonal, rows_a, weight)
+
+            # pressure gradient p[high] - p[low] across the face
+            low, high = self._face_cells(self.cells, a, fill=-2)
+            for cell, sign in ((high, 1.), (low, -1.)):
+                cell = cell[is_open]
+                inner = cell >= 0
+                rows.append(rows_a[inner])
+                cols.append(n_u + cell[inner])
+                data.append(np.full(np.count_nonzero(inner), sign))
+                if a == 0 and self.pressure_driven:
+                    # inlet (p=1) and outlet (p=0) pressures, one voxel outside the domain
+                    b[rows_a[~inner]] -= sign * (1. if sign < 0 else 0.)
+
+            if a == 0 and not self.pressure_driven:
+                b[rows_a] = 1.
+
+        rows = np.concatenate(rows + [np.arange(n_u)])
+        cols = np.concatenate(cols + [np.arange(n_u)])
+        data = np.concatenate(data + [diagonal])
+        upper = coo_matrix((data, (rows, cols)), shape=(n_u, n_u + n_p)).tocsr()
+        A, G = upper[:, :n_u], upper[:, n_u:]
+        self._K = bmat([[A, G], [G.T, diags(np.full(n_p, -1e-10))]], format='csr')
+        self._b = b
+
+        # block diagonal preconditioner: Jacobi for the viscous block, identity for the pressure Schur complement
+        self._M = diags(np.concatenate((1. / diagonal, np.ones(n_p))))
+
+    def solve(self):
+        # relative tolerance only, since the residual of the saddle point system is in voxel units
+        solver = KrylovSolver(self.solver_type, 0., self.maxiter, self._M, 'scipy', display_iter=self.display_iter,
+                              rtol=self.tolerance, display_every=10)
+        self._x = solver.solve(self._K, self._b)
+        if self.display_iter:
+            sys.stdout.write("\n")
+        if not solver.converged:
+            print_warning("The solver did not converge to the tolerance after {} iterations.".format(solver.info))
+
+    def compute_effective_coefficient(self):
+        # face velocities back on the face grids, and averaged at the voxel centers
+        n_u = self._x.size - np.count_nonzero(self.cells >= 0)
+        velocity = np.zeros(self.shape + (3,))
+        for a in range(3):
+            faces = np.zeros(self.faces[a].shape)
+            faces[self.faces[a] >= 0] = self._x[self.faces[a][self.faces[a] >= 0]]
+            low = [slice(None)] * 3
+            low[a] = slice(0, self.shape[a])
+            velocity[..., a] = (faces[tuple(low)] + self._shift(faces, a, 1, self.periodic[a], 0)[tuple(low)]) / 2.
+        pressure = np.zeros(self.shape)
+        pressure[self.cells >= 0] = self._x[n_u:]
+
+        # from voxel units (unit viscosity, body force or pressure difference) to m^2, m/s and Pa
+        voxel_length = self.ws.voxel_length
+        if self.pressure_driven:
+            # inlet and outlet pressures are one voxel outside the domain
+            length = self.shape[0] + 1
+            self.keff = list(velocity.mean(axis=(0, 1, 2)) * length * voxel_length ** 2)
+            velocity *= voxel_length
+        else:
+            self.keff = list(velocity.mean(axis=(0, 1, 2)) * voxel_length ** 2)
+            velocity *= voxel_length ** 2
+            pressure *= voxel_length
+
+        if self.direction == 'y':
+            self.keff = [self.keff[1], self.keff[0], self.keff[2]]
+            pressure = pressure.transpose(1, 0, 2)
+            velocity = velocity.transpose(1, 0, 2, 3)[:, :, :, [1, 0, 2]]
+        elif self.direction == 'z':
+            self.keff = [self.keff[2], self.keff[1], self.keff[0]]
+            pressure = pressure.transpose(2, 1, 0)
+            velocity = velocity.transpose(2, 1, 0, 3)[:, :, :, [2, 1, 0]]
+        self.pressure, self.velocity = pressure, velocity
+
+    def error_check(self):
+        check_ws_cutoff(self.ws, self.cutoff)
+
+        # solver type
+        if not (self.solver_type == "bicgstab" or self.solver_type == "minres" or
+                self.solver_type == "gmres" or self.solver_type == "direct"):
+            print_warning("Unrecognized solver specified, defaulting to minres.")
+            self.solver_type = "minres"
+
+        # direction checks
+        if self.direction == "x" or self.direction == "X":
+            self.direction = "x"
+        elif self.direction == "y" or self.direction == "Y":
+            self.direction = "y"
+        elif self.direction == "z" or self.direction == "Z":
+            self.direction = "z"
+        else:
+            raise Exception("Invalid simulation direction.")
+
+        # side_bc checks
+        if self.side_bc == "periodic" or self.side_bc == "Periodic" or self.side_bc == "p":
+            self.side_bc = "p"
+        elif self.side_bc == "free slip" or self.side_bc == "Free Slip" or self.side_bc == "fs":
+            self.side_bc = "fs"
+        elif self.side_bc == "no slip" or self.side_bc == "No Slip" or self.side_bc == "ns":
+            self.side_bc = "ns"
+        else:
+            raise Exception("Invalid side boundary conditions.")
+
+    def log_input(self):
+        self.ws.log.log_section("Computing Permeability (finite volume)")
+        self.ws.log.log_line("Domain Size: " + str(self.ws.get_shape()))
+        self.ws.log.log_line("Solver Tolerance: " + str(self.tolerance))
+        self.ws.log.log_line("Max Iterations: " + str(self.maxiter))
+        self.ws.log.write_log()
+
+    def log_output(self):
+        self.ws.log.log_section("Finished Permeability Calculation")
+        self.ws.log.log_line("Permeability: " + "[" + str(self.keff) + "]")
+        self.ws.log.write_log()
+
+    @staticmethod
+    def _shift(array, axis, step, periodic, fill=-2):
+        # value of the neighbor at index + step along axis, or fill outside a non-periodic domain
+        if periodic:
+            return np.roll(array, -step, axis=axis)
+        shifted = np.full_like(array, fill)
+        src = [slice(None)] * 3
+        dst = [slice(None)] * 3
+        if step > 0:
+            src[axis], dst[axis] = slice(step, None), slice(None, -step)
+        else:
+            src[axis], dst[axis] = slice(None, step), slice(-step, None)
+        shifted[tuple(dst)] = array[tuple(src)]
+        return shifted
+
+    def _face_cells(self, cells, axis, fill):
+        # values of the two voxels (low, high) on each side of the faces normal to axis
+        if self.periodic[axis]:
+            return np.roll(cells, 1, axis=axis), cells
+        pad = [(0, 0)] * 3
+        pad[axis] = (1, 1)
+        padded = np.pad(cells, pad, constant_values=fill)
+        src = [slice(None)] * 3
+        src[axis] = slice(None, -1)
+        low = padded[tuple(src)]
+        src[axis] = slice(1, None)
+        return low, padded[tuple(src)]
@@ -1,18 +1,23 @@
 from pumapy.utilities.logger import print_warning
 from pumapy.utilities.timer import Timer
-from pumapy.utilities.boundary_conditions import Isotropic_periodicBC, Isotropic_symmetricBC
-from pumapy.physicsmodels.conductivity_parent import Conductivity, SolverDisplay
+from pumapy.utilities.boundary_conditions import Isotropic_periodicBC, Isotropic_symmetricBC, dirichlet_bvector
+from pumapy.physicsmodels.conductivity_parent import Conductivity
 from pumapy.physicsmodels.isotropic_conductivity_utils import setup_matrices_cy, compute_flux
+from pumapy.physicsmodels.linear_solver import KrylovSolver, EffectiveConvergence
+from pumapy.physicsmodels.multilevel import coarse_to_fine
+from pumapy.utilities.parallel import allocate_field
 import numpy as np
-from scipy.sparse import csr_matrix, diags
-from scipy.sparse.linalg import bicgstab, spsolve, cg, gmres  # LinearOperator, spilu
+from scipy.sparse import csr_matrix
 import math
 
 
 class IsotropicConductivity(Conductivity):
 
-    def __init__(self, workspace, cond_map, direction, side_bc, prescribed_bc, tolerance, maxiter, solver_type, display_iter):
-        super().__init__(workspace, cond_map, direction, side_bc, prescribed_bc, tolerance, maxiter, solver_type, display_iter)
+    def __init__(self, workspace, cond_map, direction, side_bc, prescribed_bc, tolerance, maxiter, solver_type, display_iter,
+                 workers=None, outputs='fields', preconditioner='jacobi', backend=None, effective_tolerance=None,
+                 check_every=10, levels=1):
+        super().__init__(workspace, cond_map, direction, side_bc, prescribed_bc, tolerance, maxiter, solver_type, display_iter,
+                         workers, outputs, preconditioner, backend, effective_tolerance, check_every, levels)
         self._bc_func = None
         self.cond = np.zeros([1, 1, 1])
 
@@ -39,12 +44,13 @@ class IsotropicConductivity(Conductivity):
 
         self.n_iter = 0
         self._A = None
-        self._M = None
         self._bf = np.zeros(1)
         self._Tf = np.zeros(1)
         self._kf = np.zeros(1)
 
     def compute(self):
+        if self.levels > 1:
+            coarse_to_fine(self, self.cond_map, 'T')
         self.__create_cond_matrix()
         self.__init_temperature()
         t = Timer()
@@ -71,29 +77,27 @@ class IsotropicConductivity(Conductivity):
 
     def __init_temperature(self):
         print("Initializing temperature field ... ", end='')
-        self.T = np.zeros([self.len_x, self.len_y, self.len_z])
-        for i in range(self.len_x):
-            self.T[i, :, :] = i / (self.len_x - 1.)
+        if self.initial_guess is not None:
+            # solution of the coarser level, rotated like the domain
+            self.T = self.initial_guess.transpose({'x': (0, 1, 2), 'y': (1, 0, 2), 'z': (2, 1, 0)}[self.direction])
+        else:
+            self.T = np.zeros([self.len_x, self.len_y, self.len_z])
+            for i in range(self.len_x):
+                self.T[i, :, :] = i / (self.len_x - 1.)
         self._Tf = self.T.flatten('F')
         print("Done")
 
     def __setup_matrices_cy(self):
 
         print("Setting up b matrix ... ", end='')
-        bsq = np.zeros([self.len_x, self.len_y, self.len_z])
         if self.prescribed_bc is not None:
-            for i in range(self.len_x):
-                for j in range(self.len_y):
-                    for k in range(self.len_z):
-                        if self.prescribed_bc[i, j, k] != np.Inf:
-                            bsq[i, j, k] = self.prescribed_bc[i, j, k]
-
             self.prescribed_bc = self.prescribed_bc.dirichlet  # because of cython, cannot pass object
+            self._bf = dirichlet_bvector(self._matrix.shape, self.prescribed_bc, pad=0)
             bc_check = 1
         else:
             bc_check = 0
+            self._bf = dirichlet_bvector(self._matrix.shape, pad=0)
             self.prescribed_bc = np.full(self._matrix.shape, np.Inf, dtype=float)
-            bsq[-1, :, :] = 1
 
         # check for zero conductivity
         for i in range(self.cond_map.get_size()):
@@ -102,7 +106,6 @@ class IsotropicConductivity(Conductivity):
                 bc_check = 1
                 self.prescribed_bc[(self._matrix >= low) * (self._matrix <= high)] = 0
 
-        self._bf = bsq.flatten('F')
         print("Done")
 
         self._kf = self.cond.flatten('F')
@@ -112,58 +115,36 @@ class IsotropicConductivity(Conductivity):
         self._A = csr_matrix((self._data, (self._row, self._col)), shape=(n_elem, n_elem))
         print("Done")
 
-        print("Setting up preconditioner ...", end ='')
-        # ilu = spilu(self._A.tocsc(), drop_tol=1e-5)
-        # Mx = lambda x: ilu.solve(x)
-        # self._M = LinearOperator((n_elem, n_elem), Mx)
-        diag = self._A.diagonal()
-        diag[diag==0] = 1
-        diag[:] = 1./diag[:]
-        self._M = diags(diag,0).tocsr()
-        print("Done")
-
-
-
     def __solve(self):
         print("Solving Ax=b system ... ", end='')
 
-        info = 0
-
-        if self.solver_type == 'direct':
-            print("Direct solver", end='')
-            self._Tf = spsolve(self._A, self._bf)
-        elif self.solver_type == 'cg':
-            print("Conjugate Gradient:")
-            if self.display_iter:
-                self._Tf, info = cg(self._A, self._bf, x0=self._Tf, atol=self.tolerance, maxiter=self.maxiter,
-                                    callback=SolverDisplay(), M=self._M)
-            else:
-                self._Tf, info = cg(self._A, self._bf, x0=self._Tf, atol=self.tolerance, maxiter=self.maxiter, M=self._M)
-
-        elif self.solver_type == 'gmres':
-            print("gmres:")
-            if self.display_iter:
-                self._Tf, info = gmres(self._A, self._bf, x0=self._Tf, atol=self.tolerance,
-                                       maxiter=self.maxiter, callback=SolverDisplay(), M=self._M)
-            else:
-                self._Tf, info = gmres(self._A, self._bf, x0=self._Tf, atol=self.tolerance,
-                                       maxiter=self.maxiter, M=self._M)
-        else:
-            if self.solver_type != 'bicgstab':
-                print_warning("Unrecognized solver, defaulting to bicgstab.")
-            print("Bicgstab:")
-            if self.display_iter:
-                self._Tf, info = bicgstab(self._A, self._bf, x0=self._Tf, atol=self.tolerance,
-                                          maxiter=self.maxiter, callback=SolverDisplay(), M=self._M)
-            else:
-                self._Tf, info = bicgstab(self._A, self._bf, x0=self._Tf, atol=self.tolerance,
-                                          maxiter=self.maxiter, M=self._M)
-
-        if info != 0:
-            raise Exception("Solver error: " + str(info))
+        criterion = None
+        if self.effective_tolerance is not None:
+            criterion = EffectiveConvergence(self.__estimate_keff, self.effective_tolerance, self.check_every)
+        solver = KrylovSolver(self.solver_type, self.tolerance, self.maxiter, self.preconditioner, self.backend,
+                              self.workers, self.display_iter, display_every=10, criterion=criterion)
+        t = Timer()
+        self._Tf = solver.solve(self._A, self._bf, self._Tf)
+        self.solve_time = t.elapsed()
+        self.iterations = solver.iterations
+        if not solver.converged:
+            raise Exception("Solver error: " + str(solver.info))
+        if criterion is not None:
+            self.convergence_trace = criterion.trace
         self.T = self._Tf.reshape([self.len_x, self.len_y, self.len_z], order='F')
         print(" ... Done")
 
+    def coarse_solver(self, workspace):
+        # same problem on a coarser domain, for the multilevel initial guess
+        return IsotropicConductivity(workspace, self.cond_map, self.direction, self.side_bc, None, self.tolerance,
+                                     self.maxiter, self.solver_type, self.display_iter, self.workers, 'effective',
+                                     self.preconditioner, self.backend, self.effective_tolerance, self.check_every)
+
+    def __estimate_keff(self, x):
+        # conductivity along the direction of the solve, from the fluxes of the temperature iterate
+        T = x.reshape([self.len_x, self.len_y, self.len_z], order='F')
+        return compute_flux(T, self.cond, self.len_x, self.len_y, self.len_z)[0] * (self.len_x - 1)
+
     def __compute_conductivity(self):
 
         if self.direction == 'y':
@@ -190,4 +171,12 @@ class IsotropicConductivity(Conductivity):
         # making the flux have the correct spacial units
         self.q /= self.ws.voxel_length
 
+        # the kernel computes the whole flux field at once: it is only released or moved to disk afterwards
+        if self.outputs != 'fields':
+            field = allocate_field(self.q.shape, self.outputs)
+            if field is not None:
+                field[:] = self.q
+                field.flush()
+            self.q = field
+
         print("Computing effective conductivity... ", end='')
@@ -0,0 +1,335 @@
+from pumapy.utilities.logger import print_warning
+from pumapy.utilities.parallel import get_workers, SlabOperator
+from scipy.sparse import csr_matrix, csc_matrix, diags, issparse
+from scipy.sparse.linalg import LinearOperator, bicgstab, cg, gmres, minres, spsolve, spilu
+import numpy as np
+import sys
+
+
+SOLVERS = {'bicgstab': bicgstab, 'cg': cg, 'gmres': gmres, 'minres': minres}
+SOLVER_NAMES = {'bicgstab': "Bicgstab:", 'cg': "Conjugate Gradient:", 'gmres': "gmres:", 'minres': "minres:"}
+PETSC_TYPES = {'bicgstab': 'bcgs', 'cg': 'cg', 'gmres': 'gmres', 'minres': 'minres'}
+PRECONDITIONERS = ('jacobi', 'ilu', 'none')
+BACKENDS = ('scipy', 'threads', 'petsc')
+
+
+def check_solver_options(preconditioner, backend):
+    """ Checks the preconditioner and backend options of the physics models, before any assembly
+
+    :param preconditioner: 'jacobi', 'ilu', 'none' (or None), a matrix or LinearOperator, or a callable returning one
+        from the system matrix
+    :type preconditioner: string or callable or LinearOperator
+    :param backend: 'scipy', 'threads', 'petsc' or None
+    :type backend: string
+    """
+    if isinstance(preconditioner, str) and preconditioner not in PRECONDITIONERS:
+        raise Exception("Error, preconditioner has to be 'jacobi', 'ilu', 'none', an operator or a callable.")
+    if backend is not None and backend not in BACKENDS:
+        raise Exception("Error, backend has to be 'scipy', 'threads', 'petsc' or None.")
+    if backend == 'petsc' and preconditioner is not None and not isinstance(preconditioner, str):
+        raise Exception("Error, the 'petsc' backend only takes the 'jacobi', 'ilu' or 'none' preconditioners.")
+
+
+class KrylovSolver:
+    """ Sparse linear solver shared by the physics models
+
+    One interface over the Krylov solvers (or a direct solve) for the systems assembled by the conductivity, elasticity
+    and permeability solvers. The matrix is applied through a backend: 'scipy' (the matrix itself), 'threads'
+    (a SlabOperator applying blocks of rows of the CSR matrix on a thread pool, since SciPy releases the GIL in the
+    sparse products) or 'petsc' (the KSP solvers of petsc4py, if installed). The iterations are counted by a
+    ResidualHistory callback, which also displays and records the residual when asked to. After a solve, info
+    follows the SciPy convention (0 if converged, > 0 if maxiter was reached, < 0 for a breakdown).
+
+    :param solver_type: 'bicgstab', 'cg', 'gmres', 'minres' or 'direct'
+    :type solver_type: string, optional
+    :param tolerance: absolute tolerance on the residual (not used by minres)
+    :type tolerance: float, optional
+    :param maxiter: maximum number of iterations (of restart cycles for gmres)
+    :type maxiter: int, optional
+    :param preconditioner: 'jacobi' (inverse diagonal, 1 for the zero entries), 'ilu' (incomplete LU, falling back
+        to jacobi if the factorization breaks down), 'none', a matrix or LinearOperator, or a callable returning one
+        from the system matrix
+    :type preconditioner: string or callable or LinearOperator, optional
+    :param backend: 'scipy', 'threads' or 'petsc'. If None, 'threads' for more than one worker, 'scipy' otherwise
+    :type backend: string, optional
+    :param workers: number of threads of the 'threads' backend (all available cores if None)
+    :type workers: int, optional
+    :param display_iter: display the iterations and relative residual
+    :type display_iter: bool, optional
+    :param rtol: relative tolerance on the residual (the solver's default if None)
+    :type rtol: float, optional
+    :param display_every: number of iterations between two displays, each costing one extra matrix-vector product
+    :type display_every: int, optional
+    :param history: record the relative residual at every iteration in residuals
+    :type history: bool, optional
+    :param criterion: additional stopping criterion on the iterates (e.g. on an effective coefficient)
+    :type criterion: EffectiveConvergence, optional
+    """
+    def __init__(self, solver_type='bicgstab', tolerance=1e-4, maxiter=10000, preconditioner='jacobi', backend=None,
+                 workers=None, display_iter=False, rtol=None, display_every=1, history=False, criterion=None):
+        check_solver_options(preconditioner, backend)
+        if solver_type != 'direct' and solver_type not in SOLVERS:
+            print_warning("Unrecognized solver, defaulting to bicgstab.")
+            solver_type = 'bicgstab'
+        self.solver_type = solver_type
+        self.tolerance = tolerance
+        self.maxiter = maxiter
+        self.preconditioner = preconditioner
+        self.workers = get_workers(workers)
+        if backend is None:
+            backend = 'threads' if self.workers > 1 else 'scipy'
+        self.backend = backend
+        self.display_iter = display_iter
+        self.rtol = rtol
+        self.display_every = display_every
+        self.history = history
+        self.criterion = criterion
+
+        self.info = 0
+        self.iterations = 0
+        self.residuals = []
+        self.stopped_early = False
+
+    @property
+    def converged(self):
+        return self.info == 0
+
+    def solve(self, A, b, x0=None):
+        """ Solves the system
+
+        :param A: square sparse matrix
+        :type A: scipy.sparse.csr_matrix
+        :param b: right hand side
+        :type b: ndarray
+        :param x0: initial guess (zeros if None)
+        :type x0: ndarray, optional
+        :return: solution
+        :rtype: ndarray
+        """
+        self.info = 0
+        self.iterations = 0
+        self.residuals = []
+        self.stopped_early = False
+
+        if self.solver_type == 'direct':
+            print("Direct solver", end='')
+            try:
+                import scikits.umfpack
+                return spsolve(A, b, use_umfpack=True)
+            except ImportError:
+                return spsolve(A, b)
+
+        print(SOLVER_NAMES[self.solver_type])
+        if x0 is None:
+            x0 = np.zeros_like(b)
+        if self.backend == 'petsc':
+            return self._solve_petsc(A, b, x0)
+
+        callback = ResidualHistory(A, b, self.display_iter, self.display_every, self.history, self.criterion)
+        kwargs = dict(x0=x0, maxiter=self.maxiter, M=self.build_preconditioner(A), callback=callback)
+        if self.solver_type != 'minres':
+            kwargs['atol'] = self.tolerance
+        if self.solver_type == 'gmres':
+            # the iterate is only passed at the end of each restart cycle, when a criterion needs it
+            kwargs['callback_type'] = 'pr_norm' if self.criterion is None else 'x'
+
+        solver = SOLVERS[self.solver_type]
+        operator = SlabOperator(A, self.workers) if self.backend == 'threads' else A
+        try:
+            if self.rtol is None:
+                x, self.info = solver(operator, b, **kwargs)
+            else:
+                try:
+                    x, self.info = solver(operator, b, rtol=self.rtol, **kwargs)
+                except TypeError:  # scipy < 1.12
+                    x, self.info = solver(operator, b, tol=self.rtol, **kwargs)
+        except EarlyTermination as stop:
+            x, self.info, self.stopped_early = stop.x, 0, True
+        self.iterations = callback.niter
+        self.residuals = callback.residuals
+        return x
+
+    def build_preconditioner(self, A):
+        """ Preconditioner for the SciPy solvers
+
+        :param A: square sparse matrix
+        :type A: scipy.sparse.csr_matrix
+        :return: preconditioner, or None
+        :rtype: scipy.sparse.csr_matrix or LinearOperator or None
+        """
+        preconditioner = self.preconditioner
+        if preconditioner is None:
+            return None
+        if isinstance(preconditioner, str):
+            # named preconditioners, never comparing a matrix or operator to a string
+            if preconditioner == 'none':
+                return None
+            if preconditioner == 'ilu':
+                # pivoting on the diagonal: the exterior rows of the MPFA/MPSA systems make the default
+                # threshold pivoting break down with exactly singular factors
+                try:
+                    ilu = spilu(csc_matrix(A), drop_tol=1e-5, fill_factor=20, diag_pivot_thresh=0.)
+                    return LinearOperator(A.shape, ilu.solve)
+                except RuntimeError as error:
+                    print_warning("Incomplete LU failed ({}), using the jacobi preconditioner.".format(error))
+            diagonal = A.diagonal()
+            inverse = np.ones_like(diagonal)
+            inverse[diagonal != 0] = 1. / diagonal[diagonal != 0]
+            return diags(inverse, 0).tocsr()
+        if issparse(preconditioner) or isinstance(preconditioner, (LinearOperator, np.ndarray)):
+            return preconditioner
+        return preconditioner(A)
+
+    def _solve_petsc(self, A, b, x0):
+        try:
+            from petsc4py import PETSc
+        except ImportError:
+            raise Exception("Error, the 'petsc' backend requires petsc4py.")
+
+        A = csr_matrix(A)
+        matrix = PETSc.Mat().createAIJ(size=A.shape, csr=(A.indptr, A.indices, A.data))
+        matrix.assemble()
+        rhs = PETSc.Vec().createWithArray(np.array(b, dtype=PETSc.ScalarType))
+        x = PETSc.Vec().createWithArray(np.array(x0, dtype=PETSc.ScalarType))
+
+        ksp = PETSc.KSP().create()
+        ksp.setOperators(matrix)
+        ksp.setType(PETSC_TYPES[self.solver_type])
+        ksp.getPC().setType(self.preconditioner or 'none')
+        ksp.setTolerances(rtol=1e-5 if self.rtol is None else self.rtol, atol=self.tolerance, max_it=self.maxiter)
+        ksp.setInitialGuessNonzero(True)
+
+        b_norm = np.linalg.norm(b) or 1.
+        stopped = []
+
+        def monitor(solver, iteration, residual_norm):
+            # PETSc calls the monitor before the first iteration too
+            if iteration == 0:
+                return
+            self.iterations = iteration
+            if self.history:
+                self.residuals.append(residual_norm / b_norm)
+            if self.display_iter and iteration % self.display_every == 0:
+                sys.stdout.write("\rIteration {}  Residual = {} ".format(iteration, residual_norm / b_norm))
+            if self.criterion is not None and iteration % self.criterion.every == 0:
+                xk = solver.buildSolution().getArray()
+                if self.criterion.check(iteration, xk):
+                    stopped.append(np.array(xk))
+                    raise EarlyTermination(stopped[0])
+
+        ksp.setMonitor(monitor)
+        try:
+            ksp.solve(rhs, x)
+        except Exception:
+            # petsc4py may wrap the exception raised in the monitor
+            if not stopped:
+                raise
+            self.info, self.stopped_early = 0, True
+            return stopped[0]
+
+        reason = ksp.getConvergedReason()
+        if reason > 0:
+            self.info = 0
+        elif reason == PETSc.KSP.ConvergedReason.DIVERGED_ITS:
+            self.info = ksp.getIterationNumber()
+        else:
+            self.info = reason
+        return x.getArray().copy()
+
+
+class EarlyTermination(Exception):
+    """ Raised by the callback of the Krylov solvers to stop them, holding the last iterate """
+    def __init__(self, x):
+        super().__init__("Stopping criterion met")
+        self.x = x
+
+
+class EffectiveConvergence(object):
+    """ Stopping criterion of the Krylov solvers on an effective coefficient instead of the residual
+
+    Every 'every' iterations, the effective coefficient is estimated from the current iterate by the physics model.
+    The solve stops once the estimates of the last window of checks (and the one before) are all within rtol of each
+    other, which usually happens well before the residual converges. The estimates are recorded in trace as
+    (iteration, estimate) pairs.
+
+    :param estimate: function returning the effective coefficient from an iterate
+    :type estimate: callable
+    :param rtol: relative tolerance on the changes of the effective coefficient
+    :type rtol: float, optional
+    :param every: number of iterations between two checks (restart cycles for gmres)
+    :type every: int, optional
+    :param window: number of consecutive checks over which the changes have to be below rtol
+    :type window: int, optional
+    """
+    def __init__(self, estimate, rtol=1e-3, every=10, window=3):
+        self.estimate = estimate
+        self.rtol = rtol
+        self.every = every
+        self.window = window
+        self.trace = []
+
+    def check(self, iteration, x):
+        """ Estimates the effective coefficient from the iterate x, and returns whether the solve can stop
+
+        :param iteration: iteration of the solver
+        :type iteration: int
+        :param x: current iterate
+        :type x: ndarray
+        :return: True if the effective coefficient has converged
+        :rtype: bool
+        """
+        self.trace.append((iteration, float(self.estimate(x))))
+        if len(self.trace) <= self.window:
+            return False
+        recent = np.array([value for _, value in self.trace[-self.window - 1:]])
+        return bool(recent.max() - recent.min() < self.rtol * (abs(recent[-1]) or 1.))
+
+
+class ResidualHistory(object):
+    """ Callback of the Krylov solvers counting the iterations, and displaying or recording the relative residual
+
+    The residual ||b - Ax|| / ||b|| is recomputed from the iterate (one extra matrix-vector product) only at the
+    iterations where it is displayed or recorded, since SciPy does not pass it to the callbacks (except gmres,
+    which passes its preconditioned relative residual instead of the iterate). If a criterion is given, it is checked
+    on the iterate every criterion.every iterations, stopping the solver with EarlyTermination once it is met.
+
+    :param A: system matrix
+    :type A: scipy.sparse.csr_matrix
+    :param b: right hand side
+    :type b: ndarray
+    :param display: display the residual every 'every' iterations
+    :type display: bool, optional
+    :param every: number of iterations between two displays
+    :type every: int, optional
+    :param record: record the residual at every iteration in residuals
+    :type record: bool, optional
+    :param criterion: additional stopping criterion on the iterates
+    :type criterion: EffectiveConvergence, optional
+    """
+    def __init__(self, A, b, display=False, every=1, record=False, criterion=None):
+        self.niter = 0
+        self.A = A
+        self.b = b
+        self.b_norm = np.linalg.norm(b) or 1.
+        self.display = display
+        self.every = every
+        self.record = record
+        self.criterion = criterion
+        self.residuals = []
+
+    def __call__(self, xk):
+        self.niter += 1
+        if self.criterion is not None and np.ndim(xk) > 0 and self.niter % self.criterion.every == 0:
+            if self.criterion.check(self.niter, xk):
+                raise EarlyTermination(np.array(xk))
+        show = self.display and self.niter % self.every == 0
+        if not (show or self.record):
+            return
+        if np.ndim(xk) == 0:
+            residual = float(xk)
+        else:
+            residual = np.linalg.norm(self.b - self.A @ xk) / self.b_norm
+        if self.record:
+            self.residuals.append(residual)
+        if show:
+            sys.stdout.write("\rIteration {}  Residual = {} ".format(self.niter, residual))
@@ -1,24 +1,45 @@
 from pumapy.physicsmodels.anisotropic_conductivity_utils import (pad_domain, add_nondiag, divP, find_unstable_vox,
                                                                  fill_flux_matrices, flatten_Kmat)
 from pumapy.physicsmodels.mpxa_matrices import fill_Ampfa, fill_Bmpfa, fill_Cmpfa, fill_Dmpfa, create_mpfa_indices
-from pumapy.physicsmodels.conductivity_parent import Conductivity, SolverDisplay
-from pumapy.utilities.logger import print_warning
+from pumapy.physicsmodels.conductivity_parent import Conductivity
+from pumapy.physicsmodels.linear_solver import KrylovSolver, EffectiveConvergence
+from pumapy.physicsmodels.multilevel import coarse_to_fine
+from pumapy.utilities.timer import Timer
+from pumapy.utilities.orientation_encoding import pad_orientation, orientation_slice, is_encoded_orientation
+from pumapy.utilities.boundary_conditions import dirichlet_bvector
+from pumapy.utilities.parallel import (split_slabs, run_in_pool, allocate_field, slab_add_at, merge_slab_halos,
+                                      memory_bounded_workers, compact_csr, stack_rows)
 import numpy as np
-from scipy.sparse import csr_matrix, diags
-from scipy.sparse.linalg import bicgstab, spsolve, cg, gmres
+import copy
 import sys
 
 
+# flux rows of the eight IVs (sw, se, nw, ne, tsw, tse, tnw, tne) summed into each flux component of their CV
+FLUX_ROWS = ((3, 3, 2, 2, 1, 1, 0, 0),
+             (7, 6, 7, 6, 5, 4, 5, 4),
+             (11, 10, 9, 8, 11, 10, 9, 8))
+
+
 class AnisotropicConductivity(Conductivity):
     def __init__(self, workspace, cond_map, direction, side_bc, prescribed_bc, tolerance, maxiter, solver_type,
-                 display_iter, print_matrices):
-        super().__init__(workspace, cond_map, direction, side_bc, prescribed_bc, tolerance, maxiter, solver_type, display_iter)
+                 display_iter, print_matrices, workers=None, outputs='fields', preconditioner='jacobi',
+                 backend=None, effective_tolerance=None, check_every=10, levels=1):
+        super().__init__(workspace, cond_map, direction, side_bc, prescribed_bc, tolerance, maxiter, solver_type, display_iter,
+                         workers, outputs, preconditioner, backend, effective_tolerance, check_every, levels)
         self.print_matrices = print_matrices
         self.mat_cond = dict()
         self.need_to_orient = False  # changes if conductivities (k_axial, k_radial) detected
         self.orient_pad = None
+        self.orient_reorder = [0, 1, 2]
+        self.reorder = [0, 1, 2]
+        self.q_rotated = None
+        self.flux_select = None
+        self.flux_path = None
+        self.functional = None
 
     def compute(self):
+        if self.levels > 1:
+            coarse_to_fine(self, self.cond_map, 'T')
         self.__initialize()
         self.__assemble_bvector()
         self.__assemble_Amatrix()
@@ -42,12 +63,14 @@ class AnisotropicConductivity(Conductivity):
             reorder = [2, 1, 0]
             reorder_nondiagcond = [5, 4, 3]
 
+        self.reorder = reorder
         self.ws_pad = np.zeros(shape, dtype=np.uint16)
         self.ws_pad[1:-1, 1:-1, 1:-1] = self.ws.matrix.transpose(reorder)
 
         if self.need_to_orient:
-            self.orient_pad = np.zeros(shape + [3], dtype=float)
-            self.orient_pad[1:-1, 1:-1, 1:-1, :] = self.ws.orientation.transpose(reorder + [3])[:, :, :, reorder]
+            # kept in the Workspace storage type (possibly encoded), decoded one slice at a time in compute_Kmat
+            self.orient_reorder = reorder
+            self.orient_pad = pad_orientation(self.ws.orientation, reorder, 'wrap' if self.side_bc == 'p' else 'edge')
 
         for key in self.mat_cond.keys():
             tmp_cond = list(self.mat_cond[key])
@@ -59,7 +82,7 @@ class AnisotropicConductivity(Conductivity):
         self.len_xyz = self.len_x * self.len_y * self.len_z
 
         # Padding domain, imposing symmetric or periodic BC on faces
-        pad_domain(self.ws_pad, self.orient_pad, self.need_to_orient, self.len_x, self.len_y, self.len_z, self.side_bc)
+        pad_domain(self.ws_pad, None, False, self.len_x, self.len_y, self.len_z, self.side_bc)
 
         # Segmenting padded domain
         for i in range(self.cond_map.get_size()):
@@ -76,38 +99,9 @@ class AnisotropicConductivity(Conductivity):
     def __assemble_bvector(self):
         print("Assembling b vector ... ", flush=True, end='')
 
-        I, V = ([] for _ in range(2))
-
-        if self.prescribed_bc is not None:
-            for i in range(1, self.len_x - 1):
-                for j in range(1, self.len_y - 1):
-                    for k in range(1, self.len_z - 1):
-                        if self.prescribed_bc[i - 1, j - 1, k - 1] != np.Inf:
-                            I.append(self.len_x * (self.len_y * k + j) + i)
-                            V.append(self.prescribed_bc[i - 1, j - 1, k - 1])
-        else:
-            # Setting unit temperature
-            i = self.len_x - 2
-            for j in range(1, self.len_y - 1):
-                for k in range(1, self.len_z - 1):
-                    I.append(self.len_x * (self.len_y * k + j) + i)
-                    V.append(1.)
-
-        # Setting linear temperature on the boundaries if Dirichlet
-        if self.side_bc == 'd':
-            x = np.linspace(0, 1, self.len_x - 2)
-            for j in [1, self.len_y - 2]:
-                for i in range(1, self.len_x - 1):
-                    for k in range(1, self.len_z - 1):
-                        I.append(self.len_x * (self.len_y * k + j) + i)
-                        V.append(x[i - 1])
-            for k in [1, self.len_z - 2]:
-                for i in range(2, self.len_x - 2):
-                    for j in range(2, self.len_y - 2):
-                        I.append(self.len_x * (self.len_y * k + j) + i)
-                        V.append(x[i - 1])
-
-        self.bvec = csr_matrix((V, (I, np.zeros(len(I)))), shape=(self.len_xyz, 1))
+        # Setting the prescribed temperatures, or unit temperature, and linear temperature on the sides if Dirichlet
+        prescribed = None if self.prescribed_bc is None else self.prescribed_bc.dirichlet
+        self.bvec = dirichlet_bvector((self.len_x, self.len_y, self.len_z), prescribed, self.side_bc == 'd')
 
         if self.print_matrices[0]:
             self._print_b(self.print_matrices[0])
@@ -117,13 +111,16 @@ class AnisotropicConductivity(Conductivity):
         # Reset layer of Cmat
         self.Kmat[i].fill(0)
 
+        orient = None
         for key, value in self.mat_cond.items():
             mask = self.ws_pad[i_cv] == key
             if len(value) == 6:
                 self.Kmat[i, mask] = value
             else:
-                phi = np.arctan2(self.orient_pad[i_cv, mask, 1], self.orient_pad[i_cv, mask, 0])
-                theta = np.arcsin(self.orient_pad[i_cv, mask, 2])
+                if orient is None:
+                    orient = orientation_slice(self.orient_pad, i_cv, self.orient_reorder)
+                phi = np.arctan2(orient[mask, 1], orient[mask, 0])
+                theta = np.arcsin(orient[mask, 2])
 
                 size = np.sum(mask)
                 Rz_kinit = np.zeros((size, 3, 3), dtype=float)
@@ -182,11 +179,11 @@ class AnisotropicConductivity(Conductivity):
         if self.print_matrices[1]:
             self._print_E(i, i_cv, self.print_matrices[1])
 
-    def __initialize_MPFA(self):
-        # Initialize matrix slice of conductivities
+    def __initialize_MPFA(self, first=0):
+        # Initialize matrix slice of conductivities, starting from the layer before the first slice to compute
         self.Kmat = np.zeros((3, self.len_y, self.len_z, 6), dtype=float)  # per CV
-        self.__compute_Kmat(0, 0)  # Computing first layer of Kmat
-        self.__compute_Kmat(1, 1)  # Computing second layer of Kmat
+        self.__compute_Kmat(0, first)  # Computing first layer of Kmat
+        self.__compute_Kmat(1, first + 1)  # Computing second layer of Kmat
 
         # Initialize MPFA variables
         self.kf = np.zeros((48, self.len_y - 1, self.len_z - 1), dtype=float)  # per IV
@@ -195,7 +192,7 @@ class AnisotropicConductivity(Conductivity):
         self.mpfa12x12 = np.zeros((self.len_y - 1, self.len_z - 1, 12, 12), dtype=float)  # A, C
         self.zeros = np.zeros(self.kf[0].shape)
         self.Aind, self.Cind, self.Dind = create_mpfa_indices()
-        self.__compute_transmissibility(0, 0)  # Computing first layer of E
+        self.__compute_transmissibility(0, first)  # Computing first layer of E
 
     def __creating_indices(self, i):
         # Finding all indices for slice
@@ -214,33 +211,57 @@ class AnisotropicConductivity(Conductivity):
         i_indices = np.repeat(i_indices, 27)
         return i_indices, i_dirvox  # returning dirichlet voxel indices
 
-    def __assemble_Amatrix(self):
-        print("Initializing large data structures ... ", flush=True, end='')
-        I, J = np.zeros((2, 27 * self.len_xyz), dtype=np.uint32)
-        V = np.zeros(27 * self.len_xyz, dtype=float)
+    def __slabs(self):
+        # slabs of interior slices along x, processed independently by the workers
+        return [(start + 1, end + 1) for start, end in split_slabs(self.len_x - 2, self.workers)]
+
+    def __pool_workers(self):
+        # each thread has its own rolling layers (Kmat, kf, Emat, mpfa12x12), slice buffers and flux matrices of the
+        # eight IVs, i.e. about 10 kB per voxel of a slice: the threads are bounded by the free memory
+        doubles_per_voxel = 18 + 48 + 192 + 144 + 1 + 27 * 1.5 + 8 * (12 * 8 + 8)
+        return memory_bounded_workers(self.workers, 8 * doubles_per_voxel * self.len_y * self.len_z)
+
+    def __assemble_slab(self, slab):
+        # each slab works on its own copy of the rolling layers (Kmat, Emat...), initialized on the slice before it,
+        # and only writes its own slices of dir_vox: the rows of A are independent of the order of the slabs
+        start, end = slab
+        local = copy.copy(self)
+        local.__initialize_MPFA(start - 1)
+        slice_size = 27 * (self.len_y - 2) * (self.len_z - 2)
+        size = (slice_size + (self.len_y - 2) * (self.len_z - 2)) * (end - start)  # with the dirichlet voxels
+        I, J = np.zeros((2, size), dtype=np.uint32)
+        V = np.zeros(size, dtype=float)
         counter = 0
         I_dirvox = []
-        self.__initialize_MPFA()
-        j_indices = np.zeros((27 * (self.len_y - 2) * (self.len_z - 2)), dtype=np.uint32)
-        values = np.zeros((27 * (self.len_y - 2) * (self.len_z - 2)), dtype=float)
-        self.dir_vox = self.dir_vox.astype(np.uint8)
-        print("Done")
-
-        # Iterating through interior
-        for i in range(1, self.len_x - 1):
-            self.__compute_Kmat(2, i + 1)  # Computing third layer of Kmat
-            self.__compute_transmissibility(1, i)  # Computing second layer of E
+        j_indices = np.zeros(slice_size, dtype=np.uint32)
+        values = np.zeros(slice_size, dtype=float)
+        halo = None
+        if self.functional is not None:
+            T_iv = np.zeros((8, self.len_y - 2, self.len_z - 2, 8))
+            E_iv = np.zeros((8, self.len_y - 2, self.len_z - 2, 12, 8))
+            halo = np.zeros((4, self.len_y * self.len_z))
+
+        for i in range(start, end):
+            local.__compute_Kmat(2, i + 1)  # Computing third layer of Kmat
+            local.__compute_transmissibility(1, i)  # Computing second layer of E
+
+            # coefficients of the temperatures in the flux along x, running the flux kernel on their indices
+            if halo is not None:
+                fill_flux_matrices(i, self.len_x, self.len_y, self.len_z, self.__index_slices(i), local.Emat,
+                                   *E_iv, *T_iv)
+                slab_add_at(self.functional, halo, T_iv.astype(np.int64),
+                            np.einsum('vi,vyzij->vyzj', self.flux_select[0], E_iv), slab, self.len_x)
 
             # If all surrounding IV are unstable (i.e. partly or all gaseous), then put middle CV as Dirichlet
-            find_unstable_vox(i, self.len_y, self.len_z, self.dir_vox, self.unstable)
+            find_unstable_vox(i, self.len_y, self.len_z, self.dir_vox, local.unstable)
 
             # Creating j indices and divergence values for slice
             j_indices.fill(0)
             values.fill(np.NaN)
-            divP(i, self.len_x, self.len_y, self.len_z, self.dir_vox, j_indices, values, self.Emat)
+            divP(i, self.len_x, self.len_y, self.len_z, self.dir_vox, j_indices, values, local.Emat)
 
             # Creating i indices for slice
-            i_indices, i_dirvox = self.__creating_indices(i)
+            i_indices, i_dirvox = local.__creating_indices(i)
             if i_indices.size > 0:
                 I[counter:counter + i_indices.size] = i_indices
             I_dirvox.extend(i_dirvox)
@@ -251,20 +272,32 @@ class AnisotropicConductivity(Conductivity):
                 counter += i_indices.size
 
             # Passing second layer to first
-            self.Emat[0] = self.Emat[1]
-            self.Kmat[:2] = self.Kmat[1:]
-            sys.stdout.write("\rAssembling A matrix ... {:.1f}% ".format(i / (self.len_x - 2) * 100))
+            local.Emat[0] = local.Emat[1]
+            local.unstable[0] = local.unstable[1]
+            local.Kmat[:2] = local.Kmat[1:]
+        del local, j_indices, values
 
-        # Clear unnecessary variables before creating A
-        del self.Emat, self.kf, self.Kmat, self.unstable
-        del self.dir_vox, i_indices, j_indices, values, i_dirvox, i
-
-        # Adding all dirichlet voxels
+        # Adding the slab's dirichlet voxels, and compressing its rows (only this slab writes them)
         I[counter:counter + len(I_dirvox)] = I_dirvox
         J[counter:counter + len(I_dirvox)] = I_dirvox
         V[counter:counter + len(I_dirvox)] = 1
         counter += len(I_dirvox)
-        del I_dirvox
+        return compact_csr(I[:counter], J[:counter], V[:counter], self.len_xyz), halo
+
+    def __assemble_Amatrix(self):
+        print("Assembling A matrix ... ", flush=True, end='')
+        self.dir_vox = self.dir_vox.astype(np.uint8)
+        if self.effective_tolerance is not None and self.solver_type != 'direct':
+            self.__setup_flux_contraction()
+            self.functional = np.zeros(self.len_xyz)
+        slabs = run_in_pool(self.__assemble_slab, self.__slabs(), self.__pool_workers())
+        if self.functional is not None:
+            merge_slab_halos(self.functional, [slab[1] for slab in slabs], self.__slabs(), self.len_x)
+            self.functional *= -self.ws.voxel_length / ((self.len_y - 2) * (self.len_z - 2))
+
+        # Clear unnecessary variables before creating A
+        blocks = [slab[0] for slab in slabs]
+        del self.dir_vox, slabs
 
         # Add diagonal 1s for exterior voxels
         diag_1s = np.ones_like(self.ws_pad, dtype=int)
@@ -273,29 +306,19 @@ class AnisotropicConductivity(Conductivity):
         diag_1s = self.len_x * (self.len_y * ind[2] + ind[1]) + ind[0]
         diag_1s = diag_1s.astype(np.uint32)
         del ind
-        I[counter:counter + diag_1s.size] = diag_1s
-        J[counter:counter + diag_1s.size] = diag_1s
-        V[counter:counter + diag_1s.size] = 1
-        counter += diag_1s.size
+        I, J, V = diag_1s, diag_1s, np.ones(diag_1s.size)
 
         # Add non-diagonal 1s for exterior voxels
         if self.side_bc is not "d":
-            I[counter:counter + diag_1s.size] = diag_1s
-            add_nondiag(diag_1s, self.len_x, self.len_y, self.len_z, self.side_bc)
-            J[counter:counter + diag_1s.size] = diag_1s
-            V[counter:counter + diag_1s.size] = -1
-            counter += diag_1s.size
-        del diag_1s, counter
-
-        # Assemble sparse A matrix
-        self.Amat = csr_matrix((V, (I, J)), shape=(self.len_xyz, self.len_xyz))
-
-        # Simple preconditioner
-        diag = self.Amat.diagonal()
-        if np.any(diag == 0):
-            self.M = None  # identity matrix if singularity has happened in MPFA
-        else:
-            self.M = diags(1. / self.Amat.diagonal(), 0).tocsr()
+            nondiag_1s = diag_1s.copy()
+            add_nondiag(nondiag_1s, self.len_x, self.len_y, self.len_z, self.side_bc)
+            I, J, V = np.hstack((I, diag_1s)), np.hstack((J, nondiag_1s)), np.hstack((V, -np.ones(diag_1s.size)))
+            del nondiag_1s
+        blocks.append(compact_csr(I, J, V, self.len_xyz))
+        del diag_1s, I, J, V
+
+        # Assemble sparse A matrix from the disjoint rows of the slabs and of the exterior voxels
+        self.Amat = stack_rows(blocks, (self.len_xyz, self.len_xyz))
 
         if self.print_matrices[2]:
             self._print_A(self.print_matrices[2])
@@ -304,135 +327,139 @@ class AnisotropicConductivity(Conductivity):
     def __solve(self):
         print("Solving Ax=b system ... ", end='')
 
-        info = 0
-        if self.solver_type == 'direct':
-            print("Direct solver", end='')
-            try:
-                import scikits.umfpack
-                x = spsolve(self.Amat, self.bvec, use_umfpack=True)
-            except ImportError:
-                x = spsolve(self.Amat, self.bvec)
-
-
-        else:  # iterative solvers
-            Tinitial_guess = np.zeros((self.len_x, self.len_y, self.len_z), dtype=float)
+        # linear initial guess along the direction of the solve, or solution of the coarser level rotated and padded
+        # like the domain (not used by the direct solver)
+        if self.initial_guess is not None:
+            x0 = np.pad(self.initial_guess.transpose(self.reorder), 1, mode='edge')
+        else:
+            x0 = np.zeros((self.len_x, self.len_y, self.len_z), dtype=float)
             for i in range(self.len_x - 1):
-                Tinitial_guess[i] = i / (self.len_x - 2.)
-            Tinitial_guess = Tinitial_guess.flatten('F')
-
-            if self.solver_type == 'gmres':
-                print("gmres:")
-                if self.display_iter:
-                    x, info = gmres(self.Amat, self.bvec.todense(), x0=Tinitial_guess, atol=self.tolerance,
-                                    maxiter=self.maxiter, callback=SolverDisplay(), M=self.M)
-                else:
-                    x, info = gmres(self.Amat, self.bvec.todense(), x0=Tinitial_guess, atol=self.tolerance,
-                                    maxiter=self.maxiter, M=self.M)
-
-            elif self.solver_type == 'cg':
-                print("Conjugate Gradient:")
-                if self.display_iter:
-                    x, info = cg(self.Amat, self.bvec.todense(), x0=Tinitial_guess, atol=self.tolerance,
-                                 maxiter=self.maxiter, callback=SolverDisplay(), M=self.M)
-                else:
-                    x, info = cg(self.Amat, self.bvec.todense(), x0=Tinitial_guess, atol=self.tolerance,
-                                 maxiter=self.maxiter, M=self.M)
-
-            else:
-                if self.solver_type != 'bicgstab':
-                    print_warning("Unrecognized solver, defaulting to bicgstab.")
-                print("Bicgstab:")
-                if self.display_iter:
-                    x, info = bicgstab(self.Amat, self.bvec.todense(), x0=Tinitial_guess, atol=self.tolerance,
-                                       maxiter=self.maxiter, M=self.M, callback=SolverDisplay())
-                else:
-                    x, info = bicgstab(self.Amat, self.bvec.todense(), x0=Tinitial_guess, atol=self.tolerance,
-                                       maxiter=self.maxiter, M=self.M)
-
-        if info != 0:
-            raise Exception("Solver error: " + str(info))
+                x0[i] = i / (self.len_x - 2.)
+
+        criterion = None
+        if self.functional is not None:
+            criterion = EffectiveConvergence(self.functional.dot, self.effective_tolerance, self.check_every)
+        solver = KrylovSolver(self.solver_type, self.tolerance, self.maxiter, self.preconditioner, self.backend,
+                              self.workers, self.display_iter, display_every=10, criterion=criterion)
+        t = Timer()
+        x = solver.solve(self.Amat, self.bvec, x0.flatten('F'))
+        self.solve_time = t.elapsed()
+        self.iterations = solver.iterations
+        if not solver.converged:
+            raise Exception("Solver error: " + str(solver.info))
+        if criterion is not None:
+            self.convergence_trace = criterion.trace
 
         del self.Amat, self.bvec
-        self.T = x.reshape([self.len_x, self.len_y, self.len_z], order='F')
+        self.functional = None
+        self.T = self.__temperature(x)
+        return True, print(" ... Done")
+
+    def coarse_solver(self, workspace):
+        # same problem on a coarser domain, for the multilevel initial guess
+        return AnisotropicConductivity(workspace, self.cond_map, self.direction, self.side_bc, None, self.tolerance,
+                                       self.maxiter, self.solver_type, self.display_iter, (0, 0, 0, 0, 0), self.workers,
+                                       'effective', self.preconditioner, self.backend, self.effective_tolerance,
+                                       self.check_every)
+
+    def __temperature(self, x):
+        T = x.reshape([self.len_x, self.len_y, self.len_z], order='F')
 
         # Mirroring boundaries for flux computation
-        self.T[0] = self.T[1]
-        self.T[-1] = self.T[-2]
+        T[0] = T[1]
+        T[-1] = T[-2]
         if self.side_bc == "d":
-            self.T[:, 0] = self.T[:, 1]
-            self.T[:, -1] = self.T[:, -2]
-            self.T[:, :, 0] = self.T[:, :, 1]
-            self.T[:, :, -1] = self.T[:, :, -2]
-        return True, print(" ... Done")
+            T[:, 0] = T[:, 1]
+            T[:, -1] = T[:, -2]
+            T[:, :, 0] = T[:, :, 1]
+            T[:, :, -1] = T[:, :, -2]
+        return T
+
+    def __index_slices(self, i):
+        # indices of the (mirrored, see __temperature) temperatures of the slices i - 1 to i + 1, in place of their
+        # values: the conductivity along the direction of the solve is a linear function of the temperature iterate
+        x = np.clip(np.arange(i - 1, i + 2), 1, self.len_x - 2)
+        y, z = np.arange(self.len_y), np.arange(self.len_z)
+        if self.side_bc == "d":
+            y, z = np.clip(y, 1, self.len_y - 2), np.clip(z, 1, self.len_z - 2)
+        return (x[:, None, None] + self.len_x * (y[None, :, None] + self.len_y * z[None, None, :])).astype(float)
 
     def __compute_effective_coefficient(self):
-        self.__compute_fluxes()
+        partial_sums = self.__compute_fluxes()
 
-        # Accumulating and volume averaging stresses
-        fluxes = [np.sum(self.q[:, :, :, i]) / ((self.len_x - 2) * (self.len_y - 2) * (self.len_z - 2))
+        # Accumulating and volume averaging the partial sums of the fluxes of every slab
+        fluxes = [np.sum(partial_sums[:, i]) / ((self.len_x - 2) * (self.len_y - 2) * (self.len_z - 2))
                   for i in range(3)]
         self.keff = [-fluxes[i] * (self.len_x - 2) * self.ws.voxel_length for i in range(3)]
 
-        # Rotating output back
+        # Rotating output back (the flux was written in the original orientation)
         if self.direction == 'y':
             self.T = self.T.transpose(1, 0, 2)
-            self.q = self.q.transpose(1, 0, 2, 3)[:, :, :, [1, 0, 2]]
             self.keff = [self.keff[1], self.keff[0], self.keff[2]]
         elif self.direction == 'z':
             self.T = self.T.transpose(2, 1, 0)
-            self.q = self.q.transpose(2, 1, 0, 3)[:, :, :, [2, 1, 0]]
             self.keff = [self.keff[2], self.keff[1], self.keff[0]]
 
-    def __compute_fluxes(self):
-        # Initialize required data structures
-        self.q = np.zeros((self.len_x - 2, self.len_y - 2, self.len_z - 2, 3), dtype=float)
-        self.__initialize_MPFA()
-        T_sw, T_se, T_nw, T_ne, T_tsw, T_tse, T_tnw, T_tne = np.zeros((8, self.len_y - 2, self.len_z - 2, 8))
-        E_sw, E_se, E_nw, E_ne, E_tsw, E_tse, E_tnw, E_tne = np.zeros((8, self.len_y - 2, self.len_z - 2, 12, 8))
+    def __compute_fluxes_slab(self, slab):
+        # same rolling layers as in the assembly, writing the fluxes of the slab's slices into the shared q (if any)
+        start, end = slab
+        local = copy.copy(self)
+        local.__initialize_MPFA(start - 1)
+        T_iv = np.zeros((8, self.len_y - 2, self.len_z - 2, 8))
+        E_iv = np.zeros((8, self.len_y - 2, self.len_z - 2, 12, 8))
+        partial_sum = np.zeros(3)
 
-        # Iterating through interior
-        for i in range(1, self.len_x - 1):
-            self.__compute_Kmat(2, i + 1)  # Computing third layer of Kmat
-            self.__compute_transmissibility(1, i)  # Computing second layer of E
+        for i in range(start, end):
+            local.__compute_Kmat(2, i + 1)  # Computing third layer of Kmat
+            local.__compute_transmissibility(1, i)  # Computing second layer of E
 
             # filling eight IVs
-            fill_flux_matrices(i, self.len_x, self.len_y, self.len_z, self.T[i - 1:i + 2], self.Emat,
-                               E_sw, E_se, E_nw, E_ne, E_tsw, E_tse, E_tnw, E_tne,
-                               T_sw, T_se, T_nw, T_ne, T_tsw, T_tse, T_tnw, T_tne)
-
-            # Computing fluxes by computing E x T
-            q_sw = np.squeeze(E_sw @ T_sw[:, :, :, np.newaxis])
-            q_se = np.squeeze(E_se @ T_se[:, :, :, np.newaxis])
-            q_nw = np.squeeze(E_nw @ T_nw[:, :, :, np.newaxis])
-            q_ne = np.squeeze(E_ne @ T_ne[:, :, :, np.newaxis])
-            q_tsw = np.squeeze(E_tsw @ T_tsw[:, :, :, np.newaxis])
-            q_tse = np.squeeze(E_tse @ T_tse[:, :, :, np.newaxis])
-            q_tnw = np.squeeze(E_tnw @ T_tnw[:, :, :, np.newaxis])
-            q_tne = np.squeeze(E_tne @ T_tne[:, :, :, np.newaxis])
-
-            # Summing fluxes CV-wise
-            self.q[i - 1, :, :, 0] = (q_se[:, :, 3] + q_ne[:, :, 2] + q_tse[:, :, 1] + q_tne[:, :, 0] +
-                                      q_sw[:, :, 3] + q_nw[:, :, 2] + q_tsw[:, :, 1] + q_tnw[:, :, 0]) / 4
-            self.q[i - 1, :, :, 1] = (q_nw[:, :, 7] + q_ne[:, :, 6] + q_tnw[:, :, 5] + q_tne[:, :, 4] +
-                                      q_sw[:, :, 7] + q_se[:, :, 6] + q_tsw[:, :, 5] + q_tse[:, :, 4]) / 4
-            self.q[i - 1, :, :, 2] = (q_tsw[:, :, 11] + q_tse[:, :, 10] + q_tnw[:, :, 9] + q_tne[:, :, 8] +
-                                      q_sw[:, :, 11] + q_se[:, :, 10] + q_nw[:, :, 9] + q_ne[:, :, 8]) / 4
+            fill_flux_matrices(i, self.len_x, self.len_y, self.len_z, self.T[i - 1:i + 2], local.Emat, *E_iv, *T_iv)
+
+            # Computing fluxes E x T of the eight IVs and summing them CV-wise, in one contraction
+            if self.q_rotated is None:
+                partial_sum += np.einsum('cvi,vyzij,vyzj->c', self.flux_select, E_iv, T_iv, optimize=self.flux_path)
+            else:
+                q = np.einsum('cvi,vyzij,vyzj->yzc', self.flux_select, E_iv, T_iv, optimize=self.flux_path)
+                self.q_rotated[i - 1][:, :, self.reorder] = q
+                partial_sum += q.sum(axis=(0, 1))
 
             # Passing second layer to first
-            self.Emat[0] = self.Emat[1]
-            self.Kmat[0:2] = self.Kmat[1:3]
-            sys.stdout.write("\rComputing fluxes ... {:.1f}% ".format(i / (self.len_x - 2) * 100))
-        del self.Emat, self.kf, self.Kmat, self.unstable
+            local.Emat[0] = local.Emat[1]
+            local.Kmat[0:2] = local.Kmat[1:3]
+        return partial_sum
+
+    def __setup_flux_contraction(self):
+        # selection of the IV flux rows, averaged over the four IVs sharing each face, in spatial units
+        self.flux_select = np.zeros((3, 8, 12))
+        for c in range(3):
+            self.flux_select[c, np.arange(8), FLUX_ROWS[c]] = 1. / (4 * self.ws.voxel_length)
+        shape = (8, self.len_y - 2, self.len_z - 2)
+        self.flux_path = np.einsum_path('cvi,vyzij,vyzj->yzc', self.flux_select, np.empty(shape + (12, 8)),
+                                        np.empty(shape + (8,)), optimize='optimal')[0]
+
+    def __compute_fluxes(self):
+        print("Computing fluxes ... ", flush=True, end='')
+        self.__setup_flux_contraction()
+
+        # flux field (if requested) in the original orientation, written through a view in the rotated one
+        interior = np.array([self.len_x - 2, self.len_y - 2, self.len_z - 2])
+        self.q = allocate_field(tuple(interior[np.argsort(self.reorder)]) + (3,), self.outputs)
+        self.q_rotated = None if self.q is None else self.q.transpose(self.reorder + [3])
+        partial_sums = np.array(run_in_pool(self.__compute_fluxes_slab, self.__slabs(), self.__pool_workers()))
+        self.q_rotated = None
+        if isinstance(self.q, np.memmap):
+            self.q.flush()
 
         # Extract only interior temperature, ignoring exterior used as bc
         self.T = self.T[1:-1, 1:-1, 1:-1]
-        self.q /= self.ws.voxel_length
 
         if self.print_matrices[3]:
             print_T(self.T, self.print_matrices[3])
-        if self.print_matrices[4]:
+        if self.print_matrices[4] and self.q is not None:
             print_flux(self.q, self.print_matrices[4])
         print("Done")
+        return partial_sums
 
     def error_check(self):
         if Conductivity.error_check(self):
@@ -447,9 +474,7 @@ class AnisotropicConductivity(Conductivity):
             if len(k) == 2:
                 self.need_to_orient = True
                 if self.ws.orientation.shape[:3] != self.ws.matrix.shape or \
-                        not 0.9 < np.min(np.linalg.norm(self.ws.orientation[np.logical_and(self.ws.matrix >= low,
-                                                                                           self.ws.matrix <= high)],
-                                                        axis=1)) < 1.1:
+                        not self.__valid_orientation(np.logical_and(self.ws.matrix >= low, self.ws.matrix <= high)):
                     raise Exception("The Workspace needs an orientation in order to align the conductivities.")
 
             # segmenting tmp domain to check if all values covered by mat_cond
@@ -465,6 +490,11 @@ class AnisotropicConductivity(Conductivity):
             raise Exception("Print_matrices must be a tuple with 5 booleans.")
         return False
 
+    def __valid_orientation(self, mask):
+        if is_encoded_orientation(self.ws.orientation):  # encoded vectors are unit, except for the (0, 0) code
+            return not np.any(np.all(self.ws.orientation[mask] == 0, axis=1))
+        return 0.9 < np.min(np.linalg.norm(self.ws.orientation[mask], axis=1)) < 1.1
+
     # Printing functions of system matrices
     def _print_E(self, i, i_cv, dec=4):
         np.set_printoptions(precision=dec)
@@ -483,7 +513,7 @@ class AnisotropicConductivity(Conductivity):
         print(self.Amat.toarray())
 
     def _print_b(self, dec=1):
-        vector = self.bvec.toarray()
+        vector = self.bvec[:, np.newaxis]
         print()
         print("b vector:")
         for k in range(self.len_z):
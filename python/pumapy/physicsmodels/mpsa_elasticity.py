@@ -3,18 +3,32 @@ from pumapy.physicsmodels.elasticity_utils import (fill_stress_matrices, flatten
                                                    find_unstable_vox)
 from pumapy.physicsmodels.mpxa_matrices import fill_Ampsa, fill_Bmpsa, fill_Cmpsa, fill_Dmpsa, create_mpsa_indices
 from pumapy.utilities.workspace import Workspace
-from pumapy.utilities.boundary_conditions import ElasticityBC
-from pumapy.physicsmodels.isotropic_conductivity import SolverDisplay
-from pumapy.utilities.logger import print_warning
+from pumapy.utilities.boundary_conditions import ElasticityBC, dirichlet_bvector
+from pumapy.physicsmodels.linear_solver import KrylovSolver, EffectiveConvergence, check_solver_options
+from pumapy.physicsmodels.multilevel import coarse_to_fine
+from pumapy.utilities.timer import Timer
+from pumapy.utilities.orientation_encoding import pad_orientation, orientation_slice, is_encoded_orientation
+from pumapy.utilities.parallel import (get_workers, split_slabs, run_in_pool, allocate_field, slab_add_at,
+                                      merge_slab_halos, memory_bounded_workers, compact_csr, stack_rows)
 import numpy as np
-from scipy.sparse import csr_matrix, diags
-from scipy.sparse.linalg import bicgstab, spsolve, cg, gmres
+import copy
 import sys
 
 
+# stress rows of the eight IVs (sw, se, nw, ne, tsw, tse, tnw, tne) summed into each direct stress of their CV,
+# and the two sets of rows summed into each shear stress (yz, xz, xy)
+STRESS_ROWS = ((9, 9, 6, 6, 3, 3, 0, 0),
+               (21, 18, 21, 18, 15, 12, 15, 12),
+               (33, 30, 27, 24, 33, 30, 27, 24))
+SHEAR_ROWS = (((34, 31, 28, 25, 34, 31, 28, 25), (23, 20, 23, 20, 17, 14, 17, 14)),
+              ((35, 32, 29, 26, 35, 32, 29, 26), (10, 10, 7, 7, 4, 4, 1, 1)),
+              ((22, 19, 22, 19, 16, 13, 16, 13), (11, 11, 8, 8, 5, 5, 2, 2)))
+
+
 class Elasticity:
     def __init__(self, workspace, elast_map, direction, side_bc, prescribed_bc, tolerance, maxiter, solver_type,
-                 display_iter, print_matrices):
+                 display_iter, print_matrices, workers=None, outputs='fields', preconditioner='jacobi',
+                 backend=None, effective_tolerance=None, check_every=10, levels=1):
         self.ws = workspace
         self.elast_map = elast_map
         self.direction = direction
@@ -25,12 +39,30 @@ class Elasticity:
         self.display_iter = display_iter
         self.prescribed_bc = prescribed_bc
         self.print_matrices = print_matrices
+        self.workers = get_workers(workers)
+        self.outputs = outputs
+        self.preconditioner = preconditioner
+        self.backend = backend
+        self.effective_tolerance = effective_tolerance
+        self.check_every = check_every
+        self.convergence_trace = None
+        self.levels = levels
+        self.initial_guess = None
+        self.level_stats = None
         self.mat_elast = dict()
         self.need_to_orient = False  # changes if (E_axial, E_radial, nu_poissrat_12, nu_poissrat_23, G12) detected
         self.orient_pad = None
+        self.orient_reorder = [0, 1, 2]
+        self.reorder = [0, 1, 2]
+        self.s_rotated = None
+        self.t_rotated = None
+        self.stress_select = None
+        self.stress_path = None
+        self.functional = None
 
         self.Ceff = [-1., -1., -1.]
         self.solve_time = -1
+        self.iterations = 0
         self.u = np.zeros([1, 1, 1])
         self.s = np.zeros([1, 1, 1, 3])
         self.t = np.zeros([1, 1, 1, 3])
@@ -41,6 +73,8 @@ class Elasticity:
         self.len_xyz = self.len_xy * self.len_z
 
     def compute(self):
+        if self.levels > 1:
+            coarse_to_fine(self, self.elast_map, 'u')
         self.initialize()
         self.assemble_bvector()
         self.assemble_Amatrix()
@@ -79,12 +113,15 @@ class Elasticity:
                     C = R.T @ C @ R
                     self.mat_elast[key] = tuple(C[np.triu_indices(6)])
 
+        self.reorder = reorder
         self.ws_pad = np.zeros(shape, dtype=np.uint16)
         self.ws_pad[1:-1, 1:-1, 1:-1] = self.ws.matrix.transpose(reorder)
 
         if self.need_to_orient:
-            self.orient_pad = np.zeros(shape + [3], dtype=float)
-            self.orient_pad[1:-1, 1:-1, 1:-1, :] = self.ws.orientation.transpose(reorder + [3])[:, :, :, reorder]
+            # kept in the Workspace storage type (possibly encoded), decoded one slice at a time in compute_Cmat
+            self.orient_reorder = reorder
+            self.orient_pad = pad_orientation(self.ws.orientation, reorder,
+                                              {'p': 'wrap', 'f': 'constant'}.get(self.side_bc, 'edge'))
 
         self.len_x, self.len_y, self.len_z = shape
         self.len_xy = self.len_x * self.len_y
@@ -92,7 +129,7 @@ class Elasticity:
 
         if self.side_bc is not "f":
             # Padding domain, imposing symmetric or periodic BC on faces
-            pad_domain(self.ws_pad, self.orient_pad, self.need_to_orient, self.len_x, self.len_y, self.len_z,
+            pad_domain(self.ws_pad, None, False, self.len_x, self.len_y, self.len_z,
                        self.side_bc)
 
         # Segmenting padded domain
@@ -111,44 +148,12 @@ class Elasticity:
     def assemble_bvector(self):
         print("Assembling b vector ... ", flush=True, end='')
 
-        I, V = ([] for _ in range(2))
-
-        if self.prescribed_bc is not None:
-            for i in range(1, self.len_x - 1):
-                for j in range(1, self.len_y - 1):
-                    for k in range(1, self.len_z - 1):
-                        if self.prescribed_bc[i - 1, j - 1, k - 1, 0] != np.Inf:
-                            I.append(self.len_x * (self.len_y * k + j) + i)
-                            V.append(self.prescribed_bc[i - 1, j - 1, k - 1, 0])  # ux
-                        if self.prescribed_bc[i - 1, j - 1, k - 1, 1] != np.Inf:
-                            I.append(self.len_xyz + self.len_x * (self.len_y * k + j) + i)
-                            V.append(self.prescribed_bc[i - 1, j - 1, k - 1, 1])  # uy
-                        if self.prescribed_bc[i - 1, j - 1, k - 1, 2] != np.Inf:
-                            I.append(2 * self.len_xyz + self.len_x * (self.len_y * k + j) + i)
-                            V.append(self.prescribed_bc[i - 1, j - 1, k - 1, 2])  # uz
-        else:
-            # Setting unit displacement
-            i = self.len_x - 2
-            for j in range(1, self.len_y - 1):
-                for k in range(1, self.len_z - 1):
-                    I.append(self.len_x * (self.len_y * k + j) + i)
-                    V.append(1.)
-
-        # Setting linear displacement on the boundaries if Dirichlet
-        if self.side_bc == 'd' and self.direction is not None:
-            x = np.linspace(0, 1, self.len_x - 2)
-            for j in [1, self.len_y - 2]:
-                for i in range(1, self.len_x - 1):
-                    for k in range(1, self.len_z - 1):
-                        I.append(self.len_x * (self.len_y * k + j) + i)
-                        V.append(x[i - 1])
-            for k in [1, self.len_z - 2]:
-                for i in range(2, self.len_x - 2):
-                    for j in range(2, self.len_y - 2):
-                        I.append(self.len_x * (self.len_y * k + j) + i)
-                        V.append(x[i - 1])
-
-        self.bvec = csr_matrix((V, (I, np.zeros(len(I)))), shape=(3 * self.len_xyz, 1))
+        # Setting the prescribed displacements, or unit displacement, and linear displacement on the sides if Dirichlet
+        prescribed = self.prescribed_bc
+        if isinstance(prescribed, ElasticityBC):
+            prescribed = prescribed.dirichlet
+        self.bvec = dirichlet_bvector((self.len_x, self.len_y, self.len_z), prescribed,
+                                      self.side_bc == 'd' and self.direction is not None, components=3)
 
         if self.print_matrices[0]:
             self._print_b(self.print_matrices[0])
@@ -172,6 +177,7 @@ class Elasticity:
         self.Cmat[i].fill(0)
 
         # Assigning elasticities throughout domain
+        orient = None
         for key, value in self.mat_elast.items():
             mask = self.ws_pad[i_cv] == key
             if len(value) == 21:
@@ -194,10 +200,12 @@ class Elasticity:
                 C_init = np.repeat(C_tmp[:, :, np.newaxis], size, axis=2)
 
                 # Rotation matrix
-                theta = np.arctan2(self.orient_pad[i_cv, mask, 1], self.orient_pad[i_cv, mask, 0])
+                if orient is None:
+                    orient = orientation_slice(self.orient_pad, i_cv, self.orient_reorder)
+                theta = np.arctan2(orient[mask, 1], orient[mask, 0])
                 a21 = -np.sin(theta)
                 a22 = np.cos(theta)
-                beta = np.arcsin(self.orient_pad[i_cv, mask, 2])
+                beta = np.arcsin(orient[mask, 2])
                 a13 = np.sin(beta)
                 a33 = np.cos(beta)
                 a11 = a22 * a33
@@ -254,11 +262,11 @@ class Elasticity:
         if self.print_matrices[1]:
             self._print_E(i, i_cv, self.print_matrices[1])
 
-    def __initialize_MPSA(self):
-        # Initialize matrix slice of conductivities
+    def __initialize_MPSA(self, first=0):
+        # Initialize matrix slice of conductivities, starting from the layer before the first slice to compute
         self.Cmat = np.zeros((3, self.len_y, self.len_z, 21), dtype=float)  # per CV
-        self.__compute_Cmat(0, 0)  # Computing first layer of Kmat
-        self.__compute_Cmat(1, 1)  # Computing second layer of Kmat
+        self.__compute_Cmat(0, first)  # Computing first layer of Kmat
+        self.__compute_Cmat(1, first + 1)  # Computing second layer of Kmat
 
         # Initialize MPSA variables
         self.Cf = np.zeros((168, self.len_y - 1, self.len_z - 1), dtype=float)  # per IV
@@ -266,7 +274,7 @@ class Elasticity:
         self.unstable = np.zeros((2, self.len_y - 1, self.len_z - 1), dtype=bool)
         self.mpsa36x36 = np.zeros((self.len_y - 1, self.len_z - 1, 36, 36), dtype=float)  # A, C
         self.Aind, self.Cind, self.Dind = create_mpsa_indices()
-        self.__compute_transmissibility(0, 0)  # Computing first layer of E
+        self.__compute_transmissibility(0, first)  # Computing first layer of E
 
     def __creating_indices(self, i):
         # Finding all indices for slice
@@ -292,33 +300,57 @@ class Elasticity:
         i_indices = np.repeat(i_indices, 81)
         return i_indices, i_dirvox  # returning dirichlet voxel indices
 
-    def assemble_Amatrix(self):
-        print("Initializing large data structures ... ", flush=True, end='')
-        I, J = np.zeros((2, 81 * 3 * self.len_xyz), dtype=np.uint32)
-        V = np.zeros(81 * 3 * self.len_xyz, dtype=float)
-        counter = 0  # counter to keep record of the index in Amat
+    def __slabs(self):
+        # slabs of interior slices along x, processed independently by the workers
+        return [(start + 1, end + 1) for start, end in split_slabs(self.len_x - 2, self.workers)]
+
+    def __pool_workers(self):
+        # each thread has its own rolling layers (Cmat, Cf, Emat, mpsa36x36), slice buffers and stress matrices of the
+        # eight IVs, i.e. about 86 kB per voxel of a slice: the threads are bounded by the free memory
+        doubles_per_voxel = 63 + 168 + 1728 + 1296 + 243 * 1.5 + 8 * (36 * 24 + 24)
+        return memory_bounded_workers(self.workers, 8 * doubles_per_voxel * self.len_y * self.len_z)
+
+    def __assemble_slab(self, slab):
+        # each slab works on its own copy of the rolling layers (Cmat, Emat...), initialized on the slice before it,
+        # and only writes its own slices of dir_vox: the rows of A are independent of the order of the slabs
+        start, end = slab
+        local = copy.copy(self)
+        local.__initialize_MPSA(start - 1)
+        slice_size = 81 * 3 * (self.len_y - 2) * (self.len_z - 2)
+        size = (slice_size + 3 * (self.len_y - 2) * (self.len_z - 2)) * (end - start)  # with the dirichlet voxels
+        I, J = np.zeros((2, size), dtype=np.uint32)
+        V = np.zeros(size, dtype=float)
+        counter = 0  # counter to keep record of the index in the slab's entries
         I_dirvox = []
-        self.__initialize_MPSA()
-        j_indices = np.zeros((81 * 3 * (self.len_y - 2) * (self.len_z - 2)), dtype=np.uint32)
-        values = np.zeros((81 * 3 * (self.len_y - 2) * (self.len_z - 2)), dtype=float)
-        self.dir_vox = self.dir_vox.astype(np.uint8)
-        print("Done")
-
-        # Iterating through interior
-        for i in range(1, self.len_x - 1):
-            self.__compute_Cmat(2, i + 1)  # Computing third layer of Cmat
-            self.__compute_transmissibility(1, i)  # Computing second layer of E
+        j_indices = np.zeros(slice_size, dtype=np.uint32)
+        values = np.zeros(slice_size, dtype=float)
+        halo = None
+        if self.functional is not None:
+            u_iv = np.zeros((8, self.len_y - 2, self.len_z - 2, 24))
+            E_iv = np.zeros((8, self.len_y - 2, self.len_z - 2, 36, 24))
+            halo = np.zeros((4, 3 * self.len_y * self.len_z))
+
+        for i in range(start, end):
+            local.__compute_Cmat(2, i + 1)  # Computing third layer of Cmat
+            local.__compute_transmissibility(1, i)  # Computing second layer of E
+
+            # coefficients of the displacements in the direct stress along x, running the stress kernel on their indices
+            if halo is not None:
+                fill_stress_matrices(i, self.len_x, self.len_y, self.len_z, self.__index_slices(i), local.Emat,
+                                     *E_iv, *u_iv)
+                slab_add_at(self.functional, halo, u_iv.astype(np.int64),
+                            np.einsum('vi,vyzij->vyzj', self.stress_select[0], E_iv), slab, self.len_x)
 
             # If all surrounding IV are unstable (i.e. partly or all gaseous), then put middle CV as Dirichlet
-            find_unstable_vox(i, self.len_y, self.len_z, self.dir_vox, self.unstable)
+            find_unstable_vox(i, self.len_y, self.len_z, self.dir_vox, local.unstable)
 
             # Creating j indices and divergence values for slice
             j_indices.fill(-1)
             values.fill(np.NaN)
-            divP(i, self.len_x, self.len_y, self.len_z, self.dir_vox, j_indices, values, self.Emat)
+            divP(i, self.len_x, self.len_y, self.len_z, self.dir_vox, j_indices, values, local.Emat)
 
             # Creating i indices for slice
-            i_indices, i_dirvox = self.__creating_indices(i)
+            i_indices, i_dirvox = local.__creating_indices(i)
             if i_indices.size > 0:
                 I[counter:counter + i_indices.size] = i_indices
             I_dirvox.extend(i_dirvox)
@@ -329,21 +361,32 @@ class Elasticity:
                 counter += i_indices.size
 
             # Passing second layer to first
-            self.Emat[0] = self.Emat[1]
-            self.unstable[0] = self.unstable[1]
-            self.Cmat[:2] = self.Cmat[1:]
-            sys.stdout.write("\rAssembling A matrix ... {:.1f}% ".format(i / (self.len_x - 2) * 100))
-
-        # Clear unnecessary variables before creating A
-        del self.Emat, self.Cf, self.Cmat, self.mpsa36x36, self.unstable
-        del self.dir_vox, i_indices, i_dirvox, i, j_indices, values
+            local.Emat[0] = local.Emat[1]
+            local.unstable[0] = local.unstable[1]
+            local.Cmat[:2] = local.Cmat[1:]
+        del local, j_indices, values
 
-        # Adding all dirichlet voxels
+        # Adding the slab's dirichlet voxels, and compressing its rows (only this slab writes them)
         I[counter:counter + len(I_dirvox)] = I_dirvox
         J[counter:counter + len(I_dirvox)] = I_dirvox
         V[counter:counter + len(I_dirvox)] = 1
         counter += len(I_dirvox)
-        del I_dirvox
+        return compact_csr(I[:counter], J[:counter], V[:counter], 3 * self.len_xyz), halo
+
+    def assemble_Amatrix(self):
+        print("Assembling A matrix ... ", flush=True, end='')
+        self.dir_vox = self.dir_vox.astype(np.uint8)
+        if self.effective_tolerance is not None and self.direction is not None and self.solver_type != 'direct':
+            self.__setup_stress_contraction()
+            self.functional = np.zeros(3 * self.len_xyz)
+        slabs = run_in_pool(self.__assemble_slab, self.__slabs(), self.__pool_workers())
+        if self.functional is not None:
+            merge_slab_halos(self.functional, [slab[1] for slab in slabs], self.__slabs(), self.len_x)
+            self.functional *= self.ws.voxel_length / ((self.len_y - 2) * (self.len_z - 2))
+
+        # Clear unnecessary variables before creating A
+        blocks = [slab[0] for slab in slabs]
+        del self.dir_vox, slabs
 
         # Add diagonal 1s for exterior voxels
         diag_1s = np.ones_like(self.ws_pad, dtype=int)
@@ -353,33 +396,21 @@ class Elasticity:
         diag_1s = np.hstack((diag_1s, self.len_xyz + diag_1s, 2 * self.len_xyz + diag_1s))
         diag_1s = diag_1s.astype(np.uint32)
         del ind
-        I[counter:counter + diag_1s.size] = diag_1s
-        J[counter:counter + diag_1s.size] = diag_1s
-        V[counter:counter + diag_1s.size] = 1
-        counter += diag_1s.size
+        I, J, V = diag_1s, diag_1s, np.ones(diag_1s.size)
 
         # Add non-diagonal 1s for exterior voxels
         if self.side_bc is not "d" and self.side_bc is not "f":
-            I[counter:counter + diag_1s.size] = diag_1s
+            nondiag_1s = diag_1s.copy()
             nondiag1s = np.ones_like(diag_1s, dtype=np.int8)
-            add_nondiag(diag_1s, nondiag1s, self.len_x, self.len_y, self.len_z, self.side_bc)
-            J[counter:counter + diag_1s.size] = diag_1s  # CAREFUL: diag_1s reused for nondiag to optimize memory
-            if self.side_bc == "s":
-                V[counter:counter + diag_1s.size] = nondiag1s
-            else:
-                V[counter:counter + diag_1s.size] = -1
-            del nondiag1s
-        del diag_1s, counter
+            add_nondiag(nondiag_1s, nondiag1s, self.len_x, self.len_y, self.len_z, self.side_bc)
+            values = nondiag1s if self.side_bc == "s" else -np.ones(diag_1s.size)
+            I, J, V = np.hstack((I, diag_1s)), np.hstack((J, nondiag_1s)), np.hstack((V, values))
+            del nondiag_1s, nondiag1s, values
+        blocks.append(compact_csr(I, J, V, 3 * self.len_xyz))
+        del diag_1s, I, J, V
 
-        # Assemble sparse A matrix
-        self.Amat = csr_matrix((V, (I, J)), shape=(3 * self.len_xyz, 3 * self.len_xyz))
-
-        # Simple preconditioner
-        diag = self.Amat.diagonal()
-        if np.any(diag == 0):
-            self.M = None  # identity matrix if singularity has happened in MPSA
-        else:
-            self.M = diags(1. / self.Amat.diagonal(), 0).tocsr()
+        # Assemble sparse A matrix from the disjoint rows of the slabs and of the exterior voxels
+        self.Amat = stack_rows(blocks, (3 * self.len_xyz, 3 * self.len_xyz))
 
         if self.print_matrices[2]:
             self._print_A(self.print_matrices[2])
@@ -388,159 +419,156 @@ class Elasticity:
     def solve(self):
         print("Solving Ax=b system ... ", end='')
 
-        info = 0
-        if self.solver_type == 'direct':
-            print("Direct solver", end='')
-            try:
-                import scikits.umfpack
-                x = spsolve(self.Amat, self.bvec, use_umfpack=True)
-            except ImportError:
-                x = spsolve(self.Amat, self.bvec)
-
-        else:  # iterative solvers
-            u_initial_guess = np.zeros((self.len_x, self.len_y, self.len_z, 3), dtype=float)
+        # linear initial guess of the displacement along the direction of the solve, or solution of the coarser level
+        # rotated and padded like the domain (not used by the direct solver)
+        if self.initial_guess is not None:
+            x0 = np.pad(self.initial_guess.transpose(self.reorder + [3])[:, :, :, self.reorder],
+                        ((1, 1), (1, 1), (1, 1), (0, 0)), mode='edge')
+        else:
+            x0 = np.zeros((self.len_x, self.len_y, self.len_z, 3), dtype=float)
             for i in range(self.len_x - 1):
-                u_initial_guess[i, :, :, 0] = i / (self.len_x - 2.)
-            u_initial_guess = u_initial_guess.flatten('F')
-
-            if self.solver_type == 'gmres':
-                print("gmres:")
-                if self.display_iter:
-                    x, info = gmres(self.Amat, self.bvec.todense(), x0=u_initial_guess, atol=self.tolerance,
-                                    maxiter=self.maxiter, callback=SolverDisplay(), M=self.M)
-                else:
-                    x, info = gmres(self.Amat, self.bvec.todense(), x0=u_initial_guess, atol=self.tolerance,
-                                    maxiter=self.maxiter, M=self.M)
-
-            elif self.solver_type == 'cg':
-                print("Conjugate Gradient:")
-                if self.display_iter:
-                    x, info = cg(self.Amat, self.bvec.todense(), x0=u_initial_guess, atol=self.tolerance,
-                                 maxiter=self.maxiter, callback=SolverDisplay(), M=self.M)
-                else:
-                    x, info = cg(self.Amat, self.bvec.todense(), x0=u_initial_guess, atol=self.tolerance,
-                                 maxiter=self.maxiter, M=self.M)
-
-            else:
-                if self.solver_type != 'bicgstab':
-                    print_warning("Unrecognized solver, defaulting to bicgstab.")
-                print("Bicgstab:")
-                if self.display_iter:
-                    x, info = bicgstab(self.Amat, self.bvec.todense(), x0=u_initial_guess, atol=self.tolerance,
-                                       maxiter=self.maxiter, M=self.M, callback=SolverDisplay())
-                else:
-                    x, info = bicgstab(self.Amat, self.bvec.todense(), x0=u_initial_guess, atol=self.tolerance,
-                                       maxiter=self.maxiter, M=self.M)
-
-        if info != 0:
-            raise Exception("Solver error: " + str(info))
+                x0[i, :, :, 0] = i / (self.len_x - 2.)
+
+        criterion = None
+        if self.functional is not None:
+            criterion = EffectiveConvergence(self.functional.dot, self.effective_tolerance, self.check_every)
+        solver = KrylovSolver(self.solver_type, self.tolerance, self.maxiter, self.preconditioner, self.backend,
+                              self.workers, self.display_iter, display_every=10, criterion=criterion)
+        t = Timer()
+        x = solver.solve(self.Amat, self.bvec, x0.flatten('F'))
+        self.solve_time = t.elapsed()
+        self.iterations = solver.iterations
+        if not solver.converged:
+            raise Exception("Solver error: " + str(solver.info))
+        if criterion is not None:
+            self.convergence_trace = criterion.trace
 
         del self.Amat, self.bvec
-        self.u = x.reshape([self.len_x, self.len_y, self.len_z, 3], order='F')
-
-        # Mirroring boundaries for flux computation
-        if self.direction is not None:
-            self.u[0] = self.u[1]
-            self.u[-1] = self.u[-2]
-            if self.side_bc == "d" or self.side_bc == "f":
-                self.u[:, 0] = self.u[:, 1]
-                self.u[:, -1] = self.u[:, -2]
-                self.u[:, :, 0] = self.u[:, :, 1]
-                self.u[:, :, -1] = self.u[:, :, -2]
+        self.functional = None
+        self.u = self.__displacement(x)
         if self.print_matrices[3]:
             show_u(self.u, self.print_matrices[3])
         print(" ... Done")
         return True
 
+    def coarse_solver(self, workspace):
+        # same problem on a coarser domain, for the multilevel initial guess
+        return Elasticity(workspace, self.elast_map, self.direction, self.side_bc, None, self.tolerance, self.maxiter,
+                          self.solver_type, self.display_iter, (0, 0, 0, 0, 0), self.workers, 'effective',
+                          self.preconditioner, self.backend, self.effective_tolerance, self.check_every)
+
+    def __displacement(self, x):
+        u = x.reshape([self.len_x, self.len_y, self.len_z, 3], order='F')
+
+        # Mirroring boundaries for flux computation
+        if self.direction is not None:
+            u[0] = u[1]
+            u[-1] = u[-2]
+            if self.side_bc == "d" or self.side_bc == "f":
+                u[:, 0] = u[:, 1]
+                u[:, -1] = u[:, -2]
+                u[:, :, 0] = u[:, :, 1]
+                u[:, :, -1] = u[:, :, -2]
+        return u
+
+    def __index_slices(self, i):
+        # indices of the (mirrored, see __displacement) displacements of the slices i - 1 to i + 1, in place of their
+        # values: the direct stiffness along the direction of the solve is a linear function of the displacement iterate
+        x = np.clip(np.arange(i - 1, i + 2), 1, self.len_x - 2)
+        y, z = np.arange(self.len_y), np.arange(self.len_z)
+        if self.side_bc == "d" or self.side_bc == "f":
+            y, z = np.clip(y, 1, self.len_y - 2), np.clip(z, 1, self.len_z - 2)
+        c = np.arange(3)
+        return (x[:, None, None, None] + self.len_x * (y[None, :, None, None] + self.len_y *
+                (z[None, None, :, None] + self.len_z * c[None, None, None, :]))).astype(float)
+
     def compute_effective_coefficient(self):
-        self.__compute_stresses()
+        partial_sums = self.__compute_stresses()
 
         if self.direction is not None:
-            # Accumulating and volume averaging stresses
-            stresses = [np.sum(self.s[:, :, :, i]) / ((self.len_x - 2) * (self.len_y - 2) * (self.len_z - 2)) for i in
-                        range(3)]
-            stresses += [np.sum(self.t[:, :, :, i]) / ((self.len_x - 2) * (self.len_y - 2) * (self.len_z - 2)) for i in
-                         range(3)]
+            # Accumulating and volume averaging the partial sums of the stresses of every slab
+            stresses = [np.sum(partial_sums[:, i]) / ((self.len_x - 2) * (self.len_y - 2) * (self.len_z - 2))
+                        for i in range(3)]
+            stresses += [np.sum(partial_sums[:, 3 + i]) / ((self.len_x - 2) * (self.len_y - 2) * (self.len_z - 2))
+                         for i in range(3)]
             self.Ceff = [stresses[i] * (self.len_x - 2) * self.ws.voxel_length for i in range(6)]
 
-            # Rotating output back
+            # Rotating output back (the stresses were written in the original orientation)
             if self.direction == 'y':
                 self.u = self.u.transpose(2, 0, 1, 3)[:, :, :, [2, 0, 1]]
-                self.s = self.s.transpose(2, 0, 1, 3)[:, :, :, [2, 0, 1]]
-                self.t = self.t.transpose(2, 0, 1, 3)[:, :, :, [2, 0, 1]]
                 self.Ceff = [self.Ceff[2], self.Ceff[0], self.Ceff[1], self.Ceff[5], self.Ceff[3], self.Ceff[4]]
             elif self.direction == 'z':
                 self.u = self.u.transpose(1, 2, 0, 3)[:, :, :, [1, 2, 0]]
-                self.s = self.s.transpose(1, 2, 0, 3)[:, :, :, [1, 2, 0]]
-                self.t = self.t.transpose(1, 2, 0, 3)[:, :, :, [1, 2, 0]]
                 self.Ceff = [self.Ceff[1], self.Ceff[2], self.Ceff[0], self.Ceff[4], self.Ceff[5], self.Ceff[3]]
 
-    def __compute_stresses(self):
-        # Initialize required data structures
-        self.s, self.t = np.zeros((2, self.len_x - 2, self.len_y - 2, self.len_z - 2, 3))
-        self.__initialize_MPSA()
-        u_sw, u_se, u_nw, u_ne, u_tsw, u_tse, u_tnw, u_tne = np.zeros((8, self.len_y - 2, self.len_z - 2, 24))  # per CV
-        E_sw, E_se, E_nw, E_ne, E_tsw, E_tse, E_tnw, E_tne = np.zeros((8, self.len_y - 2, self.len_z - 2, 36, 24))
+    def __compute_stresses_slab(self, slab):
+        # same rolling layers as in the assembly, writing the stresses of the slab's slices into the shared s and t
+        # (if any)
+        start, end = slab
+        local = copy.copy(self)
+        local.__initialize_MPSA(start - 1)
+        u_iv = np.zeros((8, self.len_y - 2, self.len_z - 2, 24))  # per CV
+        E_iv = np.zeros((8, self.len_y - 2, self.len_z - 2, 36, 24))
+        partial_sum = np.zeros(6)
 
-        # Computing first layer of E
-        self.__compute_transmissibility(0, 0)
-
-        # Iterating through interior
-        for i in range(1, self.len_x - 1):
-            self.__compute_Cmat(2, i + 1)  # Computing third layer of Cmat
-            self.__compute_transmissibility(1, i)  # Computing second layer of E
+        for i in range(start, end):
+            local.__compute_Cmat(2, i + 1)  # Computing third layer of Cmat
+            local.__compute_transmissibility(1, i)  # Computing second layer of E
 
             # filling eight IVs
-            fill_stress_matrices(i, self.len_x, self.len_y, self.len_z, self.u[i - 1:i + 2], self.Emat,
-                                 E_sw, E_se, E_nw, E_ne, E_tsw, E_tse, E_tnw, E_tne,
-                                 u_sw, u_se, u_nw, u_ne, u_tsw, u_tse, u_tnw, u_tne)
-
-            # Computing stresses by computing E @ u
-            s_sw = np.squeeze(E_sw @ u_sw[:, :, :, np.newaxis])
-            s_se = np.squeeze(E_se @ u_se[:, :, :, np.newaxis])
-            s_nw = np.squeeze(E_nw @ u_nw[:, :, :, np.newaxis])
-            s_ne = np.squeeze(E_ne @ u_ne[:, :, :, np.newaxis])
-            s_tsw = np.squeeze(E_tsw @ u_tsw[:, :, :, np.newaxis])
-            s_tse = np.squeeze(E_tse @ u_tse[:, :, :, np.newaxis])
-            s_tnw = np.squeeze(E_tnw @ u_tnw[:, :, :, np.newaxis])
-            s_tne = np.squeeze(E_tne @ u_tne[:, :, :, np.newaxis])
-
-            # Summing fluxes CV-wise
-            self.s[i - 1, :, :, 0] = (s_se[:, :, 9] + s_ne[:, :, 6] + s_tse[:, :, 3] + s_tne[:, :, 0] +
-                                      s_sw[:, :, 9] + s_nw[:, :, 6] + s_tsw[:, :, 3] + s_tnw[:, :, 0])  # sigma_x
-            self.s[i - 1, :, :, 1] = (s_nw[:, :, 21] + s_ne[:, :, 18] + s_tnw[:, :, 15] + s_tne[:, :, 12] +
-                                      s_sw[:, :, 21] + s_se[:, :, 18] + s_tsw[:, :, 15] + s_tse[:, :, 12])  # sigma_y
-            self.s[i - 1, :, :, 2] = (s_tsw[:, :, 33] + s_tse[:, :, 30] + s_tnw[:, :, 27] + s_tne[:, :, 24] +
-                                      s_sw[:, :, 33] + s_se[:, :, 30] + s_nw[:, :, 27] + s_ne[:, :, 24])  # sigma_z
-
-            self.t[i - 1, :, :, 0] = (s_tsw[:, :, 34] + s_tse[:, :, 31] + s_tnw[:, :, 28] + s_tne[:, :, 25] +
-                                      s_sw[:, :, 34] + s_se[:, :, 31] + s_nw[:, :, 28] + s_ne[:, :, 25] +
-                                      s_nw[:, :, 23] + s_ne[:, :, 20] + s_tnw[:, :, 17] + s_tne[:, :, 14] +
-                                      s_sw[:, :, 23] + s_se[:, :, 20] + s_tsw[:, :, 17] + s_tse[:, :, 14])  # tau_yz
-            self.t[i - 1, :, :, 1] = (s_tsw[:, :, 35] + s_tse[:, :, 32] + s_tnw[:, :, 29] + s_tne[:, :, 26] +
-                                      s_sw[:, :, 35] + s_se[:, :, 32] + s_nw[:, :, 29] + s_ne[:, :, 26] +
-                                      s_se[:, :, 10] + s_ne[:, :, 7] + s_tse[:, :, 4] + s_tne[:, :, 1] +
-                                      s_sw[:, :, 10] + s_nw[:, :, 7] + s_tsw[:, :, 4] + s_tnw[:, :, 1])  # tau_xz
-            self.t[i - 1, :, :, 2] = (s_nw[:, :, 22] + s_ne[:, :, 19] + s_tnw[:, :, 16] + s_tne[:, :, 13] +
-                                      s_sw[:, :, 22] + s_se[:, :, 19] + s_tsw[:, :, 16] + s_tse[:, :, 13] +
-                                      s_se[:, :, 11] + s_ne[:, :, 8] + s_tse[:, :, 5] + s_tne[:, :, 2] +
-                                      s_sw[:, :, 11] + s_nw[:, :, 8] + s_tsw[:, :, 5] + s_tnw[:, :, 2])  # tau_xy
+            fill_stress_matrices(i, self.len_x, self.len_y, self.len_z, self.u[i - 1:i + 2], local.Emat, *E_iv, *u_iv)
 
-            # Passing second layer to first
-            self.Emat[0] = self.Emat[1]
-            self.Cmat[:2] = self.Cmat[1:]
-            sys.stdout.write("\rComputing stresses ... {:.1f}% ".format(i / (self.len_x - 2) * 100))
-        del self.Emat, self.Cf, self.Cmat, self.mpsa36x36, self.unstable
+            # Computing stresses E @ u of the eight IVs and summing them CV-wise, in one contraction
+            if self.s_rotated is None:
+                partial_sum += np.einsum('cvi,vyzij,vyzj->c', self.stress_select, E_iv, u_iv,
+                                         optimize=self.stress_path)
+            else:
+                stresses = np.einsum('cvi,vyzij,vyzj->yzc', self.stress_select, E_iv, u_iv, optimize=self.stress_path)
+                self.s_rotated[i - 1][:, :, self.reorder] = stresses[:, :, :3]
+                self.t_rotated[i - 1][:, :, self.reorder] = stresses[:, :, 3:]
+                partial_sum += stresses.sum(axis=(0, 1))
 
-        self.s /= 8 * self.ws.voxel_length
-        self.t /= 16 * self.ws.voxel_length
+            # Passing second layer to first
+            local.Emat[0] = local.Emat[1]
+            local.Cmat[:2] = local.Cmat[1:]
+        return partial_sum
+
+    def __setup_stress_contraction(self):
+        # selection of the IV stress rows, averaged over the IVs sharing each face, in spatial units
+        self.stress_select = np.zeros((6, 8, 36))
+        for c in range(3):
+            self.stress_select[c, np.arange(8), STRESS_ROWS[c]] = 1. / (8 * self.ws.voxel_length)
+            for rows in SHEAR_ROWS[c]:
+                self.stress_select[3 + c, np.arange(8), rows] = 1. / (16 * self.ws.voxel_length)
+        shape = (8, self.len_y - 2, self.len_z - 2)
+        self.stress_path = np.einsum_path('cvi,vyzij,vyzj->yzc', self.stress_select, np.empty(shape + (36, 24)),
+                                          np.empty(shape + (24,)), optimize='optimal')[0]
 
-        if self.print_matrices[4]:
+    def __compute_stresses(self):
+        print("Computing stresses ... ", flush=True, end='')
+        self.__setup_stress_contraction()
+
+        # stress fields (if requested) in the original orientation, written through views in the rotated one
+        interior = np.array([self.len_x - 2, self.len_y - 2, self.len_z - 2])
+        field_shape = tuple(interior[np.argsort(self.reorder)]) + (3,)
+        self.s = allocate_field(field_shape, self.outputs)
+        self.t = allocate_field(field_shape, self.outputs)
+        if self.s is not None:
+            self.s_rotated = self.s.transpose(self.reorder + [3])
+            self.t_rotated = self.t.transpose(self.reorder + [3])
+        partial_sums = np.array(run_in_pool(self.__compute_stresses_slab, self.__slabs(), self.__pool_workers()))
+        self.s_rotated = self.t_rotated = None
+        if isinstance(self.s, np.memmap):
+            self.s.flush()
+            self.t.flush()
+
+        if self.print_matrices[4] and self.s is not None:
             show_s(self.s, self.t, self.print_matrices[4])
 
         # Extract only interior displacement, ignoring exterior used as bc
         self.u = self.u[1:-1, 1:-1, 1:-1]
         print("Done")
+        return partial_sums
 
     def log_input(self):
         self.ws.log.log_section("Computing Elasticity")
@@ -558,6 +586,11 @@ class Elasticity:
         self.ws.log.log_section("Finished Elasticity Calculation")
         self.ws.log.log_line("Elasticity: " + "[" + str(self.Ceff) + "]")
         self.ws.log.log_line("Solver Time: " + str(self.solve_time))
+        if self.convergence_trace is not None:
+            self.ws.log.log_line("Effective Elasticity Trace (iteration, Ceff): " + str(self.convergence_trace))
+        if self.level_stats is not None:
+            self.ws.log.log_line("Levels (shape, solver time, iterations): " +
+                                 str(self.level_stats + [(self.ws.get_shape(), self.solve_time, self.iterations)]))
         self.ws.log.write_log()
 
     def error_check(self):
@@ -575,9 +608,7 @@ class Elasticity:
             if len(C) == 5:
                 self.need_to_orient = True
                 if self.ws.orientation.shape[:3] != self.ws.matrix.shape or \
-                        not 0.9 < np.min(np.linalg.norm(self.ws.orientation[np.logical_and(self.ws.matrix >= low,
-                                                                                           self.ws.matrix <= high)],
-                                                        axis=1)) < 1.1:
+                        not self.__valid_orientation(np.logical_and(self.ws.matrix >= low, self.ws.matrix <= high)):
                     raise Exception("The Workspace needs an orientation in order to align the elasticity.")
 
             # segmenting tmp domain to check if all values covered by mat_elast
@@ -618,6 +649,22 @@ class Elasticity:
         if type(self.print_matrices) is not tuple or len(self.print_matrices) != 5:
             raise Exception("Print_matrices must be a tuple with 5 booleans.")
 
+        # outputs checks
+        if self.outputs not in ('fields', 'effective', 'disk'):
+            raise Exception("Error, outputs has to be 'fields', 'effective' or 'disk'.")
+        if self.outputs == 'effective' and self.direction is None:
+            raise Exception("Error, outputs='effective' requires a direction, since the stress analysis has no "
+                            "effective coefficient.")
+
+        # solver checks
+        check_solver_options(self.preconditioner, self.backend)
+        if self.effective_tolerance is not None and self.effective_tolerance <= 0:
+            raise Exception("Error, effective_tolerance has to be positive.")
+        if not isinstance(self.levels, int) or self.levels < 1:
+            raise Exception("Error, levels has to be a positive integer.")
+        if self.levels > 1 and self.direction is None:
+            raise Exception("Error, levels > 1 requires a direction, since the coarse levels have no prescribed_bc.")
+
         # prescribed_bc checks
         if self.prescribed_bc is not None:
             if not isinstance(self.prescribed_bc, ElasticityBC):
@@ -638,6 +685,11 @@ class Elasticity:
             if self.direction is None:
                 raise Exception("prescribed_bc must be defined for compute_stress_analysis")
 
+    def __valid_orientation(self, mask):
+        if is_encoded_orientation(self.ws.orientation):  # encoded vectors are unit, except for the (0, 0) code
+            return not np.any(np.all(self.ws.orientation[mask] == 0, axis=1))
+        return 0.9 < np.min(np.linalg.norm(self.ws.orientation[mask], axis=1)) < 1.1
+
     # Printing functions of system matrices
     def _print_E(self, i, i_cv, dec=4):
         np.set_printoptions(precision=dec)
@@ -657,7 +709,7 @@ class Elasticity:
         print(self.Amat.toarray())
 
     def _print_b(self, dec=1):
-        vector = self.bvec.toarray()
+        vector = self.bvec[:, np.newaxis]
         print()
         print("b vector:")
         print("  o---> y")
@@ -0,0 +1,111 @@
+from pumapy.utilities.workspace import Workspace
+from pumapy.utilities.timer import Timer
+from pumapy.utilities.logger import print_warning
+from scipy.ndimage import zoom
+import numpy as np
+
+
+def coarsen_workspace(workspace, material_map):
+    """ Coarse copy of a workspace, with half the voxels along each axis (rounded up) and twice the voxel length
+
+    Each coarse voxel takes the most frequent material of its 2x2x2 block of fine voxels (segmented with the ranges of
+    the material map, ties going to the first voxel of the block), with the ID and orientation of the first voxel of
+    that material in the block. Odd sizes are padded by repeating the last fine slice.
+
+    :param workspace: fine domain
+    :type workspace: Workspace
+    :param material_map: property map segmenting the domain
+    :type material_map: MaterialPropertyMap
+    :return: coarse domain
+    :rtype: Workspace
+    """
+    coarse_shape = tuple((s + 1) // 2 for s in workspace.matrix.shape)
+    pad = [(0, 2 * c - s) for c, s in zip(coarse_shape, workspace.matrix.shape)]
+
+    def blocks(array):
+        # (x, y, z, ...) -> (x/2, y/2, z/2, 8, ...), the eight voxels of each block along the fourth axis
+        array = np.pad(array, pad + [(0, 0)] * (array.ndim - 3), mode='edge')
+        array = array.reshape((coarse_shape[0], 2, coarse_shape[1], 2, coarse_shape[2], 2) + array.shape[3:])
+        array = np.moveaxis(array, (1, 3, 5), (3, 4, 5))
+        return array.reshape(coarse_shape + (8,) + array.shape[6:])
+
+    phases = np.full(workspace.matrix.shape, -1, dtype=np.int32)
+    for i in range(material_map.get_size()):
+        low, high, _ = material_map.get_material(i)
+        phases[np.logical_and(workspace.matrix >= low, workspace.matrix <= high)] = i
+    phases = blocks(phases)
+
+    # majority vote, counting the occurrences of the phase of each of the eight voxels in its block
+    winner = np.zeros(coarse_shape + (1,), dtype=np.int64)
+    winner_count = np.zeros(coarse_shape, dtype=np.int8)
+    for v in range(8):
+        count = np.count_nonzero(phases == phases[..., v:v + 1], axis=-1).astype(np.int8)
+        better = count > winner_count
+        winner[better] = v
+        winner_count[better] = count[better]
+    del phases
+
+    coarse = Workspace.from_array(np.take_along_axis(blocks(workspace.matrix), winner, axis=3)[..., 0])
+    coarse.voxel_length = 2 * workspace.voxel_length
+    if workspace.orientation.shape[:3] == workspace.matrix.shape:
+        coarse.orientation = np.take_along_axis(blocks(workspace.orientation), winner[..., None], axis=3)[:, :, :, 0]
+    return coarse
+
+
+def prolongate(field, shape):
+    """ Trilinear interpolation of a coarse field onto a finer grid, keeping the values on the domain corners
+
+    :param field: coarse field, either scalar (x, y, z) or vector (x, y, z, n)
+    :type field: ndarray
+    :param shape: fine shape (X, Y, Z)
+    :type shape: tuple(int, int, int)
+    :return: fine field
+    :rtype: ndarray
+    """
+    factors = [s / c for s, c in zip(shape, field.shape[:3])] + [1] * (field.ndim - 3)
+    return zoom(field, factors, order=1, mode='nearest')
+
+
+def coarse_to_fine(solver, material_map, field):
+    """ Full multigrid style cascade of coarse solves, giving the initial guess of a conductivity or elasticity solve
+
+    The domain of the solver is coarsened solver.levels - 1 times (see coarsen_workspace). The coarsest level starts
+    from the usual linear guess, and the solution of each level is prolongated as the initial guess of the next finer
+    one. The coarse solvers are created by solver.coarse_solver(workspace), without any prescribed_bc. The result is
+    set in solver.initial_guess, and the shape, solve time and iterations of every coarse level in solver.level_stats
+    (from the coarsest).
+
+    :param solver: fine solver, after its error_check
+    :type solver: Conductivity or Elasticity
+    :param material_map: property map segmenting the domain
+    :type material_map: MaterialPropertyMap
+    :param field: name of the solution field of the solver ('T' or 'u')
+    :type field: string
+    """
+    if solver.solver_type == 'direct':
+        print_warning("The coarse levels only provide the initial guess of the iterative solvers, skipping them.")
+        return
+
+    workspaces = [solver.ws]
+    for _ in range(solver.levels - 1):
+        if min(workspaces[-1].matrix.shape) < 5:
+            print_warning("Domain too small for more than {} levels.".format(len(workspaces)))
+            break
+        workspaces.append(coarsen_workspace(workspaces[-1], material_map))
+
+    guess = None
+    solver.level_stats = []
+    for level in range(len(workspaces) - 1, 0, -1):
+        print("Solving level {} of {}, with shape {}".format(level + 1, len(workspaces), workspaces[level].get_shape()))
+        t = Timer()
+        coarse = solver.coarse_solver(workspaces[level])
+        coarse.error_check()
+        if guess is not None:
+            coarse.initial_guess = prolongate(guess, workspaces[level].matrix.shape)
+        coarse.compute()
+        guess = getattr(coarse, field)
+        solver.level_stats.append((workspaces[level].get_shape(), coarse.solve_time, coarse.iterations))
+        print("Level {} solved in {}s ({} iterations in {}s)".format(level + 1, t.elapsed(), coarse.iterations,
+                                                                    coarse.solve_time))
+    if guess is not None:
+        solver.initial_guess = prolongate(guess, solver.ws.matrix.shape)
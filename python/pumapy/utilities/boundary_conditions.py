@@ -106,3 +106,55 @@ class ElasticityBC:
 
     def show(self):
         Workspace.show_orientation(self.dirichlet)
+
+
+def dirichlet_bvector(shape, prescribed=None, side_dirichlet=False, components=1, pad=1):
+    """ Dense right hand side of the conductivity and elasticity systems, holding the Dirichlet values
+
+    The unknowns are numbered with x fastest on the (padded) domain, with one block of len_x * len_y * len_z unknowns
+    per component. Values set more than once are summed, as in a sparse matrix assembled from duplicate entries.
+
+    :param shape: shape of the (padded) domain
+    :type shape: tuple(int, int, int)
+    :param prescribed: prescribed values inside the padding (np.Inf where free), of shape (x, y, z) or
+        (x, y, z, components). If None, unit value of the first component on the last slice along x inside the padding
+    :type prescribed: ndarray, optional
+    :param side_dirichlet: add a linear ramp from 0 to 1 along x of the first component on the y and z sides
+    :type side_dirichlet: bool, optional
+    :param components: number of unknowns per voxel
+    :type components: int, optional
+    :param pad: thickness of the padding around the prescribed values
+    :type pad: int, optional
+    :return: right hand side
+    :rtype: ndarray
+    """
+    len_x, len_y, len_z = shape
+    size = len_x * len_y * len_z
+    I, V = [], []
+
+    def add(c, i, j, k, values):
+        i, j, k, values = np.broadcast_arrays(i, j, k, values)
+        I.append((c * size + len_x * (len_y * k + j) + i).ravel())
+        V.append(values.ravel())
+
+    if prescribed is not None:
+        prescribed = prescribed.reshape(prescribed.shape[:3] + (components,))
+        for c in range(components):
+            i, j, k = np.nonzero(prescribed[..., c] != np.Inf)
+            add(c, i + pad, j + pad, k + pad, prescribed[i, j, k, c])
+    else:
+        # Setting unit value on the last slice
+        j, k = np.ix_(np.arange(pad, len_y - pad), np.arange(pad, len_z - pad))
+        add(0, len_x - 1 - pad, j, k, 1.)
+
+    # Setting linear values along x on the sides
+    if side_dirichlet:
+        ramp = np.linspace(0, 1, len_x - 2 * pad)
+        i, k = np.ix_(np.arange(pad, len_x - pad), np.arange(pad, len_z - pad))
+        for j in (pad, len_y - 1 - pad):
+            add(0, i, j, k, ramp[:, np.newaxis])
+        i, j = np.ix_(np.arange(pad + 1, len_x - pad - 1), np.arange(pad + 1, len_y - pad - 1))
+        for k in (pad, len_z - 1 - pad):
+            add(0, i, j, k, ramp[1:-1, np.newaxis])
+
+    return np.bincount(np.concatenate(I), np.concatenate(V), minlength=components * size).astype(float)
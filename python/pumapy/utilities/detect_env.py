@@ -14,7 +14,7 @@ def detect_env():
         import dolfin
     except ImportError:
         complete_env = False
-        print("- FEniCS/dolfin not found, cannot use pumapy.compute_permeability()")
+        print("- FEniCS/dolfin not found, pumapy.compute_permeability() only available with method='fv'")
 
     try:
         from pumapy.generation.weave_3mdcp.weave_3mdcp import generate_3mdcp
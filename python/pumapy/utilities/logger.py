@@ -20,11 +20,17 @@ class Colors:
 
 class Logger:
 
+    # set to False to keep the logs in memory only (e.g. in the workers of an ensemble generation)
+    write_to_file = True
+
     def __init__(self):
 
         self.log = ""
         self.location = ""
 
+        if not Logger.write_to_file:
+            return
+
         if not os.path.exists('logs'):
             os.mkdir('logs')
 
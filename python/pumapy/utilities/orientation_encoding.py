@@ -0,0 +1,126 @@
+import numpy as np
+
+
+_SCALE = 65535.
+
+
+def is_encoded_orientation(orientation):
+    """ Check whether an orientation field is stored in compact (octahedral-encoded) form
+
+    :param orientation: orientation field, either as (x, y, z, 3) vectors or (x, y, z, 2) uint16 codes
+    :type orientation: ndarray
+    :return: True if encoded, False otherwise
+    :rtype: bool
+    """
+    return orientation.dtype == np.uint16 and orientation.shape[-1] == 2
+
+
+def encode_orientation(vectors):
+    """ Encode unit vectors into two uint16 per vector using the octahedral projection
+
+    The vectors are projected onto the octahedron |x|+|y|+|z|=1, whose lower half is folded over the upper one,
+    and the resulting (x, y) in [-1, 1] are quantized on 16 bits each. The angular error is below 0.005 degrees.
+    Zero vectors (e.g. voids with no orientation) are encoded as (0, 0).
+
+    :param vectors: vectors as (..., 3)
+    :type vectors: ndarray
+    :return: codes as (..., 2)
+    :rtype: ndarray
+    """
+    if vectors.shape[-1] != 3:
+        raise Exception("Vectors to encode have to be of shape (..., 3).")
+    codes = np.empty(vectors.shape[:-1] + (2,), dtype=np.uint16)
+    if vectors.ndim > 2:  # one slice at a time, to bound the temporaries
+        for i in range(vectors.shape[0]):
+            codes[i] = encode_orientation(vectors[i])
+        return codes
+
+    vectors = np.asarray(vectors, dtype=float)
+    l1 = np.abs(vectors).sum(axis=-1)
+    zero = l1 == 0
+    l1[zero] = 1
+    x, y, z = vectors[..., 0] / l1, vectors[..., 1] / l1, vectors[..., 2] / l1
+
+    # folding the lower half of the octahedron
+    lower = z < 0
+    sign_x = np.where(x >= 0, 1., -1.)
+    sign_y = np.where(y >= 0, 1., -1.)
+    x, y = np.where(lower, (1 - np.abs(y)) * sign_x, x), np.where(lower, (1 - np.abs(x)) * sign_y, y)
+
+    codes[..., 0] = np.rint((x + 1) * (_SCALE / 2.))
+    codes[..., 1] = np.rint((y + 1) * (_SCALE / 2.))
+
+    # (0, 0) is reserved for zero vectors: it otherwise folds back onto (0, 0, -1), encoded as (max, max) instead
+    corner = np.logical_and(codes[..., 0] == 0, codes[..., 1] == 0)
+    codes[np.logical_and(corner, ~zero)] = _SCALE
+    codes[zero] = 0
+    return codes
+
+
+def decode_orientation(codes, dtype=float):
+    """ Decode orientation codes produced by encode_orientation back into unit vectors
+
+    :param codes: codes as (..., 2)
+    :type codes: ndarray
+    :param dtype: floating point type of the output vectors
+    :type dtype: type, optional
+    :return: unit vectors as (..., 3), with zero vectors where the code is (0, 0)
+    :rtype: ndarray
+    """
+    if not is_encoded_orientation(codes):
+        raise Exception("Orientation codes have to be uint16 of shape (..., 2).")
+    vectors = np.empty(codes.shape[:-1] + (3,), dtype=dtype)
+    if codes.ndim > 2:  # one slice at a time, to bound the temporaries
+        for i in range(codes.shape[0]):
+            vectors[i] = decode_orientation(codes[i], dtype)
+        return vectors
+
+    x = codes[..., 0] * (2. / _SCALE) - 1
+    y = codes[..., 1] * (2. / _SCALE) - 1
+    z = 1 - np.abs(x) - np.abs(y)
+
+    # unfolding the lower half of the octahedron
+    t = np.maximum(-z, 0)
+    x -= np.where(x >= 0, t, -t)
+    y -= np.where(y >= 0, t, -t)
+
+    norm = np.sqrt(x * x + y * y + z * z)
+    zero = np.logical_and(codes[..., 0] == 0, codes[..., 1] == 0)
+    norm[zero] = np.inf
+    vectors[..., 0] = x / norm
+    vectors[..., 1] = y / norm
+    vectors[..., 2] = z / norm
+    return vectors
+
+
+def pad_orientation(orientation, reorder, mode):
+    """ Transpose an orientation field (encoded or not) and pad it by one voxel on each side, keeping its storage type
+
+    :param orientation: orientation field, either as (x, y, z, 3) vectors or (x, y, z, 2) uint16 codes
+    :type orientation: ndarray
+    :param reorder: order of the spatial axes after the transposition
+    :type reorder: list(int, int, int)
+    :param mode: np.pad mode: 'edge' (symmetric), 'wrap' (periodic) or 'constant' (zeros)
+    :type mode: string
+    :return: padded orientation
+    :rtype: ndarray
+    """
+    return np.pad(orientation.transpose(list(reorder) + [3]), ((1, 1), (1, 1), (1, 1), (0, 0)), mode=mode)
+
+
+def orientation_slice(orient_pad, i, reorder):
+    """ Unit vectors of one slice of a padded orientation field (see pad_orientation), decoded if needed and with
+    the components following the transposition
+
+    :param orient_pad: padded orientation field
+    :type orient_pad: ndarray
+    :param i: slice index along the first axis
+    :type i: int
+    :param reorder: order of the spatial axes after the transposition
+    :type reorder: list(int, int, int)
+    :return: unit vectors as (y, z, 3)
+    :rtype: ndarray
+    """
+    if is_encoded_orientation(orient_pad):
+        return decode_orientation(orient_pad[i])[:, :, reorder]
+    return orient_pad[i][:, :, reorder]
@@ -0,0 +1,295 @@
+from concurrent.futures import ThreadPoolExecutor
+from scipy.sparse import csr_matrix
+from scipy.sparse.linalg import LinearOperator
+import numpy as np
+import tempfile
+import os
+
+
+def get_workers(workers=None):
+    """ Number of workers to use in a pool
+
+    :param workers: requested number of workers. If None or <= 0, all available cores are used
+    :type workers: int, optional
+    :return: number of workers
+    :rtype: int
+    """
+    if workers is None or workers <= 0:
+        return os.cpu_count() or 1
+    return int(workers)
+
+
+def memory_bounded_workers(workers, bytes_per_worker, fraction=0.25):
+    """ Number of workers whose working sets fit in a fraction of the free physical memory
+
+    :param workers: requested number of workers (see get_workers)
+    :type workers: int
+    :param bytes_per_worker: size of the working set of each worker
+    :type bytes_per_worker: int
+    :param fraction: fraction of the free memory that the working sets can use
+    :type fraction: float, optional
+    :return: number of workers, at least 1 (not bounded if the free memory is unknown)
+    :rtype: int
+    """
+    workers = get_workers(workers)
+    try:
+        free = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return workers
+    return max(1, min(workers, int(fraction * free // max(int(bytes_per_worker), 1))))
+
+
+def split_slabs(length, nslabs):
+    """ Split a length into contiguous (start, end) slabs of approximately equal thickness
+
+    :param length: length of the axis to split
+    :type length: int
+    :param nslabs: number of slabs requested (capped by the length)
+    :type nslabs: int
+    :return: list of (start, end) bounds
+    :rtype: list(tuple(int, int))
+    """
+    nslabs = max(1, min(int(nslabs), int(length)))
+    edges = np.linspace(0, length, nslabs + 1).astype(int)
+    return [(edges[i], edges[i + 1]) for i in range(nslabs)]
+
+
+def run_in_pool(func, items, workers=None):
+    """ Run func on every item using a thread pool (intended for NumPy/SciPy kernels that release the GIL)
+
+    :param func: function taking a single item
+    :type func: callable
+    :param items: items to process
+    :type items: list
+    :param workers: number of threads
+    :type workers: int, optional
+    :return: list of results, in the same order as items
+    :rtype: list
+    """
+    workers = get_workers(workers)
+    if workers == 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, items))
+
+
+def slab_add_at(vector, halo, index, values, slab, len_x):
+    """ Unbuffered addition of values at indices of a vector shared by the slabs of a thread pool
+
+    The vector is numbered with x fastest (as the system matrices of the solvers), and the slab (start, end) only
+    adds to the slices start - 1 to end along x. The slices that no other slab touches are written directly into the
+    shared vector, and the two slices at each end of the slab into its own halo, of shape (4, vector.size // len_x),
+    merged once every slab is done (see merge_slab_halos).
+
+    :param vector: shared vector
+    :type vector: ndarray
+    :param halo: zero initialized halo of the slab
+    :type halo: ndarray
+    :param index: indices in the vector
+    :type index: ndarray
+    :param values: values to add, of the same shape as index
+    :type values: ndarray
+    :param slab: (start, end) slices of the slab along x
+    :type slab: tuple(int, int)
+    :param len_x: length of the x axis
+    :type len_x: int
+    """
+    start, end = slab
+    x, plane = index % len_x, index // len_x
+    inner = np.logical_and(x > start, x < end - 1)
+    low = x <= start
+    high = np.logical_and(~inner, ~low)
+    np.add.at(vector, index[inner], values[inner])
+    np.add.at(halo, (x[low] - (start - 1), plane[low]), values[low])
+    np.add.at(halo, (x[high] - (end - 1) + 2, plane[high]), values[high])
+
+
+def merge_slab_halos(vector, halos, slabs, len_x):
+    """ Adds the halos filled by slab_add_at to the shared vector
+
+    :param vector: shared vector
+    :type vector: ndarray
+    :param halos: halos of the slabs
+    :type halos: list(ndarray)
+    :param slabs: (start, end) slices of the slabs along x
+    :type slabs: list(tuple(int, int))
+    :param len_x: length of the x axis
+    :type len_x: int
+    """
+    slices = vector.reshape((len_x, -1), order='F')  # view, with x fastest
+    for (start, end), halo in zip(slabs, halos):
+        slices[start - 1:start + 1] += halo[:2]
+        slices[end - 1:end + 1] += halo[2:]
+
+
+def compact_csr(rows, cols, values, n_cols):
+    """ CSR block holding only the nonzero rows of a sparse matrix given by its triplets (duplicates are summed)
+
+    :param rows: row indices
+    :type rows: ndarray
+    :param cols: column indices
+    :type cols: ndarray
+    :param values: values
+    :type values: ndarray
+    :param n_cols: number of columns of the matrix
+    :type n_cols: int
+    :return: sorted indices of the rows in the matrix, and the block of these rows
+    :rtype: tuple(ndarray, scipy.sparse.csr_matrix)
+    """
+    unique = np.unique(rows)
+    return unique, csr_matrix((values, (np.searchsorted(unique, rows), cols)), shape=(unique.size, n_cols))
+
+
+def stack_rows(blocks, shape):
+    """ CSR matrix from blocks of compact_csr with disjoint rows (e.g. assembled by different slabs)
+
+    The rows of each block are copied straight into the arrays of the matrix, without any COO copy of the whole matrix.
+    The list of blocks is emptied, so that each block is released once copied.
+
+    :param blocks: (rows, block) of compact_csr
+    :type blocks: list(tuple(ndarray, scipy.sparse.csr_matrix))
+    :param shape: shape of the matrix
+    :type shape: tuple(int, int)
+    :return: matrix
+    :rtype: scipy.sparse.csr_matrix
+    """
+    indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+    for rows, block in blocks:
+        indptr[rows + 1] = np.diff(block.indptr)
+    np.cumsum(indptr, out=indptr)
+    index_type = np.int32 if max(indptr[-1], shape[1]) < np.iinfo(np.int32).max else np.int64
+    indices = np.empty(indptr[-1], dtype=index_type)
+    data = np.empty(indptr[-1], dtype=float)
+    while blocks:
+        rows, block = blocks.pop()
+        destination = np.repeat(indptr[rows] - block.indptr[:-1], np.diff(block.indptr)) + np.arange(block.nnz)
+        indices[destination] = block.indices
+        data[destination] = block.data
+        del rows, block, destination
+    return csr_matrix((data, indices, indptr.astype(index_type)), shape=shape)
+
+
+def filter_in_slabs(matrix, func, halo, workers=None, slab_voxels=2**25):
+    """ Apply a local filter to a 3D array in place, one slab along x at a time, on a thread pool
+
+    The array is split into slabs along the first axis. Each slab is extended by a halo of the unfiltered
+    neighbouring voxels, so that any filter whose footprint does not exceed the halo gives the same result
+    as running it on the whole array. The slabs are processed in waves of one slab per thread, and only the halos of
+    a wave are copied before it writes its slabs back, together with the last rows before the next wave (which the
+    halos of the next wave need once overwritten). This allows the output to be written directly into the input array
+    (including np.memmap arrays) without copying all the halos at once.
+
+    :param matrix: 3D array to filter in place
+    :type matrix: ndarray
+    :param func: function taking a 3D block and returning a filtered block of the same shape
+    :type func: callable
+    :param halo: number of voxels needed on each side of a slab (i.e. the footprint radius of the filter)
+    :type halo: int
+    :param workers: number of threads
+    :type workers: int, optional
+    :param slab_voxels: approximate maximum number of voxels in a slab, bounding the temporaries per thread
+    :type slab_voxels: int, optional
+    :return: None
+    """
+    workers = get_workers(workers)
+    len_x = matrix.shape[0]
+    halo = max(int(halo), 0)
+    plane = max(int(np.prod(matrix.shape[1:])), 1)
+
+    # at least one slab per thread, and slabs small enough to bound the temporaries
+    thickness = max(slab_voxels // plane, 2 * halo, 1)
+    nslabs = max(workers, int(np.ceil(len_x / thickness)))
+    slabs = split_slabs(len_x, nslabs)
+
+    def original(low, high, carry, wave_start):
+        # rows [low, high) before any slab was written, the rows overwritten by the previous waves being in carry
+        low, high = max(low, 0), min(high, len_x)
+        split = min(max(low, wave_start), high)
+        offset = carry.shape[0] - wave_start
+        return np.concatenate((carry[low + offset:split + offset], matrix[split:high]), axis=0)
+
+    def process(item):
+        (start, end), lower, upper = item
+        block = np.concatenate((lower, matrix[start:end], upper), axis=0)
+        matrix[start:end] = func(block)[lower.shape[0]:lower.shape[0] + end - start]
+
+    carry = np.array(matrix[0:0])
+    for first in range(0, len(slabs), workers):
+        wave = slabs[first:first + workers]
+        wave_start, wave_end = wave[0][0], wave[-1][1]
+        items = [((start, end), original(start - halo, start, carry, wave_start),
+                  original(end, end + halo, carry, wave_start)) for start, end in wave]
+        carry = original(wave_end - halo, wave_end, carry, wave_start)
+        run_in_pool(process, items, workers)
+
+
+def allocate_field(shape, outputs='fields'):
+    """ Output field filled slab by slab by the solvers' post-processing
+
+    :param shape: shape of the field
+    :type shape: tuple(int)
+    :param outputs: 'fields' for an array in memory, 'disk' for a np.memmap on a temporary .npy file (its path is
+        in the filename attribute), or 'effective' when only the effective coefficients are needed (no field)
+    :type outputs: string, optional
+    :return: zero field, or None for 'effective'
+    :rtype: ndarray or np.memmap or None
+
+    The temporary file of a 'disk' field is owned by the caller: it is not deleted when the field is released, and
+    can be kept (e.g. moved elsewhere) or deleted with remove_field.
+    """
+    if outputs == 'effective':
+        return None
+    if outputs == 'disk':
+        handle, path = tempfile.mkstemp(suffix='.npy', prefix='pumapy_')
+        os.close(handle)
+        return np.lib.format.open_memmap(path, mode='w+', dtype=float, shape=tuple(shape))
+    return np.zeros(shape)
+
+
+def remove_field(field):
+    """ Deletes the temporary file of a field allocated on 'disk' (see allocate_field), once it is no longer needed
+
+    On Windows, the field has to be released (e.g. del field) before, since an open file cannot be deleted.
+
+    :param field: field returned by a solver
+    :type field: np.memmap or ndarray or None
+    :return: None
+    """
+    if isinstance(field, np.memmap) and field.filename is not None and os.path.exists(field.filename):
+        os.remove(field.filename)
+
+
+class SlabOperator(LinearOperator):
+    """ Sparse matrix applied by blocks of contiguous rows on a thread pool, for the Krylov solvers
+
+    The system matrices are numbered with x fastest, so that a block of contiguous rows is a slab of the domain along
+    the slowest axis. Each block is a view of the rows of the matrix (no copy of the entries), and only reads the
+    entries of the shared vector in its slab and in the neighboring planes it is coupled to (i.e. its halo).
+
+    :param matrix: square sparse matrix
+    :type matrix: scipy.sparse.csr_matrix
+    :param workers: number of threads, also the number of slabs
+    :type workers: int, optional
+    """
+    def __init__(self, matrix, workers=None):
+        super().__init__(matrix.dtype, matrix.shape)
+        matrix = csr_matrix(matrix)
+        self.workers = get_workers(workers)
+        self.slabs = split_slabs(matrix.shape[0], self.workers)
+        self.blocks = []
+        for start, end in self.slabs:
+            low, high = matrix.indptr[start], matrix.indptr[end]
+            self.blocks.append(csr_matrix((matrix.data[low:high], matrix.indices[low:high],
+                                           matrix.indptr[start:end + 1] - low), shape=(end - start, matrix.shape[1])))
+
+    def _matvec(self, x):
+        x = np.ravel(x)
+        y = np.empty(self.shape[0], dtype=np.result_type(self.dtype, x.dtype))
+
+        def process(n):
+            start, end = self.slabs[n]
+            y[start:end] = self.blocks[n] @ x
+
+        run_in_pool(process, list(range(len(self.slabs))), self.workers)
+        return y
+
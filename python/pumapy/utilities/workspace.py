@@ -1,4 +1,5 @@
 from pumapy.utilities.logger import Logger, print_warning
+from pumapy.utilities.orientation_encoding import encode_orientation, decode_orientation, is_encoded_orientation
 import skimage.transform as trans
 import numpy as np
 from copy import deepcopy
@@ -163,11 +164,14 @@ class Workspace:
         """ Set orientation with numpy array
 
         :param nparray: array of shape (X,Y,Z, 3) to be assigned to the orientation variable
+            (or encoded orientation of shape (X,Y,Z, 2), see encode_orientation)
         :type nparray: ndarray
         :return: None
         """
         if isinstance(nparray, np.ndarray):
-            if nparray.ndim == 4 and nparray.shape[3] == 3:
+            if nparray.ndim == 4 and is_encoded_orientation(nparray):
+                self.orientation = nparray.copy()
+            elif nparray.ndim == 4 and nparray.shape[3] == 3:
                 self.orientation = nparray.copy().astype(float)
             else:
                 raise Exception("Wrong nparray ndim, 4 dimensions required as (x,y,z,3). Leaving orientation unchanged")
@@ -222,8 +226,33 @@ class Workspace:
         return np.unique(self.matrix, return_counts=True)
 
     def orientation_magnitude(self):
+        if is_encoded_orientation(self.orientation):
+            return np.any(self.orientation != 0, axis=3).astype(float)
         return np.linalg.norm(self.orientation, axis=3)
 
+    def encode_orientation(self):
+        """ Store the orientation in compact form, as two uint16 per voxel (octahedral encoding) instead of three
+        float64, i.e. 4 instead of 24 bytes per voxel. The conductivity and elasticity solvers decode it one slice
+        at a time, other functions expect it to be decoded first
+
+        :return: None
+        """
+        if not is_encoded_orientation(self.orientation):
+            self.orientation = encode_orientation(self.orientation)
+
+    def decode_orientation(self, dtype=float):
+        """ Restore an orientation stored in compact form (see encode_orientation) to unit vectors
+
+        :param dtype: floating point type of the decoded orientation
+        :type dtype: type, optional
+        :return: None
+        """
+        if is_encoded_orientation(self.orientation):
+            self.orientation = decode_orientation(self.orientation, dtype)
+
+    def orientation_is_encoded(self):
+        return is_encoded_orientation(self.orientation)
+
     def resize_new_matrix(self, shape, value=None):
         """ Resize matrix numpy array
 
@@ -416,6 +445,10 @@ class Workspace:
     def rotate(self, degrees, around_axis, reshape=False, boundary_mode='reflect', apply_to_orientation=True):
         """ Rotate domain by specified degrees
 
+        When the orientation is rotated as well, the matrix and the orientation are resampled together by nearest
+        neighbor, using the same mapping from the rotated voxels to the original ones, and the orientation vectors
+        are rotated by slabs of voxels. Otherwise, the matrix is interpolated with scipy.ndimage.rotate.
+
         :param degrees: degrees to rotate domain
         :type degrees: float
         :param around_axis: specify around what axis to perform the rotation. It can be 'x', 'y' or 'z'
@@ -438,27 +471,59 @@ class Workspace:
         else:
             raise Exception("Axis not recognized: around_axis can only be 'x', 'y' or 'z'")
 
-        self.matrix = rotate(self.matrix, angle=degrees, axes=axes, mode=boundary_mode, reshape=reshape)
-
-        if self.orientation.shape[:3] == self.matrix.shape and apply_to_orientation:
-            from scipy.spatial.transform import Rotation
-            rotation_degrees = degrees
-            rotation_radians = np.radians(rotation_degrees)
-            if around_axis == 'x':
-                rotation_axis = np.array([1, 0, 0])
-            elif around_axis == 'y':
-                rotation_axis = np.array([0, 1, 0])
-            else:
-                rotation_axis = np.array([0, 0, 1])
-            rotation_vector = rotation_radians * rotation_axis
-            rotation = Rotation.from_rotvec(rotation_vector)
-            for i in range(self.len_x()):
-                for j in range(self.len_y()):
-                    for k in range(self.len_z()):
-                        self.orientation[i, j, k] = rotation.apply(self.orientation[i, j, k])
-
-            self.orientation = rotate(self.orientation, angle=degrees, axes=axes, mode=boundary_mode,
-                                      reshape=reshape, order=0)
+        if not (self.orientation.shape[:3] == self.matrix.shape and apply_to_orientation):
+            self.matrix = rotate(self.matrix, angle=degrees, axes=axes, mode=boundary_mode, reshape=reshape)
+            return
+
+        if boundary_mode not in ('reflect', 'constant', 'nearest', 'mirror', 'wrap'):
+            raise Exception("Boundary mode not recognized: it can be 'reflect', 'constant', 'nearest', 'mirror' or "
+                            "'wrap'")
+        from scipy.spatial.transform import Rotation
+        from scipy.special import cosdg, sindg
+        rotation_axis = np.zeros(3)
+        rotation_axis["xyz".index(around_axis)] = 1
+        vector_rotation = Rotation.from_rotvec(np.radians(degrees) * rotation_axis).as_matrix()
+
+        # same mapping from the rotated plane to the original one as scipy.ndimage.rotate
+        plane_rotation = np.array([[cosdg(degrees), sindg(degrees)], [-sindg(degrees), cosdg(degrees)]])
+        in_plane_shape = np.array(self.matrix.shape)[list(axes)]
+        if reshape:
+            out_bounds = plane_rotation @ [[0, 0, in_plane_shape[0], in_plane_shape[0]],
+                                           [0, in_plane_shape[1], 0, in_plane_shape[1]]]
+            out_plane_shape = (np.ptp(out_bounds, axis=1) + 0.5).astype(int)
+        else:
+            out_plane_shape = in_plane_shape
+        offset = (in_plane_shape - 1) / 2. - plane_rotation @ ((out_plane_shape - 1) / 2.)
+        out_coords = np.indices(out_plane_shape).reshape(2, -1)
+        in_coords = plane_rotation @ out_coords + offset[:, np.newaxis]
+        inside = np.all((in_coords >= 0) & (in_coords <= in_plane_shape[:, np.newaxis] - 1), axis=0)
+        inside = inside.reshape(out_plane_shape)
+        index0 = _nearest_index(in_coords[0], in_plane_shape[0], boundary_mode).reshape(out_plane_shape)
+        index1 = _nearest_index(in_coords[1], in_plane_shape[1], boundary_mode).reshape(out_plane_shape)
+
+        # rotation axes first, so that a slab of rotated rows gathers whole lines along the remaining axis
+        matrix = np.moveaxis(self.matrix, axes, (0, 1))
+        orientation = np.moveaxis(self.orientation, axes, (0, 1))
+        encoded = is_encoded_orientation(orientation)
+        new_matrix = np.empty(tuple(out_plane_shape) + matrix.shape[2:], dtype=matrix.dtype)
+        dtype = orientation.dtype if encoded or np.issubdtype(orientation.dtype, np.floating) else float
+        new_orientation = np.empty(tuple(out_plane_shape) + orientation.shape[2:], dtype=dtype)
+
+        rows = max(1, 2 ** 20 // int(out_plane_shape[1] * matrix.shape[2]))
+        for start in range(0, out_plane_shape[0], rows):
+            block = slice(start, start + rows)
+            new_matrix[block] = matrix[index0[block], index1[block]]
+            vectors = orientation[index0[block], index1[block]]
+            if encoded:
+                vectors = decode_orientation(vectors)
+            vectors = vectors @ vector_rotation.T
+            new_orientation[block] = encode_orientation(vectors) if encoded else vectors
+            if boundary_mode == 'constant':
+                new_matrix[block][~inside[block]] = 0
+                new_orientation[block][~inside[block]] = 0
+
+        self.matrix = np.ascontiguousarray(np.moveaxis(new_matrix, (0, 1), axes))
+        self.orientation = np.ascontiguousarray(np.moveaxis(new_orientation, (0, 1), axes))
 
     def show_matrix(self):
         if isinstance(self, Workspace):
@@ -531,3 +596,16 @@ class Workspace:
                 print()
                 print()
         print(']')
+
+
+def _nearest_index(coords, length, mode):
+    # index of the nearest voxel to coordinates outside the domain, following the scipy.ndimage boundary modes
+    if mode == 'reflect':
+        coords = (coords + 0.5) % (2 * length)
+        coords = np.where(coords < length, coords, 2 * length - coords) - 0.5
+    elif mode == 'mirror' and length > 1:
+        coords = coords % (2 * length - 2)
+        coords = np.where(coords <= length - 1, coords, 2 * length - 2 - coords)
+    elif mode == 'wrap' and length > 1:
+        coords = np.where((coords >= 0) & (coords <= length - 1), coords, coords % (length - 1))
+    return np.clip(np.floor(coords + 0.5), 0, length - 1).astype(np.int64)
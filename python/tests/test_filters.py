@@ -0,0 +1,62 @@
+import unittest
+import numpy as np
+import pumapy as puma
+from skimage.filters import gaussian
+from scipy.ndimage import median_filter, uniform_filter
+from skimage.morphology import erosion, dilation, opening, closing, ball
+
+
+class TestFilters(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        self.matrix = np.random.randint(0, 255, (30, 21, 17)).astype(np.uint16)
+
+    def test_median_slabs(self):
+        ws = puma.Workspace.from_array(self.matrix)
+        puma.filter_median(ws, 5, workers=4)
+        np.testing.assert_array_equal(ws.matrix, median_filter(self.matrix, 5))
+
+    def test_gaussian_slabs(self):
+        ws = puma.Workspace.from_array(self.matrix)
+        puma.filter_gaussian(ws, 1.5, workers=4)
+        np.testing.assert_array_equal(ws.matrix, gaussian(self.matrix, sigma=1.5, preserve_range=True).astype(np.uint16))
+
+    def test_mean_slabs(self):
+        ws = puma.Workspace.from_array(self.matrix)
+        puma.filter_mean(ws, 4, workers=4)
+        np.testing.assert_array_equal(ws.matrix, uniform_filter(self.matrix, 4))
+
+    def test_morphology_slabs(self):
+        binary = (self.matrix > 120).astype(np.uint16)
+        ws = puma.Workspace.from_array(self.matrix)
+        puma.filter_erode(ws, (121, 255), 3, workers=4)
+        np.testing.assert_array_equal(ws.matrix, erosion(binary, ball(3)))
+        ws = puma.Workspace.from_array(self.matrix)
+        puma.filter_closing(ws, (121, 255), 3, workers=4)
+        np.testing.assert_array_equal(ws.matrix, closing(binary, ball(3)))
+
+    def test_morphology_edt(self):
+        binary = (self.matrix > 120).astype(np.uint16)
+        for size in [1, 2, 4]:
+            for filter_func, reference in [(puma.filter_erode, erosion), (puma.filter_dilate, dilation),
+                                           (puma.filter_opening, opening), (puma.filter_closing, closing)]:
+                ws_edt = puma.Workspace.from_array(self.matrix)
+                filter_func(ws_edt, (121, 255), size, method='edt')
+                ws_ball = puma.Workspace.from_array(self.matrix)
+                filter_func(ws_ball, (121, 255), size, method='ball')
+                np.testing.assert_array_equal(ws_edt.matrix, ws_ball.matrix)
+                np.testing.assert_array_equal(ws_edt.matrix, reference(binary, ball(size)))
+
+    def test_memmap(self):
+        matrix = np.memmap("out/filter_memmap.raw", dtype=np.uint16, mode='w+', shape=self.matrix.shape)
+        matrix[:] = self.matrix
+        ws = puma.Workspace()
+        ws.matrix = matrix
+        puma.filter_median(ws, 3, workers=4)
+        self.assertTrue(isinstance(ws.matrix, np.memmap))
+        np.testing.assert_array_equal(ws.matrix, median_filter(self.matrix, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,276 @@
+import unittest
+import numpy as np
+import pumapy as puma
+from scipy.spatial.distance import pdist, squareform
+from pumapy.generation.random_spheres import GeneratorSpheres
+from pumapy.generation.random_fibers import _sample_fibers, _rasterize_fibers
+from pumapy.generation.tracker import DescriptorTracker
+from pumapy.generation.fiber_array import GeneratorFiberArray
+
+
+class TestRandomSpheres(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+
+    def test_porosity(self):
+        for allow_intersect in [True, False]:
+            ws = puma.generate_random_spheres((60, 60, 60), 8, 0.7, allow_intersect)
+            self.assertEqual(ws.matrix.shape, (60, 60, 60))
+            self.assertAlmostEqual(np.mean(ws.matrix <= 127), 0.7, delta=0.002)
+
+    def test_non_intersecting(self):
+        for diameter_std in [0, 2]:
+            generator = GeneratorSpheres((60, 60, 60), 8, 0.75, False, diameter_std, 256)
+            ws = generator.generate()
+            self.assertAlmostEqual(np.mean(ws.matrix <= 127), 0.75, delta=0.002)
+
+            generator._rebuild_tree()
+            centers, diameters = generator._tree.data, generator._tree_diameters
+            if diameter_std > 0:
+                self.assertTrue(np.std(diameters) > 1)
+            contact = (diameters[:, np.newaxis] + diameters[np.newaxis]) / 2.
+            distances = squareform(pdist(centers)) + np.eye(centers.shape[0]) * 1e6
+            self.assertTrue(np.all(distances >= contact))
+
+    def test_rasterization(self):
+        ws = puma.generate_random_spheres((40, 50, 30), 8, 0.5, True, 2, workers=1)
+        np.random.seed(0)
+        ws_threads = puma.generate_random_spheres((40, 50, 30), 8, 0.5, True, 2, workers=4)
+        np.testing.assert_array_equal(ws.matrix, ws_threads.matrix)
+        self.assertTrue(ws.matrix.max() <= 255)
+
+        # a single sphere placed at the center of its block is identical to get_sphere
+        generator = GeneratorSpheres((12, 12, 12), 8, 0.5, True)
+        generator._centers, generator._diameters = [np.array([5.5, 5.5, 5.5])], [8.]
+        generator._workspace.resize_new_matrix((12, 12, 12))
+        generator._rasterize()
+        np.testing.assert_array_equal(generator._workspace.matrix, puma.get_sphere(8))
+
+    def test_periodic(self):
+        for allow_intersect in [True, False]:
+            ws = puma.generate_random_spheres((40, 40, 40), 8, 0.7, allow_intersect, periodic=True)
+            self.assertAlmostEqual(np.mean(ws.matrix <= 127), 0.7, delta=0.002)
+
+        # a sphere crossing a corner wraps around, like a sphere at the center of the domain rolled to the corner
+        matrices = []
+        for center in [(1., 2., 3.), (11., 12., 13.)]:
+            generator = GeneratorSpheres((20, 20, 20), 8, 0.5, True, periodic=True)
+            generator._centers, generator._diameters = [np.array(center)], [8.]
+            generator._workspace.resize_new_matrix((20, 20, 20))
+            generator._rasterize()
+            matrices.append(generator._workspace.matrix)
+        self.assertTrue(np.all(matrices[1][0] == 0))
+        np.testing.assert_array_equal(matrices[0], np.roll(matrices[1], -10, axis=(0, 1, 2)))
+
+        generator = GeneratorSpheres((30, 30, 30), 8, 0.75, False, periodic=True)
+        generator.generate()
+        generator._rebuild_tree()
+        pairs = generator._tree.sparse_distance_matrix(generator._tree, 8, output_type='ndarray')
+        self.assertTrue(np.all(pairs['v'][pairs['i'] != pairs['j']] >= 8))
+
+    def test_tracker(self):
+        # the incremental descriptors match the ones of the final domain
+        for allow_intersect in [True, False]:
+            generator = GeneratorSpheres((40, 40, 40), 8, 0.7, allow_intersect, specific_area=1e9)
+            ws = generator.generate()
+            solid = ws.matrix > 127
+            self.assertEqual(generator._tracker.solid_voxels, np.count_nonzero(solid))
+            self.assertEqual(generator._tracker.faces, DescriptorTracker._count_faces(solid))
+
+        # targeting the specific area instead of the porosity
+        ws = puma.generate_random_spheres((50, 50, 50), 8, 0.1, specific_area=1.5e5)
+        self.assertTrue(np.mean(ws.matrix <= 127) > 0.5)
+        specific_area = puma.compute_partial_volume(ws, (128, 255))[2]
+        self.assertAlmostEqual(specific_area / 1.5e5, 1, delta=0.15)
+
+
+class TestRandomFibers(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+
+    def test_porosity(self):
+        ws = puma.generate_random_fibers((60, 60, 60), 3, porosity=0.8, length=30)
+        self.assertAlmostEqual(np.mean(ws.matrix == 0), 0.8, delta=0.02)
+
+    def test_rasterization(self):
+        starts, ends = _sample_fibers((40, 50, 30), 20, phi=90, length=40)
+        self.assertEqual(starts.shape, (20, 3))
+        solid = np.zeros((40, 50, 30), dtype=bool)
+        added = _rasterize_fibers(solid, starts, ends, 3, workers=1)
+        solid_threads = np.zeros((40, 50, 30), dtype=bool)
+        self.assertEqual(_rasterize_fibers(solid_threads, starts, ends, 3, workers=4), added)
+        self.assertEqual(np.count_nonzero(solid), added)
+        np.testing.assert_array_equal(solid, solid_threads)
+
+        # brute force distances to the centerlines
+        points = np.indices(solid.shape).reshape(3, -1).T[:, np.newaxis]
+        direction = ends - starts
+        t = np.clip(np.sum((points - starts) * direction, axis=2) / np.sum(direction ** 2, axis=1), 0, 1)
+        dist = np.linalg.norm(points - starts - t[..., np.newaxis] * direction, axis=2).min(axis=1)
+        np.testing.assert_array_equal(solid.ravel(), dist < 3)
+
+    def test_periodic(self):
+        ws = puma.generate_random_fibers((40, 40, 40), 2, porosity=0.8, phi=90, periodic=True)
+        self.assertAlmostEqual(np.mean(ws.matrix == 0), 0.8, delta=0.02)
+
+        # shifting the fibers by a translation rolls the periodic domain
+        starts, ends = _sample_fibers((30, 20, 25), 10, phi=90, length=20, periodic=True)
+        solid = np.zeros((30, 20, 25), dtype=bool)
+        _rasterize_fibers(solid, starts, ends, 2.5, periodic=True)
+        shifted = np.zeros((30, 20, 25), dtype=bool)
+        _rasterize_fibers(shifted, starts + (7, 3, 11), ends + (7, 3, 11), 2.5, periodic=True)
+        np.testing.assert_array_equal(solid, np.roll(shifted, (-7, -3, -11), axis=(0, 1, 2)))
+        self.assertTrue(np.count_nonzero(solid) > 0)
+
+        # by default, periodic fibers are not longer than the smallest period
+        starts, ends = _sample_fibers((30, 20, 25), 10, phi=90, periodic=True)
+        self.assertTrue(np.all(np.abs(ends - starts) <= 20))
+
+
+class TestFibers(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+
+    def test_porosity(self):
+        for kwargs in [dict(), dict(curvature_radius=20), dict(n_small_fibers=5, small_radius=1.5),
+                       dict(curvature_radius=20, n_small_fibers=5, small_radius=1.5, placement_var=10)]:
+            ws = puma.generate_fibers((50, 50, 50), 3, 30, 0.8, phi=90, radius_var=0.5, orientation=True, **kwargs)
+            self.assertAlmostEqual(np.mean(ws.matrix < 128), 0.8, delta=0.01)
+            magnitude = np.linalg.norm(ws.orientation, axis=3)
+            np.testing.assert_allclose(magnitude[ws.matrix >= 128], 1)
+            self.assertTrue(np.all(magnitude[ws.matrix < 128] == 0))
+
+    def test_small_fibers_var(self):
+        with self.assertRaises(Exception):
+            puma.generate_fibers((30, 30, 30), 3, 20, 0.8, n_small_fibers_var=2)
+        ws = puma.generate_fibers((30, 30, 30), 3, 20, 0.8, n_small_fibers_var=2, small_radius=1)
+        self.assertTrue(np.count_nonzero(ws.matrix) > 0)
+
+    def test_orientation(self):
+        ws = puma.generate_fibers((60, 60, 60), 3, 40, 0.85, phi=90, curvature_radius=25, orientation=True)
+        reference = ws.orientation.copy()
+        puma.compute_orientation_st(ws, 0.7, 1.1, (128, 255))
+        error, mean, std = puma.compute_angular_differences(ws.matrix, ws.orientation, reference, (128, 255))
+        self.assertTrue(mean < 10)
+
+    def test_prescribed(self):
+        ws = puma.generate_prescribed_fibers([[2, 10, 10, 37, 10, 10]], 4, size=(40, 20, 20), orientation=True)
+        x, y, z = np.indices(ws.matrix.shape)
+        dist = np.sqrt((x - np.clip(x, 2, 37)) ** 2 + (y - 10) ** 2 + (z - 10) ** 2)
+        np.testing.assert_array_equal(ws.matrix >= 128, dist <= 4)
+        np.testing.assert_array_equal(ws.orientation[ws.matrix >= 128], [[1, 0, 0]] * np.sum(dist <= 4))
+
+        ws = puma.generate_prescribed_fibers(np.array([[[0, 0, 0], [10, 5, 0]], [[0, 5, 2], [10, 0, 2]]]), 0.5,
+                                             scale=2.)
+        self.assertEqual(ws.matrix.shape, (26, 16, 10))
+
+    def test_periodic(self):
+        ws = puma.generate_fibers((50, 50, 50), 3, 30, 0.8, phi=90, curvature_radius=20, periodic=True)
+        self.assertAlmostEqual(np.mean(ws.matrix < 128), 0.8, delta=0.01)
+
+        # a fiber leaving the domain through the x faces continues on the opposite side
+        ws = puma.generate_prescribed_fibers([[-10, 10, 10, 10, 10, 10]], 4, size=(30, 20, 20), orientation=True,
+                                             periodic=True)
+        reference = puma.generate_prescribed_fibers([[20, 10, 10, 40, 10, 10]], 4, size=(60, 20, 20),
+                                                    orientation=True)
+        wrapped = np.maximum(reference.matrix[:30], reference.matrix[30:])
+        np.testing.assert_array_equal(ws.matrix, wrapped)
+        np.testing.assert_array_equal(ws.orientation[ws.matrix >= 128], [[1, 0, 0]] * np.sum(ws.matrix >= 128))
+
+
+class TestFiberArray(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+
+    def test_lattices(self):
+        for packing in ['hexagonal', 'square']:
+            ws = puma.generate_fiber_array((200, 150, 20), 5, 0.5, packing, coating=1, orientation=True)
+            self.assertEqual(ws.matrix.shape, (200, 150, 20))
+            self.assertEqual(ws.matrix.strides[2], 0)
+            self.assertAlmostEqual(np.mean(ws.matrix == 2), 0.5, delta=0.01)
+            self.assertAlmostEqual(np.mean(ws.matrix == 1), 0.5 * ((6 / 5.) ** 2 - 1), delta=0.01)
+            np.testing.assert_array_equal(ws.orientation[..., 2], ws.matrix > 0)
+
+    def test_random(self):
+        generator = GeneratorFiberArray((100, 120), 4, 0.2, 'random', coating=1, min_spacing=1, phase_ids=(3, 2, 1))
+        generator.error_check()
+        ws = generator.generate()
+        self.assertEqual(ws.matrix.shape, (100, 120, 1))
+        self.assertAlmostEqual(np.mean(ws.matrix == 1), 0.2, delta=0.02)
+
+        # minimum spacing across the periodic faces, and phases from the distance to the nearest center
+        centers = generator._centers
+        difference = centers[:, np.newaxis] - centers[np.newaxis]
+        difference -= np.array([100, 120]) * np.round(difference / np.array([100, 120]))
+        distance = np.linalg.norm(difference, axis=2) + np.eye(centers.shape[0]) * 1e6
+        self.assertTrue(np.all(distance >= 11))
+        points = np.indices((100, 120)).reshape(2, -1).T[:, np.newaxis]
+        difference = points - centers
+        difference -= np.array([100, 120]) * np.round(difference / np.array([100, 120]))
+        nearest = np.linalg.norm(difference, axis=2).min(axis=1).reshape(100, 120)
+        np.testing.assert_array_equal(ws.matrix[:, :, 0], np.where(nearest <= 4, 1, np.where(nearest <= 5, 2, 3)))
+
+
+class TestTPMS(unittest.TestCase):
+
+    def test_memmap(self):
+        ws = puma.generate_tpms((40, 30, 20), (0.1, 0.3), (0.2, 0.5), 1)
+        ws_memmap = puma.generate_tpms((40, 30, 20), (0.1, 0.3), (0.2, 0.5), 1, output="out/tpms_memmap.raw", workers=4)
+        self.assertTrue(isinstance(ws_memmap.matrix, np.memmap))
+        self.assertEqual(ws.matrix.dtype, np.uint16)
+        np.testing.assert_array_equal(ws.matrix, ws_memmap.matrix)
+        self.assertTrue(ws.matrix.min() == 0 and ws.matrix.max() <= 255)
+
+    def test_user_equation(self):
+        ws = puma.generate_tpms((30, 40, 20), (0.1, 0.3), 0.3, 2)
+        ws_user = puma.generate_tpms((30, 40, 20), (0.1, 0.3), 0.3,
+                                     lambda x, y, z, w, q: np.cos(w * x) + np.cos(w * y) + np.cos(w * z) + q)
+        np.testing.assert_array_equal(ws.matrix, ws_user.matrix)
+
+
+class TestEnsemble(unittest.TestCase):
+
+    def test_ensemble(self):
+        parameters = {'size': [(30, 30, 30)], 'diameter': [6, 8], 'porosity': [0.8]}
+        table = puma.generate_ensemble(puma.generate_random_spheres, parameters, realizations=2, seed=3, workers=1,
+                                       descriptors=('porosity', 'mean_intercept_length'))
+        self.assertEqual(table.dtype.names, ('realization', 'replicate', 'diameter', 'measured_porosity',
+                                             'mean_intercept_length_x', 'mean_intercept_length_y',
+                                             'mean_intercept_length_z'))
+        np.testing.assert_array_equal(table['diameter'], [6, 6, 8, 8])
+        np.testing.assert_allclose(table['measured_porosity'], 0.8, atol=0.01)
+        self.assertNotEqual(table['measured_porosity'][0], table['measured_porosity'][1])
+
+        # same results on a process pool, with the realizations saved
+        table_pool = puma.generate_ensemble(puma.generate_random_spheres, parameters, realizations=2, seed=3,
+                                            workers=2, descriptors=('porosity', 'mean_intercept_length'),
+                                            output_dir="out/ensemble")
+        for name in table.dtype.names:
+            np.testing.assert_array_equal(table[name], table_pool[name])
+        ws = puma.import_bin(table_pool['path'][2])
+        self.assertAlmostEqual(np.mean(ws.matrix <= 127), table['measured_porosity'][2])
+
+    def test_ensemble_descriptor_names(self):
+        # the varied input porosities are kept next to the measured ones
+        parameters = {'size': [(20, 20, 20)], 'diameter': [6], 'porosity': [0.6, 0.8]}
+        table = puma.generate_ensemble(puma.generate_random_spheres, parameters, seed=1, workers=1)
+        self.assertEqual(table.dtype.names, ('realization', 'replicate', 'porosity', 'measured_porosity'))
+        np.testing.assert_array_equal(table['porosity'], [0.6, 0.8])
+        np.testing.assert_allclose(table['measured_porosity'], [0.6, 0.8], atol=0.05)
+
+    def test_ensemble_global_rng(self):
+        # running in the current process leaves the caller's global RNG untouched
+        np.random.seed(5)
+        expected = np.random.rand(3)
+        np.random.seed(5)
+        puma.generate_ensemble(puma.generate_random_spheres, {'size': [(20, 20, 20)], 'diameter': [6],
+                                                              'porosity': [0.8]}, seed=1, workers=1)
+        np.testing.assert_array_equal(np.random.rand(3), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
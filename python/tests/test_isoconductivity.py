@@ -131,6 +131,57 @@ class TestIsotropicTC(unittest.TestCase):
         keff, T, _ = puma.compute_thermal_conductivity(self.ws_matSeriesInx, self.cond_map_matSeries, 'z', 's', solver_type='bicgstab')
         np.testing.assert_array_almost_equal(keff, [0., 0., 5.5], decimal=4)
 
+    def test_solver_backends(self):
+        # same solution with every backend and preconditioner
+        for backend, preconditioner, workers in (('scipy', 'jacobi', 1), ('threads', 'jacobi', 3), ('scipy', 'ilu', 1),
+                                                 ('threads', 'none', 2)):
+            keff, T, _ = puma.compute_thermal_conductivity(self.ws_matSeriesInx, self.cond_map_matSeries, 'x', 's',
+                                                           tolerance=1e-8, solver_type='bicgstab', display_iter=False,
+                                                           workers=workers, preconditioner=preconditioner,
+                                                           backend=backend)
+            np.testing.assert_array_almost_equal(keff, [1.818181818, 0., 0.], decimal=5)
+        with self.assertRaises(Exception):
+            puma.compute_thermal_conductivity(self.ws_matSeriesInx, self.cond_map_matSeries, 'x', 's',
+                                              preconditioner='amg')
+
+    def test_residual_history(self):
+        from scipy.sparse import diags
+        from pumapy.physicsmodels.linear_solver import KrylovSolver
+        A = diags([-np.ones(99), 2.1 * np.ones(100), -np.ones(99)], [-1, 0, 1]).tocsr()
+        b = np.ones(100)
+        for solver_type in ('cg', 'bicgstab', 'gmres'):
+            solver = KrylovSolver(solver_type, tolerance=1e-10, rtol=1e-10, history=True)
+            x = solver.solve(A, b)
+            self.assertTrue(solver.converged)
+            self.assertEqual(len(solver.residuals), solver.iterations)
+            self.assertLess(solver.residuals[-1], 1e-8)
+            np.testing.assert_allclose(A @ x, b, atol=1e-8)
+
+    def test_effective_tolerance(self):
+        ws = puma.Workspace.from_array(np.random.randint(1, 3, (20, 16, 18)))
+        keff = puma.compute_thermal_conductivity(ws, self.cond_map_matSeries, 'z', 's', tolerance=1e-10,
+                                                 display_iter=False)[0]
+        keff_e = puma.compute_thermal_conductivity(ws, self.cond_map_matSeries, 'z', 's', tolerance=1e-10,
+                                                   display_iter=False, effective_tolerance=1e-3, check_every=2)[0]
+        np.testing.assert_allclose(keff_e[2], keff[2], rtol=5e-3)
+
+    def test_levels(self):
+        from pumapy.physicsmodels.multilevel import coarsen_workspace
+        np.random.seed(0)
+        ws = puma.Workspace.from_array(np.random.randint(1, 3, (21, 16, 18)))
+        coarse = coarsen_workspace(ws, self.cond_map_matSeries)
+        self.assertEqual(coarse.matrix.shape, (11, 8, 9))
+        self.assertEqual(coarse.voxel_length, 2 * ws.voxel_length)
+        np.testing.assert_array_equal(coarsen_workspace(self.ws_matSeriesInx, self.cond_map_matSeries).matrix,
+                                      self.ws_matSeriesInx.matrix[::2, ::2, ::2])
+
+        # same solution from the coarse-to-fine initial guess
+        keff = puma.compute_thermal_conductivity(ws, self.cond_map_matSeries, 'y', 's', tolerance=1e-10,
+                                                 display_iter=False)[0]
+        keff_l = puma.compute_thermal_conductivity(ws, self.cond_map_matSeries, 'y', 's', tolerance=1e-10,
+                                                   display_iter=False, levels=3)[0]
+        np.testing.assert_allclose(keff_l[1], keff[1], rtol=1e-4)
+
     def test_artfib50(self):
         ws = puma.import_vti("testdata/artifib.vtk")
         cond_map = puma.IsotropicConductivityMap()
@@ -1,6 +1,8 @@
+import os
 import unittest
 import numpy as np
 import pumapy as puma
+from pumapy.physicsmodels.mpfa_conductivity import AnisotropicConductivity
 
 
 class TestAnisotropicTC(unittest.TestCase):
@@ -177,6 +179,19 @@ class TestAnisotropicTC(unittest.TestCase):
         keff, T, q = puma.compute_thermal_conductivity(ws, cond_map, 'z', 's', solver_type='direct')
         np.testing.assert_array_almost_equal(keff, [0, 0, 10], decimal=6)
 
+    def test_tensor_rotation_encoded(self):
+        ws = puma.Workspace.from_array(np.zeros((self.X, self.Y, self.Z)))
+        ws.set(1, (1 / np.sqrt(3), 1 / np.sqrt(3), 1 / np.sqrt(3)))
+        cond_map = puma.AnisotropicConductivityMap()
+        cond_map.add_material_to_orient((1, 1), 10, 1)
+        ws_encoded = ws.copy()
+        ws_encoded.encode_orientation()
+
+        for direction, side_bc in [('x', 's'), ('y', 'p'), ('z', 's')]:
+            keff, _, _ = puma.compute_thermal_conductivity(ws, cond_map, direction, side_bc, solver_type='direct')
+            keff_encoded, _, _ = puma.compute_thermal_conductivity(ws_encoded, cond_map, direction, side_bc, solver_type='direct')
+            np.testing.assert_array_almost_equal(keff, keff_encoded, decimal=3)
+
     def test_artfib50(self):
         ws = puma.import_vti("testdata/artifib.vtk")
         cond_map = puma.AnisotropicConductivityMap()
@@ -189,6 +204,106 @@ class TestAnisotropicTC(unittest.TestCase):
         keff, _, _ = puma.compute_thermal_conductivity(ws, cond_map, 'z', 's', tolerance=1e-4)
         np.testing.assert_array_almost_equal(keff, [0.001, -0.0034, 0.0848], decimal=4)
 
+    def test_workers(self):
+        # slabs assembled and post-processed by separate workers give the same system and fields as a single slab
+        ws = puma.Workspace.from_array(np.random.randint(1, 3, (12, 7, 8)))
+        ws[:, :, :2] = 0
+        cond_map = puma.AnisotropicConductivityMap()
+        cond_map.add_material((0, 0), 0.1, 0.1, 0.1, 0, 0, 0)
+        cond_map.add_material((1, 1), 10, 2, 1, 0.5, 0.3, 0.1)
+        cond_map.add_material((2, 2), 3, 3, 5, 0, 0, 0)
+        keff1, T1, q1 = puma.compute_thermal_conductivity(ws, cond_map, 'y', 's', solver_type='bicgstab',
+                                                          tolerance=1e-12, workers=1)
+        keff3, T3, q3 = puma.compute_thermal_conductivity(ws, cond_map, 'y', 's', solver_type='bicgstab',
+                                                          tolerance=1e-12, workers=3)
+        np.testing.assert_allclose(keff3, keff1, rtol=1e-8)
+        np.testing.assert_allclose(T3, T1, atol=1e-8)
+        np.testing.assert_allclose(q3, q1, atol=1e-8 * np.abs(q1).max())
+
+    def test_outputs(self):
+        # effective conductivity without flux field, and flux streamed to disk
+        ws = puma.Workspace.from_array(np.random.randint(1, 3, (9, 7, 8)))
+        cond_map = puma.AnisotropicConductivityMap()
+        cond_map.add_material((1, 1), 10, 2, 1, 0.5, 0.3, 0.1)
+        cond_map.add_material((2, 2), 3, 3, 5, 0, 0, 0)
+        keff, T, q = puma.compute_thermal_conductivity(ws, cond_map, 'z', 'p', solver_type='direct')
+        keff_e, T_e, q_e = puma.compute_thermal_conductivity(ws, cond_map, 'z', 'p', solver_type='direct',
+                                                             outputs='effective')
+        keff_d, T_d, q_d = puma.compute_thermal_conductivity(ws, cond_map, 'z', 'p', solver_type='direct',
+                                                             outputs='disk')
+        np.testing.assert_allclose(keff_e, keff, rtol=1e-12)
+        np.testing.assert_allclose(keff_d, keff, rtol=1e-12)
+        self.assertIsNone(q_e)
+        self.assertIsInstance(q_d, np.memmap)
+        np.testing.assert_allclose(np.load(q_d.filename), q, atol=1e-12 * np.abs(q).max())
+        puma.remove_field(q_d)
+        self.assertFalse(os.path.exists(q_d.filename))
+
+    def test_ilu(self):
+        # the incomplete LU preconditioner factors the systems of every boundary condition
+        np.random.seed(0)
+        ws = puma.Workspace.from_array(np.random.randint(1, 3, (10, 9, 8)))
+        cond_map = puma.AnisotropicConductivityMap()
+        cond_map.add_material((1, 1), 10, 2, 1, 0.5, 0.3, 0.1)
+        cond_map.add_material((2, 2), 3, 3, 5, 0, 0, 0)
+        for side_bc in ['s', 'p', 'd']:
+            keff, _, _ = puma.compute_thermal_conductivity(ws, cond_map, 'x', side_bc, solver_type='direct')
+            keff_ilu, _, _ = puma.compute_thermal_conductivity(ws, cond_map, 'x', side_bc, solver_type='bicgstab',
+                                                               tolerance=1e-10, preconditioner='ilu')
+            np.testing.assert_allclose(keff_ilu, keff, rtol=1e-5, atol=1e-8)
+
+    def test_effective_tolerance(self):
+        # stopping on the effective conductivity, whose estimates from the iterates are exact for the converged solution
+        np.random.seed(0)
+        ws = puma.Workspace.from_array(np.random.randint(1, 3, (12, 10, 11)))
+        cond_map = puma.AnisotropicConductivityMap()
+        cond_map.add_material((1, 1), 10, 2, 1, 0.5, 0.3, 0.1)
+        cond_map.add_material((2, 2), 3, 3, 5, 0, 0, 0)
+        keff = puma.compute_thermal_conductivity(ws, cond_map, 'y', 's', tolerance=1e-10, display_iter=False)[0]
+        keff_e = puma.compute_thermal_conductivity(ws, cond_map, 'y', 's', tolerance=1e-10, display_iter=False,
+                                                   effective_tolerance=1e-3, check_every=2)[0]
+        np.testing.assert_allclose(keff_e[1], keff[1], rtol=5e-3)
+
+        solver = AnisotropicConductivity(ws, cond_map, 'y', 's', None, 1e-10, 10000, 'bicgstab', False,
+                                         (0, 0, 0, 0, 0), effective_tolerance=1e-12, check_every=1)
+        solver.error_check()
+        solver.compute()
+        self.assertAlmostEqual(solver.convergence_trace[-1][1], solver.keff[1], places=10)
+
+    def test_levels(self):
+        # same solution from the coarse-to-fine initial guess, with the orientation taken along in the coarse levels
+        np.random.seed(0)
+        ws = puma.Workspace.from_array(np.random.randint(1, 3, (14, 12, 13)))
+        ws.orientation = np.random.rand(14, 12, 13, 3) - 0.5
+        ws.orientation /= np.linalg.norm(ws.orientation, axis=3)[:, :, :, np.newaxis]
+        cond_map = puma.AnisotropicConductivityMap()
+        cond_map.add_material_to_orient((1, 1), 10, 1)
+        cond_map.add_isotropic_material((2, 2), 3)
+        keff = puma.compute_thermal_conductivity(ws, cond_map, 'z', 's', tolerance=1e-10, display_iter=False)[0]
+        keff_l = puma.compute_thermal_conductivity(ws, cond_map, 'z', 's', tolerance=1e-10, display_iter=False,
+                                                   levels=2)[0]
+        np.testing.assert_array_almost_equal(keff_l, keff, decimal=4)
+
+    def test_dirichlet_bvector(self):
+        # vectorized right hand side against the voxel by voxel assembly, with the side ramps overlapping the unit face
+        from pumapy.utilities.boundary_conditions import dirichlet_bvector
+        len_x, len_y, len_z = 7, 5, 6
+        prescribed = np.full((len_x - 2, len_y - 2, len_z - 2), np.Inf)
+        prescribed[0], prescribed[2, 1, 1:3] = 0.5, 3.
+        x = np.linspace(0, 1, len_x - 2)
+        for bc in (None, prescribed):
+            b = np.zeros(len_x * len_y * len_z)
+            for i in range(1, len_x - 1):
+                for j in range(1, len_y - 1):
+                    for k in range(1, len_z - 1):
+                        if bc is None and i == len_x - 2:
+                            b[len_x * (len_y * k + j) + i] += 1.
+                        elif bc is not None and bc[i - 1, j - 1, k - 1] != np.Inf:
+                            b[len_x * (len_y * k + j) + i] += bc[i - 1, j - 1, k - 1]
+                        if j in (1, len_y - 2) or (k in (1, len_z - 2) and 1 < i < len_x - 2 and 1 < j < len_y - 2):
+                            b[len_x * (len_y * k + j) + i] += x[i - 1]
+            np.testing.assert_allclose(dirichlet_bvector((len_x, len_y, len_z), bc, side_dirichlet=True), b)
+
 
 if __name__ == '__main__':
     unittest.main()
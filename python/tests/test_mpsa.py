@@ -1,3 +1,4 @@
+import os
 import unittest
 import numpy as np
 import pumapy as puma
@@ -265,6 +266,19 @@ class TestElasticity(unittest.TestCase):
         Ceff, u, _, _ = puma.compute_elasticity(ws, elast_map, 'z', 'p', solver_type='direct')
         np.testing.assert_array_almost_equal(Ceff, [9.418509418509425, 9.418509418509425, 14.33251433251433, 0, 0, 0], decimal=7)
 
+    def test_tensor_rotation_encoded(self):
+        ws = puma.Workspace.from_array(np.ones((self.X, self.Y, self.Z)))
+        ws.set(orientation_value=(1 / np.sqrt(3), 1 / np.sqrt(3), 1 / np.sqrt(3)))
+        elast_map = puma.ElasticityMap()
+        elast_map.add_material_to_orient((1, 1), 10, 20, 0.23, 0.3, 50)
+        ws_encoded = ws.copy()
+        ws_encoded.encode_orientation()
+
+        for direction in ['x', 'y', 'z']:
+            Ceff, _, _, _ = puma.compute_elasticity(ws, elast_map, direction, 'p', solver_type='direct')
+            Ceff_encoded, _, _, _ = puma.compute_elasticity(ws_encoded, elast_map, direction, 'p', solver_type='direct')
+            np.testing.assert_array_almost_equal(Ceff, Ceff_encoded, decimal=3)
+
     def test_Amat_builtinbeam596(self):
         ws = puma.Workspace.from_shape_value((5, 9, 6), 1)
 
@@ -364,6 +378,80 @@ class TestElasticity(unittest.TestCase):
         test_Amat = np.abs(solver.Amat.toarray() - Amat_correct.toarray())
         self.assertAlmostEqual(test_Amat.max(), 0, 10)
 
+    def test_workers(self):
+        # slabs assembled and post-processed by separate workers give the same system and fields as a single slab
+        ws = puma.Workspace.from_array(np.random.randint(1, 3, (12, 6, 7)))
+        elast_map = puma.ElasticityMap()
+        elast_map.add_isotropic_material((1, 1), 200, 0.3)
+        elast_map.add_isotropic_material((2, 2), 100, 0.2)
+        Ceff1, u1, s1, t1 = puma.compute_elasticity(ws, elast_map, 'x', 'p', solver_type='direct', workers=1)
+        Ceff3, u3, s3, t3 = puma.compute_elasticity(ws, elast_map, 'x', 'p', solver_type='direct', workers=3)
+        np.testing.assert_allclose(Ceff3, Ceff1, rtol=1e-10)
+        np.testing.assert_allclose(u3, u1, atol=1e-12)
+        np.testing.assert_allclose(s3, s1, atol=1e-10 * np.abs(s1).max())
+        np.testing.assert_allclose(t3, t1, atol=1e-10 * np.abs(t1).max())
+
+    def test_outputs(self):
+        # effective elasticity without stress fields, and stresses streamed to disk
+        ws = puma.Workspace.from_array(np.random.randint(1, 3, (8, 6, 7)))
+        elast_map = puma.ElasticityMap()
+        elast_map.add_isotropic_material((1, 1), 200, 0.3)
+        elast_map.add_isotropic_material((2, 2), 100, 0.2)
+        Ceff, u, s, t = puma.compute_elasticity(ws, elast_map, 'y', 's', solver_type='direct')
+        Ceff_e, _, s_e, t_e = puma.compute_elasticity(ws, elast_map, 'y', 's', solver_type='direct', outputs='effective')
+        Ceff_d, _, s_d, t_d = puma.compute_elasticity(ws, elast_map, 'y', 's', solver_type='direct', outputs='disk')
+        np.testing.assert_allclose(Ceff_e, Ceff, rtol=1e-12, atol=1e-12 * np.abs(Ceff).max())
+        np.testing.assert_allclose(Ceff_d, Ceff, rtol=1e-12, atol=1e-12 * np.abs(Ceff).max())
+        self.assertIsNone(s_e)
+        self.assertIsNone(t_e)
+        np.testing.assert_allclose(np.load(s_d.filename), s, atol=1e-12 * np.abs(s).max())
+        np.testing.assert_allclose(np.load(t_d.filename), t, atol=1e-12 * np.abs(t).max())
+        puma.remove_field(s_d)
+        puma.remove_field(t_d)
+        self.assertFalse(os.path.exists(s_d.filename) or os.path.exists(t_d.filename))
+
+    def test_ilu(self):
+        # the incomplete LU preconditioner factors the systems of every boundary condition
+        np.random.seed(1)
+        ws = puma.Workspace.from_array(np.random.randint(1, 3, (10, 9, 8)))
+        elast_map = puma.ElasticityMap()
+        elast_map.add_isotropic_material((1, 1), 200, 0.3)
+        elast_map.add_isotropic_material((2, 2), 100, 0.2)
+        for side_bc in ['p', 'f', 'd', 's']:
+            Ceff, _, _, _ = puma.compute_elasticity(ws, elast_map, 'x', side_bc, solver_type='direct')
+            Ceff_ilu, _, _, _ = puma.compute_elasticity(ws, elast_map, 'x', side_bc, solver_type='bicgstab',
+                                                        tolerance=1e-10, preconditioner='ilu')
+            np.testing.assert_allclose(Ceff_ilu, Ceff, rtol=1e-5, atol=1e-6)
+
+    def test_effective_tolerance(self):
+        # stopping on the effective stiffness, whose estimates from the iterates are exact for the converged solution
+        np.random.seed(0)
+        ws = puma.Workspace.from_array(np.random.randint(1, 3, (9, 7, 8)))
+        elast_map = puma.ElasticityMap()
+        elast_map.add_isotropic_material((1, 1), 200, 0.3)
+        elast_map.add_isotropic_material((2, 2), 100, 0.2)
+        Ceff = puma.compute_elasticity(ws, elast_map, 'z', 'p', tolerance=1e-10, display_iter=False)[0]
+        Ceff_e = puma.compute_elasticity(ws, elast_map, 'z', 'p', tolerance=1e-10, display_iter=False,
+                                         effective_tolerance=1e-3, check_every=2)[0]
+        np.testing.assert_allclose(Ceff_e[2], Ceff[2], rtol=5e-3)
+
+        solver = Elasticity(ws, elast_map, 'z', 'p', None, 1e-10, 10000, 'bicgstab', False, (0, 0, 0, 0, 0),
+                            effective_tolerance=1e-12, check_every=1)
+        solver.error_check()
+        solver.compute()
+        self.assertAlmostEqual(solver.convergence_trace[-1][1] / solver.Ceff[2], 1., places=10)
+
+    def test_levels(self):
+        # same solution from the coarse-to-fine initial guess
+        np.random.seed(0)
+        ws = puma.Workspace.from_array(np.random.randint(1, 3, (12, 10, 11)))
+        elast_map = puma.ElasticityMap()
+        elast_map.add_isotropic_material((1, 1), 200, 0.3)
+        elast_map.add_isotropic_material((2, 2), 100, 0.2)
+        Ceff = puma.compute_elasticity(ws, elast_map, 'y', 'p', tolerance=1e-10, display_iter=False)[0]
+        Ceff_l = puma.compute_elasticity(ws, elast_map, 'y', 'p', tolerance=1e-10, display_iter=False, levels=2)[0]
+        np.testing.assert_allclose(Ceff_l, Ceff, rtol=1e-4, atol=1e-3)
+
 
 if __name__ == '__main__':
     unittest.main()
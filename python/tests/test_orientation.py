@@ -1,5 +1,7 @@
 import unittest
+import numpy as np
 import pumapy as puma
+from pumapy.materialproperties.orientation import smallest_eigenvector_sym3
 
 
 class TestOrientationST(unittest.TestCase):
@@ -19,6 +21,54 @@ class TestOrientationST(unittest.TestCase):
         print(mean, std)
         self.assertTrue(mean < 6 and std < 10)
 
+    def test_blocks(self):
+        ws1 = puma.generate_random_fibers((60, 60, 60), 4, nfibers=30, phi=0, theta=90)
+        ws2 = ws1.copy()
+        puma.compute_orientation_st(ws1, 0.7, 1.1, (1, 1))
+        puma.compute_orientation_st(ws2, 0.7, 1.1, (1, 1), blocks=True, workers=4)
+        self.assertEqual(ws2.orientation.dtype, np.float32)
+        error, mean, std = puma.compute_angular_differences(ws1.matrix, ws1.orientation, ws2.orientation, (1, 1))
+        self.assertTrue(mean < 0.1)
+
+    def test_fibers(self):
+        ws = puma.import_bin("testdata/fibers_with_orientation.pumapy")
+        for blocks in [False, True]:
+            ws_st = ws.copy()
+            puma.compute_orientation_st(ws_st, 0.7, 1.4, (128, 255), blocks=blocks)
+            _, mean, std = puma.compute_angular_differences(ws.matrix, ws_st.orientation, ws.orientation, (128, 255))
+            self.assertTrue(mean < 6 and std < 12)
+
+    def test_raycasting(self):
+        ws = puma.import_bin("testdata/fibers_with_orientation.pumapy")
+        reference = ws.orientation.copy()
+        puma.compute_orientation_rc(ws, (128, 255), 5, 15)
+        error, mean, std = puma.compute_angular_differences(ws.matrix, ws.orientation, reference, (128, 255))
+        self.assertTrue(mean < 10 and std < 15)
+
+    def test_artificialflux(self):
+        ws = puma.import_bin("testdata/fibers_with_orientation.pumapy")
+        reference = ws.orientation.copy()
+        puma.compute_orientation_af(ws, (128, 255))
+        error, mean, std = puma.compute_angular_differences(ws.matrix, ws.orientation, reference, (128, 255))
+        self.assertTrue(mean < 25 and std < 25)
+
+    def test_smallest_eigenvector(self):
+        np.random.seed(0)
+        a = np.random.randn(1000, 3, 3)
+        a = a @ a.transpose(0, 2, 1)
+        a[:10] = np.diag([1., 2., 2.])  # repeated eigenvalues
+        a[10:20] = np.diag([1., 1., 2.])
+        vectors = smallest_eigenvector_sym3(a[:, [0, 1, 2, 0, 0, 1], [0, 1, 2, 1, 2, 2]])
+        np.testing.assert_allclose(np.abs(np.sum(vectors * np.linalg.eigh(a)[1][:, :, 0], axis=1))[20:], 1.)
+        np.testing.assert_allclose(np.einsum('nij,nj->ni', a, vectors)[:20], vectors[:20] * a[:20, 0, 0, None])
+
+        # float32 components, as in the block mode
+        vectors = smallest_eigenvector_sym3(a[:, [0, 1, 2, 0, 0, 1], [0, 1, 2, 1, 2, 2]].astype(np.float32))
+        self.assertEqual(vectors.dtype, np.float32)
+        np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), 1., rtol=1e-5)
+        alignment = np.abs(np.sum(vectors * np.linalg.eigh(a)[1][:, :, 0], axis=1))[20:]
+        self.assertTrue(np.median(alignment) > 1 - 1e-6 and np.min(alignment) > 0.99)
+
 
 if __name__ == '__main__':
     unittest.main()
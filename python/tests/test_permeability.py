@@ -0,0 +1,43 @@
+import unittest
+import numpy as np
+import pumapy as puma
+
+
+class TestFVPermeability(unittest.TestCase):
+
+    def test_square_array(self):
+        # body force through a square array of cylinders, against the analytical solution (Gebart's expansion)
+        ws = puma.generate_2d_square_array(100, 1. - 0.0632)
+        ws.binarize_range((140, 255))
+        ws.set_voxel_length(1e-2)
+        r, c = 0.1, 0.0632
+        k_analytical = r ** 2 * (-np.log(c) - 1.476 + 2 * c - 1.774 * c ** 2 + 4.078 * c ** 3 - 4.842 * c ** 4) / (8 * c)
+
+        keff_x, pressure, velocity = puma.compute_permeability(ws, 'x', (1, 1), side_bc='p', pressure_driven=False,
+                                                              solver_type='minres', display_iter=0, method='fv')
+        keff_y = puma.compute_permeability(ws, 'y', (1, 1), side_bc='p', pressure_driven=False,
+                                           solver_type='minres', display_iter=0, method='fv')[0]
+        np.testing.assert_allclose(keff_x[0], k_analytical, rtol=0.03)
+        np.testing.assert_allclose(keff_y[1], keff_x[0], rtol=1e-4)
+        np.testing.assert_allclose(keff_x[1:], 0, atol=1e-4 * keff_x[0])
+        self.assertEqual(pressure.shape, ws.matrix.shape)
+        self.assertEqual(velocity.shape, ws.matrix.shape + (3,))
+        self.assertTrue(np.all(velocity[ws.matrix == 1] == 0))
+
+    def test_channel(self):
+        # pressure driven Poiseuille flow along z between two plates normal to x: k = H^2 / 12 times the porosity
+        ws = puma.Workspace.from_shape_value((12, 5, 8), 0)
+        ws[[0, -1]] = 1
+        ws.set_voxel_length(1e-6)
+        keff, pressure, velocity = puma.compute_permeability(ws, 'z', (1, 1), side_bc='fs', pressure_driven=True,
+                                                            solver_type='direct', display_iter=0, method='fv')
+        k_analytical = 10 ** 2 / 12. * 10. / 12. * 1e-12
+        np.testing.assert_allclose(keff[2], k_analytical, rtol=0.02)
+        np.testing.assert_allclose(keff[:2], 0, atol=1e-8 * k_analytical)
+
+        # linear pressure between the inlet and outlet, one voxel outside the domain
+        np.testing.assert_allclose(pressure[5, 2], 1 - (np.arange(8) + 1) / 9., atol=1e-8)
+
+
+if __name__ == '__main__':
+    unittest.main()
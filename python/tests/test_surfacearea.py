@@ -1,7 +1,7 @@
 import unittest
 import numpy as np
 import pumapy as puma
-from skimage import io
+from skimage import io, measure
 
 
 class TestSurfacearea(unittest.TestCase):
@@ -13,6 +13,28 @@ class TestSurfacearea(unittest.TestCase):
         np.testing.assert_almost_equal(area, 4.12090e-7, decimal=5)
         np.testing.assert_almost_equal(specific_area, 52291.746, decimal=3)
 
+    def test_partial_volume(self):
+        ws = puma.Workspace.from_array(io.imread("testdata/100_FiberForm.tif"))
+        vf, area, specific_area, slabs = puma.compute_partial_volume(ws, (90, 255), workers=1)
+        vf_slabs, area_slabs, _, slabs_threads = puma.compute_partial_volume(ws, (90, 255), workers=3,
+                                                                             slab_voxels=2 ** 16)
+        self.assertAlmostEqual(vf, vf_slabs)
+        self.assertAlmostEqual(area / area_slabs, 1)
+        self.assertEqual(slabs_threads.shape[0], 17)
+        self.assertAlmostEqual(np.sum(slabs_threads['area']) / area, 1)
+
+        # same area as the marching cubes mesh
+        matrix = ws.matrix.astype(float)
+        matrix[matrix > 172.5] = 345 - matrix[matrix > 172.5]
+        verts, faces = measure.marching_cubes(matrix, 89.5, method='lorensen')[:2]
+        np.testing.assert_allclose(area, measure.mesh_surface_area(verts, faces) * ws.voxel_length ** 2, rtol=1e-5)
+        self.assertAlmostEqual(specific_area, area / (99 ** 3 * ws.voxel_length ** 3))
+
+        # sub-voxel volume fraction close to the voxel count, which is recovered on a segmented domain
+        self.assertAlmostEqual(vf, puma.compute_volume_fraction(ws, (90, 255)), delta=0.01)
+        ws.binarize_range((90, 255))
+        self.assertAlmostEqual(puma.compute_partial_volume(ws, (1, 1))[0], puma.compute_volume_fraction(ws, (1, 1)))
+
 
 if __name__ == '__main__':
     unittest.main()
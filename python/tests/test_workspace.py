@@ -193,6 +193,40 @@ class TestWorkspace(unittest.TestCase):
         self.ws.binarize(128)
         np.testing.assert_equal(self.ws.orientation, test)
 
+    def test_encode_orientation(self):
+        np.random.seed(0)
+        orientation = np.random.randn(10, 11, 12, 3)
+        orientation /= np.linalg.norm(orientation, axis=3)[:, :, :, np.newaxis]
+        orientation[0, 0, 0] = 0
+        orientation[0, 0, 1] = (0, 0, -1)
+        self.ws.set_orientation(orientation)
+        self.ws.encode_orientation()
+        self.assertEqual(self.ws.orientation.dtype, np.uint16)
+        self.assertEqual(self.ws.orientation.shape, (10, 11, 12, 2))
+        self.assertTrue(self.ws.orientation_is_encoded())
+        self.ws.decode_orientation()
+        np.testing.assert_equal(self.ws.orientation[0, 0, 0], 0)
+        np.testing.assert_allclose(self.ws.orientation, orientation, atol=1e-4)
+
+    def test_rotate_orientation(self):
+        from scipy.ndimage import rotate
+        np.random.seed(0)
+        matrix = np.random.randint(0, 255, (10, 11, 12)).astype(np.uint16)
+        ws = puma.Workspace.from_array(matrix)
+        ws.orientation = np.tile([1., 0, 0], (10, 11, 12, 1))
+        ws.rotate(90, 'z', reshape=True)
+        np.testing.assert_equal(ws.matrix, rotate(matrix, 90, axes=(0, 1), reshape=True, order=0))
+        np.testing.assert_allclose(ws.orientation, np.tile([0, 1., 0], (11, 10, 12, 1)), atol=1e-12)
+
+        # matrix and orientation resampled with the same nearest neighbor mapping
+        ws = puma.Workspace.from_array(matrix)
+        ws.orientation = np.zeros((10, 11, 12, 3))
+        ws.orientation[..., 1] = matrix
+        ws.rotate(33, 'x', boundary_mode='constant')
+        np.testing.assert_equal(ws.matrix, rotate(matrix, 33, axes=(1, 2), reshape=False, mode='constant', order=0))
+        np.testing.assert_allclose(ws.orientation[..., 1], ws.matrix * np.cos(np.radians(33)))
+        np.testing.assert_allclose(ws.orientation[..., 2], ws.matrix * np.sin(np.radians(33)))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -22,8 +22,6 @@ class CleanCommand(Command):
 try:
     from Cython.Build import cythonize
     extensions = cythonize([
-                            Extension("pumapy.generation.tpms_utils",
-                                      ["python/pumapy/generation/tpms_utils.pyx"]),
                             Extension("pumapy.physicsmodels.isotropic_conductivity_utils",
                                       ["python/pumapy/physicsmodels/isotropic_conductivity_utils.pyx"]),
                             Extension("pumapy.physicsmodels.anisotropic_conductivity_utils",
@@ -33,8 +31,6 @@ try:
                             ])
 except ImportError:
     extensions = [
-                  Extension("pumapy.generation.tpms_utils",
-                            ["python/pumapy/generation/tpms_utils.c"]),
                   Extension("pumapy.physicsmodels.isotropic_conductivity_utils",
                             ["python/pumapy/physicsmodels/isotropic_conductivity_utils.c"]),
                   Extension("pumapy.physicsmodels.anisotropic_conductivity_utils",